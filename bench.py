@@ -0,0 +1,554 @@
+#!/usr/bin/env python
+"""Performance benchmarks.
+
+Usage: bench.py <benchmark> [options...]
+Run without arguments to list available benchmarks."""
+import sys
+import os
+import glob
+import time
+from cStringIO import StringIO
+from functools import partial
+
+from lexer import tokenize
+from parse import IRParser
+from pllvm import IRRenderer, PInstruction, Opcode
+from ptypes import PType
+import serialize
+from columnar import pack_module, ColumnarFunction
+
+
+DATADIR = os.path.dirname(os.path.abspath(__file__)) + "/tests/data/"
+
+
+def synth_func(name, blocks, insts):
+    """Generate textual IR for a function with a chain of self-looping
+    blocks, each having given number of arithmetic instructions."""
+    out = []
+    out.append("define i32 @%s(i32 %%a, i32 %%b) nounwind {" % name)
+    out.append("entry:")
+    out.append("  br label %b0")
+    prev_b = "entry"
+    prev = "a"
+    for b in xrange(blocks):
+        out.append("")
+        out.append("b%d:" % b)
+        out.append("  %%p%d = phi i32 [ %%%s, %%%s ], [ %%v%d.%d, %%b%d ]" % (b, prev, prev_b, b, insts - 1, b))
+        v = "p%d" % b
+        for i in xrange(insts):
+            op = ("add", "sub", "mul", "xor")[i % 4]
+            out.append("  %%v%d.%d = %s i32 %%%s, %%b" % (b, i, op, v))
+            v = "v%d.%d" % (b, i)
+        out.append("  %%c%d = icmp slt i32 %%%s, 100" % (b, v))
+        out.append("  br i1 %%c%d, label %%b%d, label %%b%d" % (b, b, b + 1))
+        prev_b = "b%d" % b
+        prev = v
+    out.append("")
+    out.append("b%d:" % blocks)
+    out.append("  ret i32 %%%s" % prev)
+    out.append("}")
+    return "\n".join(out) + "\n"
+
+
+def synth_loops(depth, insts):
+    """Generate textual IR (not in SSA form) for a function with loop
+    nest of given depth. Each loop has a counter, used in the innermost
+    body, which has given number of instructions."""
+    out = []
+    out.append("define i32 @loops(i32 %n) {")
+    out.append("entry:")
+    out.append("  %s = mov i32 0")
+    out.append("  %i0 = mov i32 0")
+    out.append("  br label %h0")
+    for k in xrange(depth):
+        out.append("")
+        out.append("h%d:" % k)
+        out.append("  %%c%d = icmp slt i32 %%i%d, %%n" % (k, k))
+        # Loop preheader initializes counter of the inner loop
+        inner = "p%d" % k if k + 1 < depth else "body"
+        out.append("  br i1 %%c%d, label %%%s, label %%e%d" % (k, inner, k))
+        if k + 1 < depth:
+            out.append("")
+            out.append("p%d:" % k)
+            out.append("  %%i%d = mov i32 0" % (k + 1))
+            out.append("  br label %%h%d" % (k + 1))
+    out.append("")
+    out.append("body:")
+    v = "s"
+    for i in xrange(insts):
+        out.append("  %%t%d = add i32 %%%s, %%i%d" % (i, v, i % depth))
+        v = "t%d" % i
+    out.append("  %%s = mov i32 %%%s" % v)
+    out.append("  br label %%l%d" % (depth - 1))
+    for k in xrange(depth - 1, -1, -1):
+        out.append("")
+        out.append("l%d:" % k)
+        out.append("  %%i%d = add i32 %%i%d, 1" % (k, k))
+        out.append("  br label %%h%d" % k)
+        out.append("")
+        out.append("e%d:" % k)
+        if k:
+            out.append("  br label %%l%d" % (k - 1))
+        else:
+            out.append("  ret i32 %s")
+    out.append("}")
+    return "\n".join(out) + "\n"
+
+
+def synth_wide(temps):
+    """Generate textual IR (not in SSA form) for a function with given
+    number of temporaries, all live through a loop."""
+    out = []
+    out.append("define i32 @wide(i32 %a, i32 %n) {")
+    out.append("entry:")
+    for k in xrange(temps):
+        out.append("  %%v%d = add i32 %%a, %d" % (k, k))
+    out.append("  %s = mov i32 0")
+    out.append("  %i = mov i32 0")
+    out.append("  br label %loop")
+    out.append("")
+    out.append("loop:")
+    for k in xrange(temps):
+        out.append("  %%s = add i32 %%s, %%v%d" % k)
+    out.append("  %i = add i32 %i, 1")
+    out.append("  %c = icmp slt i32 %i, %n")
+    out.append("  br i1 %c, label %loop, label %exit")
+    out.append("")
+    out.append("exit:")
+    out.append("  ret i32 %s")
+    out.append("}")
+    return "\n".join(out) + "\n"
+
+
+def synth_tree(depth, temps=8):
+    """Generate textual IR (not in SSA form) for a function with binary
+    tree of branches of given depth (so 2^(depth+1) blocks), updating
+    given number of variables."""
+    out = []
+    out.append("define i32 @tree(i32 %a, i32 %n) {")
+    out.append("entry:")
+    for t in xrange(temps):
+        out.append("  %%x%d = add i32 %%a, %d" % (t, t))
+    out.append("  br label %n1")
+    for k in xrange(1, 2 ** (depth + 1)):
+        out.append("")
+        out.append("n%d:" % k)
+        t = k % temps
+        out.append("  %%x%d = add i32 %%x%d, %%x%d" % (t, t, (t + 1) % temps))
+        if k < 2 ** depth:
+            out.append("  %%c = icmp slt i32 %%x%d, %%n" % t)
+            out.append("  br i1 %%c, label %%n%d, label %%n%d" % (2 * k, 2 * k + 1))
+        else:
+            out.append("  ret i32 %%x%d" % t)
+    out.append("}")
+    return "\n".join(out) + "\n"
+
+
+def synth_module(funcs=1, blocks=100, insts=10):
+    "Generate textual IR for a module of synthetic functions."
+    out = ["; ModuleID = 'synth'", "", "@g = common global i32 0", ""]
+    for f in xrange(funcs):
+        out.append(synth_func("f%d" % f, blocks, insts))
+    return "\n".join(out)
+
+
+def best_time(func, repeat=3):
+    best = None
+    for i in xrange(repeat):
+        t = time.time()
+        func()
+        t = time.time() - t
+        if best is None or t < best:
+            best = t
+    return best
+
+
+class NullOut(object):
+    def write(self, s):
+        pass
+
+
+def lex_all(text):
+    for l in StringIO(text):
+        tokenize(l, 0, len(l) - 1)
+
+
+def parse_all(text):
+    IRParser(StringIO(text)).parse()
+
+
+def load_regex_parser():
+    """Return old regex-based IRParser class, loaded from git history
+    (parse.py as it was before lexer.py was added), or None if history
+    isn't available."""
+    import subprocess
+    root = os.path.dirname(os.path.abspath(__file__))
+    devnull = open(os.devnull, "w")
+    try:
+        revs = subprocess.check_output(
+            ["git", "log", "--diff-filter=A", "--format=%H", "--", "lexer.py"],
+            cwd=root, stderr=devnull).split()
+        if not revs:
+            return None
+        name = revs[-1] + "^:parse.py"
+        src = subprocess.check_output(["git", "show", name], cwd=root, stderr=devnull)
+    except (OSError, subprocess.CalledProcessError):
+        return None
+    namespace = {"__name__": "parse_regex"}
+    exec compile(src, name, "exec") in namespace
+    return namespace["IRParser"]
+
+
+def regex_supported(text):
+    "Check if old regex-based parser can handle text (it doesn't know pointer types)."
+    return "*" not in text
+
+
+def parse_regex_all(parser, text):
+    # Old parser has debug prints, don't let them skew results
+    stdout = sys.stdout
+    sys.stdout = NullOut()
+    try:
+        parser(StringIO(text)).parse()
+    finally:
+        sys.stdout = stdout
+
+
+def render_print(mod, out):
+    "Render functions the way it was done before buffered renderer."
+    for f in mod:
+        if f.is_declaration:
+            continue
+        print >>out, str(f) + " {"
+        last_b = None
+        for b in f:
+            if last_b: print >>out
+            print >>out, "%s:" % b.name
+            for i in b:
+                print >>out, i.render()
+            last_b = b
+        print >>out, "}"
+
+
+def drop_texts(mod):
+    for f in mod:
+        for i in f.iter_insts():
+            i.dirty()
+
+
+def bench_parse(args):
+    """Parser throughput (MB/s) of lexer alone, IRParser and old
+    regex-based parser (if it can be loaded from git history) on
+    tests/data files and synthetic modules."""
+    regex_parser = load_regex_parser()
+    inputs = []
+    for fname in sorted(glob.glob(DATADIR + "*.ll*")):
+        inputs.append((os.path.basename(fname), open(fname).read()))
+    for funcs in (10, 100):
+        inputs.append(("synth-%d" % funcs, synth_module(funcs, 100, 10)))
+
+    print "%-28s %10s %10s %10s %10s" % ("input", "size", "lex", "parse", "regex")
+    for name, text in inputs:
+        # Small inputs are repeated to get measurable times
+        repeat = max(1, 1000000 / len(text))
+        res = []
+        for func in (lex_all, parse_all, partial(parse_regex_all, regex_parser)):
+            if func.__class__ is partial and (regex_parser is None or not regex_supported(text)):
+                res.append("n/a")
+                continue
+            t = best_time(lambda: [func(text) for i in xrange(repeat)])
+            res.append("%.2f" % (len(text) * repeat / t / 1e6))
+        print "%-28s %10d %10s %10s %10s" % ((name, len(text)) + tuple(res))
+
+
+def bench_serialize(args):
+    """Size and save/load times (ms) of binary format vs IR text
+    roundtrip (render and parse)."""
+    inputs = []
+    for fname in sorted(glob.glob(DATADIR + "*.ll")):
+        inputs.append((os.path.basename(fname), open(fname).read()))
+    for funcs in (10, 100):
+        inputs.append(("synth-%d" % funcs, synth_module(funcs, 100, 10)))
+
+    print "%-28s %9s %9s %9s %9s %9s %9s" % (
+        "input", "text", "binary", "render", "parse", "dump", "load")
+    for name, text in inputs:
+        mod = IRParser(StringIO(text)).parse()
+        out = StringIO()
+        IRRenderer.render(mod, out)
+        text = out.getvalue()
+        out = StringIO()
+        serialize.dump(mod, out)
+        binary = out.getvalue()
+        times = [
+            best_time(lambda: IRRenderer.render(mod, StringIO())),
+            best_time(lambda: IRParser(StringIO(text)).parse()),
+            best_time(lambda: serialize.dump(mod, StringIO())),
+            best_time(lambda: serialize.load(StringIO(binary))),
+        ]
+        print "%-28s %9d %9d %9.1f %9.1f %9.1f %9.1f" % (
+            (name, len(text), len(binary)) + tuple(t * 1000 for t in times))
+
+
+def bench_render(args):
+    """Renderer throughput (lines/s) on synthetic module: printing each
+    line, buffered with texts rendered anew (cold) and cached (warm),
+    and in parallel (cold). Args are number of instructions (1M by
+    default) and of parallel workers (number of CPUs by default)."""
+    insts = int(args[0]) if args else 1000000
+    workers = int(args[1]) if len(args) > 1 else None
+    # Each block has phi, icmp and br besides arithmetic instructions
+    funcs = max(1, insts / (100 * 101))
+    mod = IRParser(StringIO(synth_module(funcs, 100, 98))).parse()
+    insts = sum(len(b) for f in mod for b in f)
+    out = StringIO()
+    IRRenderer.render(mod, out)
+    lines = out.getvalue().count("\n")
+
+    def cold(render=IRRenderer.render, **kwargs):
+        drop_texts(mod)
+        t = time.time()
+        render(mod, null, **kwargs)
+        return time.time() - t
+
+    null = open(os.devnull, "w")
+    times = [
+        best_time(lambda: render_print(mod, null)),
+        min(cold() for i in xrange(3)),
+        best_time(lambda: IRRenderer.render(mod, null)),
+        min(cold(IRRenderer.render_parallel, workers=workers) for i in xrange(3)),
+    ]
+    print "%-10s %10s %12s %12s %12s %12s" % ("insts", "lines", "print", "cold", "warm", "parallel")
+    print "%-10d %10d %12.0f %12.0f %12.0f %12.0f" % ((insts, lines) + tuple(lines / t for t in times))
+
+
+def bench_liveness(args):
+    """Liveness analysis time (ms) on loop nests of growing depth:
+    instruction-level round-robin solver vs block-level worklist one,
+    with sets and bitsets. Then time and memory (KB of live-out sets) of
+    set vs bitset variant on functions with many live temporaries. Then
+    time of worklist vs NumPy backend (with bitsets) on functions with
+    many blocks: of whole analysis, also with NumPy backend on columnar
+    function, and of block-level solver alone.
+    Args are depths, 2 4 8 16 32 by default."""
+    from liveness import Liveness, InstLiveness, BitLiveness
+    from cfg import get_cfg
+    import dataflow
+
+    def bits_map(func):
+        l = BitLiveness(func)
+        return Liveness.live_out_map(l)
+
+    depths = [int(a) for a in args] or [2, 4, 8, 16, 32]
+    print "%-8s %8s %10s %10s %10s" % ("depth", "insts", "inst", "block", "bits")
+    for depth in depths:
+        func = IRParser(StringIO(synth_loops(depth, 50))).parse()[0]
+        insts = sum(len(b) for b in func)
+        times = [
+            best_time(lambda: InstLiveness(func).live_out_map()),
+            best_time(lambda: Liveness(func).live_out_map()),
+            best_time(lambda: bits_map(func)),
+        ]
+        print "%-8d %8d %10.1f %10.1f %10.1f" % ((depth, insts) + tuple(t * 1000 for t in times))
+
+    print
+    print "%-8s %8s %10s %10s %10s %10s" % ("temps", "insts", "sets", "bits", "sets KB", "bits KB")
+    for temps in (250, 500, 1000, 2000):
+        func = IRParser(StringIO(synth_wide(temps))).parse()[0]
+        insts = sum(len(b) for b in func)
+        times = []
+        sizes = []
+        for make in (lambda: Liveness(func).live_out_map(), lambda: bits_map(func)):
+            times.append(best_time(make, 1) * 1000)
+            # Names are shared by all sets, so not counted
+            sizes.append(sum(sys.getsizeof(s) for s in make().itervalues()) / 1024)
+        print "%-8d %8d %10.1f %10.1f %10d %10d" % ((temps, insts) + tuple(times + sizes))
+
+    if not dataflow.numpy:
+        return
+    print
+    print "%-8s %8s %10s %10s %10s %10s %10s" % ("blocks", "insts", "worklist", "numpy",
+                                                "columnar", "solve", "solve np")
+    for depth in (10, 13, 15):
+        text = synth_tree(depth)
+        func = IRParser(StringIO(text)).parse()[0]
+        insts = sum(len(b) for b in func)
+        columnar = ColumnarFunction.from_function(IRParser(StringIO(text)).parse()[0])
+        # Make CFG cached for both
+        get_cfg(func)
+        times = [best_time(lambda: BitLiveness(func, backend=backend)) * 1000
+                 for backend in Liveness.BACKENDS]
+        times.append(best_time(lambda: BitLiveness(columnar, backend="numpy")) * 1000)
+        l = BitLiveness(func)
+
+        def solve():
+            for b in l._live_in:
+                l._live_in[b] = 0
+            l.solve()
+
+        times.append(best_time(solve) * 1000)
+        gen, kill = dataflow.columnar_gen_kill(columnar)
+        start, index = dataflow.columnar_successors(columnar)
+        times.append(best_time(lambda: dataflow.solve_csr(gen, kill, start, index)) * 1000)
+        print "%-8d %8d %10.1f %10.1f %10.1f %10.1f %10.1f" % (
+            (len(func.bblocks), insts) + tuple(times))
+
+
+def bench_convert(args):
+    """Time (ms) of converting llvmpy modules in text-based and fast
+    IRConverter modes. Args are .ll files or C sources (compiled with
+    clang -O2), by default tests/data/*.c."""
+    import subprocess
+    from llvm.core import Module
+    from llvm2py import IRConverter
+
+    if not args:
+        args = sorted(glob.glob(DATADIR + "*.c"))
+    print "%-28s %9s %9s %9s" % ("input", "size", "text", "fast")
+    for fname in args:
+        if fname.endswith(".c"):
+            text = subprocess.check_output(["clang", "-O2", "-S", "-emit-llvm", "-o", "-", fname])
+        else:
+            text = open(fname).read()
+        times = []
+        for fast in (False, True):
+            # Converter names temporaries in place, so use fresh module
+            mods = [Module.from_assembly(StringIO(text)) for i in xrange(3)]
+            times.append(best_time(lambda: IRConverter.convert(mods.pop(), fast=fast)))
+        print "%-28s %9d %9.1f %9.1f" % (
+            (os.path.basename(fname), len(text)) + tuple(t * 1000 for t in times))
+
+
+class Plain(object):
+    "Object with per-instance dict, like IR objects before slotting."
+
+
+def is_shared(obj):
+    "Check if object is interned, so not owned by any module."
+    return isinstance(obj, (type, PType, Opcode))
+
+
+def plain_attrs(obj):
+    "Return attributes of an IR object as they'd be in its __dict__."
+    if hasattr(obj, "__dict__"):
+        return obj.__dict__
+    d = {}
+    for cls in type(obj).__mro__:
+        for name in getattr(cls, "__slots__", ()):
+            if name != "_extra" and hasattr(obj, name):
+                d[name] = getattr(obj, name)
+    if isinstance(obj, PInstruction):
+        # These used to be always set
+        d.update(comment=None, metadata=None, alignment=None)
+    d.update(getattr(obj, "_extra", None) or {})
+    return d
+
+
+def unslot(root):
+    """Return copy of an object graph, where slotted objects are replaced
+    with ordinary objects having the same attributes in __dict__."""
+    copies = {}
+    order = []
+    stack = [root]
+    while stack:
+        obj = stack.pop()
+        if id(obj) in copies or is_shared(obj):
+            continue
+        if isinstance(obj, (list, tuple)):
+            copies[id(obj)] = []
+            stack.extend(obj)
+        elif isinstance(obj, dict):
+            copies[id(obj)] = {}
+            stack.extend(obj.values())
+        elif hasattr(type(obj), "__slots__") or hasattr(obj, "__dict__"):
+            copies[id(obj)] = Plain()
+            stack.extend(plain_attrs(obj).values())
+        else:
+            continue
+        order.append(obj)
+
+    def copy(x):
+        return copies.get(id(x), x)
+
+    # Tuples are immutable, so make them first, from the innermost
+    for obj in reversed(order):
+        if isinstance(obj, tuple):
+            copies[id(obj)] = tuple([copy(x) for x in obj])
+    for obj in order:
+        res = copies[id(obj)]
+        if isinstance(obj, list):
+            res.extend([copy(x) for x in obj])
+        elif isinstance(obj, dict):
+            for k, v in obj.iteritems():
+                res[k] = copy(v)
+        elif isinstance(res, Plain):
+            res.__dict__ = dict((k, copy(v)) for k, v in plain_attrs(obj).iteritems())
+    return copies[id(root)]
+
+
+def graph_size(root):
+    """Total size in bytes of objects reachable from root. Interned
+    objects shared between modules (types, opcodes) are not counted."""
+    seen = set()
+    stack = [root]
+    size = 0
+    while stack:
+        obj = stack.pop()
+        if id(obj) in seen or is_shared(obj) or obj is None:
+            continue
+        seen.add(id(obj))
+        size += sys.getsizeof(obj)
+        if isinstance(obj, (list, tuple, set, frozenset)):
+            stack.extend(obj)
+        elif isinstance(obj, dict):
+            stack.extend(obj.keys())
+            stack.extend(obj.values())
+        else:
+            if hasattr(obj, "__dict__"):
+                stack.append(obj.__dict__)
+            for cls in type(obj).__mro__:
+                for name in getattr(cls, "__slots__", ()):
+                    stack.append(getattr(obj, name, None))
+    return size
+
+
+def bench_memory(args):
+    """Memory use (bytes per instruction) of parsed IR with compact
+    (slotted) objects, with per-instance dicts, and in columnar
+    storage."""
+    inputs = []
+    for fname in sorted(glob.glob(DATADIR + "*.ll")):
+        inputs.append((os.path.basename(fname), open(fname).read()))
+    for funcs in (10, 100):
+        inputs.append(("synth-%d" % funcs, synth_module(funcs, 100, 10)))
+
+    print "%-28s %9s %9s %9s %9s" % ("input", "insts", "dict", "slots", "columns")
+    for name, text in inputs:
+        mod = IRParser(StringIO(text)).parse()
+        insts = sum(len(b) for f in mod for b in f)
+        if not insts:
+            continue
+        sizes = [graph_size(unslot(mod)), graph_size(mod)]
+        pack_module(mod)
+        sizes.append(graph_size(mod))
+        print "%-28s %9d %9.1f %9.1f %9.1f" % (
+            (name, insts) + tuple(float(s) / insts for s in sizes))
+
+
+BENCHMARKS = {
+    "parse": bench_parse,
+    "serialize": bench_serialize,
+    "convert": bench_convert,
+    "render": bench_render,
+    "liveness": bench_liveness,
+    "memory": bench_memory,
+}
+
+
+if __name__ == "__main__":
+    if len(sys.argv) < 2 or sys.argv[1] not in BENCHMARKS:
+        print __doc__
+        for name, func in sorted(BENCHMARKS.items()):
+            print "%-12s %s" % (name, func.__doc__.split("\n")[0])
+        sys.exit(1)
+    BENCHMARKS[sys.argv[1]](sys.argv[2:])
@@ -0,0 +1,129 @@
+"""Control-flow graph of basic blocks.
+
+CFG of a function is built on demand by get_cfg() and cached on the
+function. The cache is invalidated by changes of the function's block
+list, by adding or removing terminator instructions and by setting
+their label operands with set_operand() (tracked by
+PFunction.cfg_version). If branch targets are changed otherwise in
+place, call invalidate() explicitly."""
+from pllvm import *
+
+
+class CFG(object):
+
+    def __init__(self, func):
+        self.blocks = list(func)
+        self.entry = self.blocks[0] if self.blocks else None
+        self.succ = {}
+        self.pred = {}
+        for b in self.blocks:
+            self.pred[b] = []
+        for n, b in enumerate(self.blocks):
+            succ = self.succ[b] = []
+            last = b.last
+            if last is not None and last.opcode.terminator:
+                targets = [func[op.name] for op in last.operands if isinstance(op, PLabelRef)]
+            elif n + 1 < len(self.blocks):
+                # Falls through to the next block
+                targets = [self.blocks[n + 1]]
+            else:
+                targets = []
+            for s in targets:
+                if s not in succ:
+                    succ.append(s)
+                    self.pred[s].append(b)
+        self.exits = [b for b in self.blocks if not self.succ[b]]
+        # Taken last, as the above may load function body
+        self.version = func.cfg_version
+
+    def successors(self, block):
+        return self.succ[block]
+
+    def predecessors(self, block):
+        return self.pred[block]
+
+    def edges(self):
+        "Return list of (from, to) block pairs."
+        return [(b, s) for b in self.blocks for s in self.succ[b]]
+
+    def reverse_edges(self):
+        "Return list of (to, from) block pairs."
+        return [(b, p) for b in self.blocks for p in self.pred[b]]
+
+    def postorder(self):
+        "Return blocks reachable from entry, in DFS postorder."
+        res = []
+        if self.entry is None:
+            return res
+        seen = set([self.entry])
+        stack = [(self.entry, iter(self.succ[self.entry]))]
+        while stack:
+            b, it = stack[-1]
+            for s in it:
+                if s not in seen:
+                    seen.add(s)
+                    stack.append((s, iter(self.succ[s])))
+                    break
+            else:
+                stack.pop()
+                res.append(b)
+        return res
+
+    def reverse_postorder(self):
+        return self.postorder()[::-1]
+
+
+def get_cfg(func):
+    "Return CFG of a function, cached while the function doesn't change."
+    cfg = func.__dict__.get("_cfg")
+    if cfg is None or cfg.version != func.cfg_version:
+        cfg = func._cfg = CFG(func)
+    return cfg
+
+
+def invalidate(func):
+    "Drop cached CFG of a function."
+    func.__dict__.pop("_cfg", None)
+
+
+class Dominators(object):
+    """Dominator tree of blocks reachable from entry, computed from CFG
+    by iterative algorithm of Cooper, Harvey and Kennedy."""
+
+    def __init__(self, cfg):
+        order = cfg.reverse_postorder()
+        index = dict((b, n) for n, b in enumerate(order))
+        idom = {}
+        if order:
+            idom[order[0]] = order[0]
+
+        def intersect(a, b):
+            while a is not b:
+                while index[a] > index[b]:
+                    a = idom[a]
+                while index[b] > index[a]:
+                    b = idom[b]
+            return a
+
+        changed = True
+        while changed:
+            changed = False
+            for b in order[1:]:
+                new = None
+                for p in cfg.predecessors(b):
+                    if p in idom:
+                        new = p if new is None else intersect(p, new)
+                if idom.get(b) is not new:
+                    idom[b] = new
+                    changed = True
+        if order:
+            idom[order[0]] = None
+        self.idom = idom
+
+    def dominates(self, a, b):
+        "Check if block a dominates block b."
+        while b is not None:
+            if b is a:
+                return True
+            b = self.idom.get(b)
+        return False
@@ -0,0 +1,278 @@
+"""Struct-of-arrays storage for function bodies.
+
+ColumnarFunction keeps instructions in flat integer columns (array
+module) rather than a graph of PInstruction objects: opcode ids, ids of
+defined values, operands in CSR form (per-instruction start offsets
+into a flat operand index array) and block boundaries. That is all most
+dataflow analyses need, and they can walk the columns (or NumPy arrays
+made of them) for a whole function without touching per-instruction
+objects.
+
+Blocks are still PBasicBlock's, with PInstruction views materialized
+from the columns when block's instructions are first accessed, so code
+working with the object model keeps working. Changes made via views
+(or to the block structure) are written back to columns by pack().
+Users lists of values only have uses by views made so far, so code
+relying on their completeness (replace_all_uses_with(), erase()) makes
+all views first."""
+from array import array
+
+from pllvm import *
+
+try:
+    import numpy
+except ImportError:
+    numpy = None
+
+
+# Marks instruction without result
+NO_VALUE = -1
+
+
+class ColumnarBlock(PBasicBlock):
+    """Basic block of ColumnarFunction, materializing its instructions
+    on first access."""
+
+    def __init__(self, func, label, row, end):
+        self.parent = func
+        self.name = label
+        # Range of block's instructions (rows) in function's columns
+        self.row = row
+        self.end = end
+
+    def materialized(self):
+        return "count" in self.__dict__
+
+    def __getattr__(self, name):
+        # Called only for missing attributes, so free once materialized
+        if name in ("first", "last", "count"):
+            f = self.parent
+            # Not a change of function
+            version = f.cfg_version
+            insts = f.make_views(self)
+            PBasicBlock.__init__(self, f, self.name)
+            for i in insts:
+                self.append(i)
+            f.cfg_version = version
+            return getattr(self, name)
+        raise AttributeError(name)
+
+
+class ColumnarFunction(PFunction):
+    """PFunction with body stored in columns. Instructions are numbered
+    (as rows) consecutively over the function, values are referred to
+    by their ids (see PFunction.value())."""
+
+    @classmethod
+    def from_function(cls, func):
+        """Make columnar function from an ordinary one. Value objects
+        are shared with the original function, which shouldn't be used
+        after that."""
+        self = cls()
+        for k, v in func.__dict__.items():
+            # Cached CFG is of the original blocks
+            if k not in ("bblocks", "_body_loader", "_cfg"):
+                self.__dict__[k] = v
+        self.bblocks = func.bblocks
+        self.pack()
+        return self
+
+    def pack(self):
+        """(Re)build columns from current blocks and instructions, and
+        drop instruction views."""
+        for b in self.bblocks:
+            for i in b:
+                if i.name and i.name not in self.values:
+                    self.value(i.name, i.type)
+        # Operand table: each value at index of its id, followed by other
+        # operand objects (constants, globals, labels, and uses of values
+        # with own attributes or type)
+        table = [None] * len(self.values)
+        for v in self.values.itervalues():
+            table[v.id] = v
+        table_index = {}
+        opcodes = array("H")
+        results = array("i")
+        types = []
+        op_start = array("i")
+        op_index = array("i")
+        # Phi incoming values (indexes into table) and labels, in CSR form
+        # too, rather than in per-instruction lists of tuples
+        inc_start = array("i")
+        inc_index = array("i")
+        inc_labels = []
+        block_start = array("i")
+        # Other optional attributes, equal sets of them share a dict (views
+        # get copies)
+        extra = {}
+        extras = {}
+        blocks = []
+
+        def table_slot(op):
+            op_id = getattr(op, "id", None)
+            if op_id is not None and table[op_id] is op:
+                return op_id
+            k = table_index.get(id(op))
+            if k is None:
+                k = table_index[id(op)] = len(table)
+                table.append(op)
+            return k
+
+        for b in self.bblocks:
+            block_start.append(len(opcodes))
+            for i in b:
+                n = len(opcodes)
+                opcodes.append(i.opcode.id)
+                if i.name:
+                    results.append(self.values[i.name].id)
+                else:
+                    results.append(NO_VALUE)
+                types.append(i.type)
+                op_start.append(len(op_index))
+                for op in i.operands:
+                    op_index.append(table_slot(op))
+                inc_start.append(len(inc_index))
+                if i._extra:
+                    e = dict(i._extra)
+                    for v, l in e.pop("incoming_vars", None) or ():
+                        inc_index.append(table_slot(v))
+                        inc_labels.append(intern(l))
+                    if e:
+                        try:
+                            e = extras.setdefault(frozenset(e.iteritems()), e)
+                        except TypeError:
+                            # Unhashable attribute value
+                            pass
+                        extra[n] = e
+            blocks.append(ColumnarBlock(self, b.name, block_start[-1], len(opcodes)))
+            blocks[-1].comment = getattr(b, "comment", None)
+        op_start.append(len(op_index))
+        inc_start.append(len(inc_index))
+        block_start.append(len(opcodes))
+
+        # Value id of each operand table entry, or NO_VALUE
+        table_ids = array("i", [NO_VALUE]) * len(table)
+        for k, op in enumerate(table):
+            op_id = getattr(op, "id", None)
+            if op_id is not None:
+                table_ids[k] = op_id
+        for v in self.values.itervalues():
+            # Will be linked to views when they're materialized, until then
+            # users lists are incomplete
+            v.definition = None
+            v.users = PendingUsers()
+            v.users.owner = self
+        for op in table[len(self.values):]:
+            if getattr(op, "id", None) is not None:
+                # Separate use object shares users list of the value
+                op.users = table[op.id].users
+
+        self.table = table
+        self.table_ids = table_ids
+        self.opcodes = opcodes
+        self.results = results
+        self.types = types
+        self.op_start = op_start
+        self.op_index = op_index
+        self.inc_start = inc_start
+        self.inc_index = inc_index
+        self.inc_labels = inc_labels
+        self.block_start = block_start
+        self.extra = extra
+        self.bblocks = blocks
+        self._blocks = SymbolTable()
+        self._insts = {}
+        self.cfg_version += 1
+
+    def make_views(self, b):
+        "Make PInstruction views for instructions of a block."
+        table = self.table
+        op_index = self.op_index
+        insts = []
+        inc_start = self.inc_start
+        for n in xrange(b.row, b.end):
+            r = self.results[n]
+            v = None if r == NO_VALUE else table[r]
+            # Each view gets own copy of optional attributes
+            extra = dict(self.extra.get(n, ()))
+            start, end = inc_start[n], inc_start[n + 1]
+            if start != end:
+                extra["incoming_vars"] = [(table[k], l) for k, l in zip(
+                    self.inc_index[start:end], self.inc_labels[start:end])]
+            i = PInstruction(v and v.name, self.types[n], OPCODES[self.opcodes[n]].name,
+                             [table[k] for k in op_index[self.op_start[n]:self.op_start[n + 1]]],
+                             **extra)
+            if v is not None:
+                v.definition = i
+            insts.append(i)
+        return insts
+
+    def materialize(self):
+        """Make views of all instructions, so users lists of values are
+        complete again (see PendingUsers)."""
+        for b in self.bblocks:
+            b.first
+        for v in self.values.itervalues():
+            if v.users.__class__ is PendingUsers:
+                v.users = list(v.users)
+        for op in self.table[len(self.values):]:
+            if getattr(op, "id", None) is not None:
+                op.users = self.table[op.id].users
+
+    def users(self, v):
+        self.materialize()
+        return PFunction.users(self, v)
+
+    def defs(self, n):
+        "Return list of ids of values defined by instruction n."
+        r = self.results[n]
+        if r == NO_VALUE:
+            return []
+        return [r]
+
+    def uses(self, n):
+        "Return list of ids of values used by instruction n."
+        table_ids = self.table_ids
+        res = []
+        for k in self.op_index[self.op_start[n]:self.op_start[n + 1]]:
+            v = table_ids[k]
+            if v != NO_VALUE:
+                res.append(v)
+        return res
+
+    def succ_rows(self):
+        """Return successors of each instruction, as (start, index)
+        arrays in CSR form, like operands."""
+        block_rows = {}
+        for b in self.bblocks:
+            block_rows[b.name] = b.row
+        start = array("i")
+        index = array("i")
+        last = len(self.opcodes) - 1
+        for n in xrange(len(self.opcodes)):
+            start.append(len(index))
+            if OPCODES[self.opcodes[n]].terminator:
+                for k in self.op_index[self.op_start[n]:self.op_start[n + 1]]:
+                    op = self.table[k]
+                    if isinstance(op, PLabelRef):
+                        index.append(block_rows[op.name])
+            elif n < last:
+                index.append(n + 1)
+        start.append(len(index))
+        return start, index
+
+    def numpy_columns(self):
+        "Return dict of columns as NumPy arrays (sharing memory)."
+        assert numpy, "NumPy is not available"
+        res = {}
+        for name in ("opcodes", "results", "op_start", "op_index", "block_start", "table_ids"):
+            col = getattr(self, name)
+            res[name] = numpy.frombuffer(col, dtype=numpy.dtype(col.typecode))
+        return res
+
+
+def pack_module(mod):
+    "Convert all defined functions of a module to columnar storage."
+    for f in list(mod.functions):
+        if not f.is_declaration:
+            mod.replace(f, ColumnarFunction.from_function(f))
@@ -0,0 +1,352 @@
+"""Bit-vector dataflow problems solved with NumPy.
+
+Sets of facts of all blocks are rows of a matrix of packed uint64 words,
+and flow edges are in CSR form (per-block start offsets into a flat
+array of block numbers). Each iteration of the solver then processes
+all blocks at once, with a few batched bitwise operations, instead of
+a Python loop over blocks.
+
+The solver is generic: liveness (see liveness.Liveness with
+backend="numpy"), reaching definitions and available expressions below
+are all expressed with it. For liveness of a columnar function (see
+columnar.py), the per-block gen/kill sets and flow edges are also built
+from its columns with NumPy, rather than by walking instructions.
+NumPy is optional, only this module needs it."""
+from pllvm import *
+from cfg import get_cfg
+from columnar import ColumnarFunction, NO_VALUE
+
+try:
+    import numpy
+except ImportError:
+    numpy = None
+
+
+# Opcodes of instructions computing expressions without side effects
+EXPR_OPCODES = frozenset(get_opcode(name) for name in (
+    "add", "sub", "mul", "udiv", "sdiv", "urem", "srem", "shl", "lshr",
+    "ashr", "and", "or", "xor", "select", "getelementptr", "icmp"))
+
+
+def words(nbits):
+    "Return number of uint64 words to hold nbits."
+    return max(1, (nbits + 63) / 64)
+
+
+def pack(rows, nbits):
+    "Make bit matrix from list of lists of bit numbers."
+    assert numpy, "NumPy is not available"
+    r = []
+    bits = []
+    for n, row in enumerate(rows):
+        r.extend([n] * len(row))
+        bits.extend(row)
+    return pack_pairs(numpy.array(r, dtype=numpy.intp), numpy.array(bits, dtype=numpy.intp),
+                      len(rows), nbits)
+
+
+def pack_pairs(rows, bits, nrows, nbits):
+    "Make bit matrix with bits[k] set in row rows[k], for all k."
+    m = numpy.zeros((nrows, words(nbits)), dtype=numpy.uint64)
+    if len(bits):
+        bits = bits.astype(numpy.uint64)
+        numpy.bitwise_or.at(m, (rows, (bits >> 6).astype(numpy.intp)),
+                            numpy.left_shift(numpy.uint64(1), bits & numpy.uint64(63)))
+    return m
+
+
+def unpack(m):
+    "Return list of lists of bit numbers set in rows of bit matrix."
+    res = []
+    for row in m:
+        # Bytes from least significant, bits in each from most significant
+        bits = numpy.unpackbits(row.astype("<u8").view(numpy.uint8)).reshape(-1, 8)[:, ::-1]
+        res.append(numpy.flatnonzero(bits).tolist())
+    return res
+
+
+def ones(nbits):
+    "Return bit matrix row with bits 0..nbits-1 set."
+    row = numpy.zeros(words(nbits), dtype=numpy.uint64)
+    row[:nbits / 64] = ~numpy.uint64(0)
+    if nbits % 64:
+        row[nbits / 64] = (1 << (nbits % 64)) - 1
+    return row
+
+
+WORD_MASK = (1 << 64) - 1
+
+def pack_ints(ints, nbits):
+    "Make bit matrix from list of Python int bitsets."
+    assert numpy, "NumPy is not available"
+    n = words(nbits)
+    m = numpy.zeros((len(ints), n), dtype=numpy.uint64)
+    if not ints:
+        return m
+    for w in xrange(n):
+        shift = 64 * w
+        m[:, w] = [v >> shift & WORD_MASK for v in ints]
+    return m
+
+
+def unpack_ints(m):
+    "Return list of Python int bitsets of rows of bit matrix."
+    n = m.shape[1]
+    res = m[:, n - 1].tolist()
+    for w in xrange(n - 2, -1, -1):
+        res = [v << 64 | low for v, low in zip(res, m[:, w].tolist())]
+    return res
+
+
+def csr(lists, empty):
+    """Convert list of lists of block numbers to (start, index) arrays.
+    Empty lists are replaced with [empty]."""
+    start = []
+    index = []
+    for l in lists:
+        start.append(len(index))
+        index.extend(l or [empty])
+    return numpy.array(start, dtype=numpy.intp), numpy.array(index, dtype=numpy.intp)
+
+
+def solve(gen, kill, inputs, intersect=None):
+    """Solve system of x[b] = gen[b] | (m[b] & ~kill[b]) for all blocks
+    b, where m[b] is union of x[p] for p in inputs[b], empty for blocks
+    without inputs. For a forward problem inputs of block are its
+    predecessors (then m is "in", x is "out"), for a backward one -
+    successors (then m is "out", x is "in"). For "must" problems, where
+    m[b] is intersection instead, intersect is number of facts (bits).
+    Returns (m, x) bit matrices."""
+    assert numpy, "NumPy is not available"
+    # Blocks without inputs get the extra empty row n
+    start, index = csr(inputs, len(gen))
+    return solve_csr(gen, kill, start, index, intersect)
+
+
+def solve_csr(gen, kill, start, index, intersect=None):
+    """Same as solve(), with inputs of blocks already in CSR form,
+    where blocks without inputs have the single input n (number of
+    blocks)."""
+    n = len(gen)
+    meet = numpy.bitwise_or if intersect is None else numpy.bitwise_and
+
+    ext = numpy.zeros((n + 1, gen.shape[1]), dtype=numpy.uint64)
+    notkill = ~kill
+    if intersect is not None:
+        # Start from the top, all facts
+        x = numpy.tile(ones(intersect), (n, 1))
+    else:
+        x = gen.copy()
+    while True:
+        ext[:n] = x
+        m = meet.reduceat(ext[index], start, axis=0)
+        new = gen | (m & notkill)
+        if numpy.array_equal(new, x):
+            return m, x
+        x = new
+
+
+def edges_csr(src, dst, n):
+    """Convert edges (arrays of source and destination block numbers)
+    to CSR (start, index) arrays of destinations of each of n blocks,
+    like csr(). Duplicate edges are dropped."""
+    key = numpy.unique(src * (n + 1) + dst)
+    src = key // (n + 1)
+    dst = key % (n + 1)
+    counts = numpy.bincount(src, minlength=n)
+    empty = numpy.flatnonzero(counts == 0)
+    # Stable sort keeps destinations of each block in order
+    order = numpy.argsort(numpy.concatenate([src, empty]), kind="mergesort")
+    index = numpy.concatenate([dst, numpy.full(len(empty), n, dtype=dst.dtype)])[order]
+    start = numpy.zeros(n, dtype=numpy.intp)
+    numpy.cumsum(numpy.maximum(counts, 1)[:-1], out=start[1:])
+    return start, index
+
+
+def columnar_successors(func):
+    """Return successors of blocks of columnar function, in CSR form
+    (see edges_csr()). Same as CFG's, derived from the columns without
+    materializing instructions: label operands of block's last
+    instruction if it's a terminator, else the next block."""
+    cols = func.numpy_columns()
+    block_start = cols["block_start"]
+    op_start = cols["op_start"]
+    n = len(block_start) - 1
+    pos = dict((b.name, k) for k, b in enumerate(func.bblocks))
+    # Block number of each label in operand table, else -1
+    label_block = numpy.array([pos[op.name] if isinstance(op, PLabelRef) else -1
+                               for op in func.table], dtype=numpy.intp)
+    terminator = numpy.array([op.terminator for op in OPCODES], dtype=bool)
+    blocks = numpy.arange(n)
+    last = block_start[1:] - 1
+    nonempty = block_start[1:] > block_start[:-1]
+    ends = numpy.zeros(n, dtype=bool)
+    ends[nonempty] = terminator[cols["opcodes"][last[nonempty]]]
+    # Operand slots of terminators: op_start of each, repeated for its
+    # operands, plus position among them
+    term = last[ends]
+    counts = op_start[term + 1] - op_start[term]
+    slots = numpy.repeat(op_start[term] - (numpy.cumsum(counts) - counts), counts) + \
+        numpy.arange(counts.sum())
+    src = numpy.repeat(blocks[ends], counts)
+    dst = label_block[cols["op_index"][slots]]
+    src = src[dst >= 0]
+    dst = dst[dst >= 0]
+    # Fall through
+    falls = blocks[~ends & (blocks + 1 < n)]
+    return edges_csr(numpy.concatenate([src, falls]), numpy.concatenate([dst, falls + 1]), n)
+
+
+def columnar_gen_kill(func):
+    """Return (gen, kill) liveness bit matrices of blocks of columnar
+    function, bits being value ids: values used before being defined in
+    a block, and values defined in it. Instructions after block's first
+    terminator are skipped. Computed from the columns for all
+    instructions at once."""
+    cols = func.numpy_columns()
+    nvalues = len(func.values)
+    block_start = cols["block_start"]
+    op_start = cols["op_start"]
+    results = cols["results"]
+    n = len(block_start) - 1
+    ninsts = len(results)
+    block = numpy.repeat(numpy.arange(n), numpy.diff(block_start))
+    terminator = numpy.array([op.terminator for op in OPCODES], dtype=bool)
+    # Number of terminators before each row, which must be the same as
+    # before start of its block
+    before = numpy.zeros(ninsts + 1, dtype=numpy.intp)
+    numpy.cumsum(terminator[cols["opcodes"]], out=before[1:])
+    valid = before[:-1] == before[block_start[:-1]][block]
+
+    rows = numpy.flatnonzero(valid & (results != NO_VALUE))
+    def_keys = block[rows] * nvalues + results[rows]
+    # First definition of each value in each block (rows are ascending)
+    keys, first = numpy.unique(def_keys, return_index=True)
+    first = rows[first]
+
+    use_rows = numpy.repeat(numpy.arange(ninsts), numpy.diff(op_start))
+    uses = cols["table_ids"][cols["op_index"]]
+    used = (uses != NO_VALUE) & valid[use_rows]
+    use_rows = use_rows[used]
+    uses = uses[used]
+    use_keys = block[use_rows] * nvalues + uses
+    k = numpy.minimum(numpy.searchsorted(keys, use_keys), max(len(keys) - 1, 0))
+    if len(keys):
+        # Use in the defining instruction itself counts
+        exposed = (keys[k] != use_keys) | (first[k] >= use_rows)
+    else:
+        exposed = numpy.ones(len(uses), dtype=bool)
+
+    gen = pack_pairs(block[use_rows[exposed]], uses[exposed], n, nvalues)
+    kill = pack_pairs(block[rows], results[rows], n, nvalues)
+    return gen, kill
+
+
+def solve_liveness(l):
+    """Solve block live-in/out sets of liveness.Liveness object. For a
+    columnar function, its variables are numbered by value ids and
+    everything is computed from the columns, else from block use/def
+    summaries made by the object."""
+    func = l.func
+    if isinstance(func, ColumnarFunction):
+        blocks = func.bblocks
+        names = [None] * len(func.values)
+        for v in func.values.itervalues():
+            names[v.id] = v.name
+        l.names[:] = names
+        l.index.clear()
+        l.index.update((name, k) for k, name in enumerate(names))
+        gen, kill = columnar_gen_kill(func)
+        start, index = columnar_successors(func)
+        empty = numpy.flatnonzero(numpy.diff(func.numpy_columns()["block_start"]) == 0)
+    else:
+        cfg = l.cfg
+        blocks = cfg.blocks
+        for b in blocks:
+            l._use[b], l._def[b] = l.summary(b)
+        pos = dict((b, n) for n, b in enumerate(blocks))
+        nbits = len(l.names)
+        gen = pack_ints([l.to_bits(l._use[b]) for b in blocks], nbits)
+        kill = pack_ints([l.to_bits(l._def[b]) for b in blocks], nbits)
+        start, index = csr([[pos[s] for s in cfg.successors(b)] for b in blocks], len(blocks))
+        empty = [n for n, b in enumerate(blocks) if b.first is None]
+    # Empty block has no instruction to be live at
+    kill[empty] = ~numpy.uint64(0)
+    out, live_in = solve_csr(gen, kill, start, index)
+    for b, i, o in zip(blocks, unpack_ints(live_in), unpack_ints(out)):
+        l._live_in[b] = l.from_bits(i)
+        l._live_out[b] = l.from_bits(o)
+
+
+def reaching_definitions(func, cfg=None):
+    """Return dict mapping each block to set of instructions (definitions
+    of variables) reaching its start."""
+    if cfg is None:
+        cfg = get_cfg(func)
+    blocks = cfg.blocks
+    defs = [i for b in blocks for i in b if i.name]
+    num = dict((i, n) for n, i in enumerate(defs))
+    by_var = {}
+    for i in defs:
+        by_var.setdefault(i.name, []).append(num[i])
+    gen = []
+    kill = []
+    for b in blocks:
+        last = {}
+        for i in b:
+            if i.name:
+                last[i.name] = num[i]
+        gen.append(last.values())
+        kill.append([n for name in last for n in by_var[name] if n != last[name]])
+    pos = dict((b, n) for n, b in enumerate(blocks))
+    preds = [[pos[p] for p in cfg.predecessors(b)] for b in blocks]
+    reach_in, out = solve(pack(gen, len(defs)), pack(kill, len(defs)), preds)
+    return dict((b, set(defs[n] for n in row)) for b, row in zip(blocks, unpack(reach_in)))
+
+
+def expression(i):
+    """Return key of expression computed by instruction, None if it's not
+    one without side effects."""
+    if i.opcode not in EXPR_OPCODES:
+        return None
+    return (i.opcode_name, i.predicate, i.type, tuple(str(op) for op in i.operands))
+
+
+def available_expressions(func, cfg=None):
+    """Return dict mapping each block to set of expressions (see
+    expression()) available at its start."""
+    if cfg is None:
+        cfg = get_cfg(func)
+    blocks = cfg.blocks
+    num = {}
+    # Variable -> expressions using it
+    users = {}
+    for b in blocks:
+        for i in b:
+            e = expression(i)
+            if e is not None and e not in num:
+                num[e] = len(num)
+                for op in i.operands:
+                    if isinstance(op, LOCAL_VALUES):
+                        users.setdefault(op.name, set()).add(num[e])
+    gen = []
+    kill = []
+    for b in blocks:
+        avail = set()
+        killed = set()
+        for i in b:
+            e = expression(i)
+            if e is not None:
+                avail.add(num[e])
+            if i.name:
+                # Redefinition kills expressions using the variable
+                k = users.get(i.name, set())
+                avail -= k
+                killed |= k
+        gen.append(list(avail))
+        kill.append(list(killed))
+    exprs = sorted(num, key=num.get)
+    pos = dict((b, n) for n, b in enumerate(blocks))
+    preds = [[pos[p] for p in cfg.predecessors(b)] for b in blocks]
+    avail_in, out = solve(pack(gen, len(exprs)), pack(kill, len(exprs)), preds, intersect=len(exprs))
+    return dict((b, set(exprs[n] for n in row)) for b, row in zip(blocks, unpack(avail_in)))
@@ -0,0 +1,124 @@
+"""Tokenizer for textual LLVM IR.
+
+Works a line at a time and produces list of (ws, text) tuples, where
+ws is whitespace preceding the token. This way, tokenization is done
+completely by a single precompiled regex (no per-token Python code),
+and the exact source text of any token range can be recovered (needed
+to roundtrip types, metadata, etc.). Token kind is not stored, but
+easily derived from the token text (see kind()).
+
+Source may be a plain string or any other buffer supported by the re
+module, so a line can be tokenized in place in a larger buffer."""
+import re
+
+
+# Token kinds
+COMMENT = "comment"
+LOCAL = "local"
+GLOBAL = "global"
+METADATA = "metadata"
+CSTRING = "cstring"
+STRING = "string"
+LABEL = "label"
+TYPE = "type"
+INT = "int"
+IDENT = "ident"
+PUNCT = "punct"
+
+TOKEN_RE = re.compile(r"""
+    ([ \t]*)
+    (
+        ;.*                                     # comment
+      | c"[^"]*"                                # c"string"
+      | [%@!]?(?:[-a-zA-Z$._0-9]+:?|"[^"]*")    # names, numbers, labels, strings
+      | [^ \t\r]                                # punctuation
+    )
+""", re.X)
+
+TYPE_KEYWORDS = set(["void", "half", "float", "double", "x86_fp80", "fp128",
+    "ppc_fp128", "x86_mmx", "label", "metadata", "opaque"])
+
+OPEN_BRACKETS = "([{<"
+CLOSE_BRACKETS = ")]}>"
+
+
+def tokenize(s, pos=0, endpos=None):
+    """Tokenize one line of IR (s[pos:endpos], which should not include
+    end-of-line char). Comment, if any, is returned as last token."""
+    if endpos is None:
+        return TOKEN_RE.findall(s, pos)
+    return TOKEN_RE.findall(s, pos, endpos)
+
+
+def kind(t):
+    "Return kind of token with text t."
+    c = t[0]
+    if c == "%":
+        return LOCAL
+    if c == "@":
+        return GLOBAL
+    if c == "!":
+        return METADATA
+    if c == ";":
+        return COMMENT
+    if c == '"':
+        return STRING
+    if len(t) > 1:
+        if t[-1] == ":":
+            return LABEL
+        if t[0] == "c" and t[1] == '"':
+            return CSTRING
+    if c.isdigit() or c == "-":
+        return INT
+    if is_type(t):
+        return TYPE
+    if c.isalpha() or c == "_":
+        return IDENT
+    return PUNCT
+
+
+def is_type(t):
+    "Check if token is a primitive type name."
+    return t[0] == "i" and t[1:].isdigit() or t in TYPE_KEYWORDS
+
+
+def source(toks):
+    "Return source text spanned by list of tokens."
+    return toks[0][1] + "".join([w + t for w, t in toks[1:]])
+
+
+def split(toks, sep=","):
+    """Split list of tokens into groups separated by sep punctuation.
+    Separators nested in brackets don't split."""
+    groups = []
+    cur = []
+    depth = 0
+    for tok in toks:
+        t = tok[1]
+        if t in OPEN_BRACKETS:
+            depth += 1
+        elif t in CLOSE_BRACKETS:
+            depth -= 1
+        elif t == sep and depth == 0:
+            groups.append(cur)
+            cur = []
+            continue
+        cur.append(tok)
+    if cur:
+        groups.append(cur)
+    return groups
+
+
+def skip_brackets(toks, i):
+    """Given index of opening bracket token, return index past
+    matching closing bracket."""
+    depth = 0
+    while True:
+        t = toks[i][1]
+        i += 1
+        if t in OPEN_BRACKETS:
+            depth += 1
+        elif t in CLOSE_BRACKETS:
+            depth -= 1
+            if depth == 0:
+                return i
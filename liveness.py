@@ -1,53 +1,294 @@
 #!/usr/bin/env python
 import sys
 import re
-from copy import copy
+from collections import deque
 
 from pllvm import *
+from cfg import get_cfg
+import dataflow
+
+
+def inst_succ(i, cfg):
+    "Return successor instructions, using CFG at the ends of blocks."
+    if i.next is not None and not i.opcode.terminator:
+        return [i.next]
+    return [b.first for b in cfg.successors(i.parent) if b.first is not None]
 
 
 class Liveness(object):
+    """Live variables of function, solved for blocks: per-block use/def
+    summaries are propagated by worklist, visiting blocks in postorder
+    (i.e. reverse postorder of reverse CFG, the natural order for this
+    backward problem). Live-out sets of instructions are derived on
+    demand, by a single backward walk over a block.
+
+    Live sets are Python sets of variable names. Subclasses may use
+    another representation, overriding empty(), copy(), diff(),
+    uses_defs(), to_bits() and from_bits() (union and comparison are
+    done with | and !=).
+
+    Block-level problem is solved by worklist, or with backend="numpy"
+    by NumPy engine for all blocks at once (see dataflow.py), which pays
+    off for huge functions. For a columnar function (see columnar.py)
+    that backend also makes block summaries from the columns, and
+    instructions are only materialized for instruction-level queries."""
 
-    def __init__(self, func):
+    BACKENDS = ("worklist", "numpy")
+
+    def __init__(self, func, cfg=None, backend="worklist"):
+        assert backend in self.BACKENDS, "Unknown liveness backend: " + backend
+        self.func = func
+        self._cfg = cfg
+        # Variables numbered as bits, names[n] is name of variable n
+        self.index = {}
+        self.names = []
+        # Per block
+        self._use = {}
+        self._def = {}
         self._live_in = {}
         self._live_out = {}
+        # Per instruction, filled for whole blocks by walk()
+        self._inst_out = {}
+        self._walked = set()
+        if backend == "numpy":
+            dataflow.solve_liveness(self)
+        else:
+            for b in self.cfg.blocks:
+                self._use[b], self._def[b] = self.summary(b)
+                self._live_in[b] = self.empty()
+                self._live_out[b] = self.empty()
+            self.solve()
+
+    @property
+    def cfg(self):
+        # Made on demand, NumPy backend may do without it
+        if self._cfg is None:
+            self._cfg = get_cfg(self.func)
+        return self._cfg
+
+    def empty(self):
+        return set()
+
+    def copy(self, live):
+        return set(live)
+
+    @staticmethod
+    def diff(a, b):
+        return a - b
+
+    def uses_defs(self, i):
+        "Return (uses, defs) of instruction as live sets."
+        return i.uses(), i.defines()
+
+    def bit(self, name):
+        "Return number of variable."
+        n = self.index.get(name)
+        if n is None:
+            n = self.index[name] = len(self.names)
+            self.names.append(name)
+        return n
+
+    def names_of(self, bits):
+        "Return set of names of variables in a bitset."
+        res = set()
+        names = self.names
+        while bits:
+            low = bits & -bits
+            res.add(names[low.bit_length() - 1])
+            bits ^= low
+        return res
+
+    def to_bits(self, live):
+        "Convert live set to bitset (Python int)."
+        bits = 0
+        for name in live:
+            bits |= 1 << self.bit(name)
+        return bits
+
+    def from_bits(self, bits):
+        "Convert bitset to live set."
+        return self.names_of(bits)
+
+    def summary(self, b):
+        """Return (use, def) sets of block: variables used before being
+        defined in it, and defined in it."""
+        diff = self.diff
+        use = self.empty()
+        defs = self.empty()
+        for i in b:
+            u, d = self.uses_defs(i)
+            use |= diff(u, defs)
+            defs |= d
+            if i.opcode.terminator:
+                # Anything after is not reachable from block's start
+                break
+        return use, defs
+
+    def solve(self):
+        cfg = self.cfg
+        live_in = self._live_in
+        live_out = self._live_out
+        diff = self.diff
+        order = cfg.postorder()
+        reachable = set(order)
+        order.extend([b for b in cfg.blocks if b not in reachable])
+        work = deque(order)
+        queued = set(order)
+        while work:
+            b = work.popleft()
+            queued.discard(b)
+            out = self.empty()
+            for s in cfg.successors(b):
+                out |= live_in[s]
+            live_out[b] = out
+            if b.first is None:
+                # Empty block has no instruction to be live at
+                continue
+            new_in = self._use[b] | diff(out, self._def[b])
+            if new_in != live_in[b]:
+                live_in[b] = new_in
+                for p in cfg.predecessors(b):
+                    if p not in queued:
+                        queued.add(p)
+                        work.append(p)
+
+    def walk(self, b):
+        "Compute live-out sets of block's instructions."
+        diff = self.diff
+        out = self._live_out[b]
+        live = out
+        i = b.last
+        while i is not None:
+            if i.next is None or i.opcode.terminator:
+                live = self.copy(out)
+            self._inst_out[i] = live
+            u, d = self.uses_defs(i)
+            live = u | diff(live, d)
+            i = i.prev
+        self._walked.add(b)
+
+    def live_in_block(self, b):
+        return self._live_in[b]
+
+    def live_out_block(self, b):
+        return self._live_out[b]
+
+    def live_out_map(self):
+        for b in self.cfg.blocks:
+            if b not in self._walked:
+                self.walk(b)
+        return self._inst_out
+
+    def live_out(self, inst):
+        try:
+            return self._inst_out[inst]
+        except KeyError:
+            self.walk(inst.parent)
+            return self._inst_out[inst]
+
+    def back_annotate(self):
+        "Annotate input function with liveness information."
+        for inst, live_out in self.live_out_map().iteritems():
+            inst.comment = "\t;live_out: %s" % sorted(list(live_out))
+
+
+class BitLiveness(Liveness):
+    """Liveness with live sets represented as bitsets (Python ints), so
+    union and difference are single operations over all variables.
+    Variables are numbered densely per function, in order of appearance.
+    Views as name sets are made on demand."""
+
+    def __init__(self, func, cfg=None, backend="worklist"):
+        # Per instruction (uses, defs) bitsets
+        self._masks = {}
+        self._map = None
+        Liveness.__init__(self, func, cfg, backend)
+
+    def empty(self):
+        return 0
+
+    def copy(self, live):
+        return live
+
+    @staticmethod
+    def diff(a, b):
+        return a & ~b
+
+    def to_bits(self, live):
+        return live
+
+    def from_bits(self, bits):
+        return bits
+
+    def uses_defs(self, i):
+        try:
+            return self._masks[i]
+        except KeyError:
+            uses = 0
+            for op in i.operands:
+                if isinstance(op, LOCAL_VALUES):
+                    uses |= 1 << self.bit(op.name)
+            defs = 1 << self.bit(i.name) if i.name else 0
+            res = self._masks[i] = (uses, defs)
+            return res
+
+    def live_out_bits(self, inst):
+        return Liveness.live_out(self, inst)
+
+    def is_live_out(self, inst, name):
+        "Check if variable is live after instruction."
+        n = self.index.get(name)
+        return n is not None and bool(self.live_out_bits(inst) >> n & 1)
+
+    def live_in_block(self, b):
+        return self.names_of(self._live_in[b])
+
+    def live_out_block(self, b):
+        return self.names_of(self._live_out[b])
+
+    def live_out(self, inst):
+        return self.names_of(self.live_out_bits(inst))
+
+    def live_out_map(self):
+        if self._map is None:
+            bits = Liveness.live_out_map(self)
+            self._map = dict((i, self.names_of(live)) for i, live in bits.iteritems())
+        return self._map
+
+
+class InstLiveness(Liveness):
+    """Reference solver: iterates over all instructions in layout order
+    until nothing changes."""
+
+    def __init__(self, func, cfg=None):
+        self._live_in = {}
+        self._inst_out = {}
         for b in func:
             for i in b.instructions():
                 self._live_in[i] = set()
-                self._live_out[i] = set()
+                self._inst_out[i] = set()
 
+        if cfg is None:
+            cfg = get_cfg(func)
         changed = True
-        iter = 1
         while changed:
             changed = False
-            print "iter", iter
-            iter += 1
             for b in func:
                 for i in b.instructions():
-                    print "Analyzing", i, "| def:", i.defines(), "| use:", i.uses()
-                    new_in = copy(self._live_in[i])
-                    new_out = copy(self._live_out[i])
-                    new_in = i.uses() | (new_out - i.defines())
                     new_out = set()
-                    print "Succ:", i.succ()
-                    for s in i.succ():
+                    for s in inst_succ(i, cfg):
                         new_out |= self._live_in[s]
-                    if new_in != self._live_in[i] or new_out != self._live_out[i]:
+                    new_in = i.uses() | (new_out - i.defines())
+                    if new_in != self._live_in[i] or new_out != self._inst_out[i]:
                         changed = True
                         self._live_in[i] = new_in
-                        self._live_out[i] = new_out
+                        self._inst_out[i] = new_out
 
     def live_out_map(self):
-        return self._live_out
+        return self._inst_out
 
     def live_out(self, inst):
-        return self._live_out[inst]
-
-    def back_annotate(self):
-        "Annotate input function with liveness information."
-        for inst, live_out in self.live_out_map().iteritems():
-            inst.comment = "\t;live_out: %s" % sorted(list(live_out))
-
+        return self._inst_out[inst]
 
 if __name__ == "__main__":
     with open(sys.argv[1]) as asm:
@@ -2,6 +2,8 @@ import sys
 import re
 
 from llvm2py import *
+from ptypes import PArrayType
+from pllvm import get_opcode
 
 
 def render_i(s):
@@ -48,48 +50,68 @@ def cdecl(typ, v):
     "Convert LLVM type and var name to C declaration"
     assert type(typ) is not type("")
 #    print "!", typ, type(typ)
-    if isinstance(typ, ArrayType):
+    if isinstance(typ, (ArrayType, PArrayType)):
         return "%s %s[%s]" % (typ.element, var(v), typ.count)
     return "%s %s" % (str(typ), var(v))
 
+def convert_ret(i, args, defined_vars):
+    render_i("return %s;" % var(args[0]))
+
+def convert_br(i, args, defined_vars):
+    if len(args) == 3:
+        render_i("if (%s) goto %s; else goto %s;" % (var(args[0]), var(args[2]), var(args[1])))
+    else:
+        render_i("goto %s;" % var(args[0]))
+
+def convert_call(i, args, defined_vars):
+    func = args[-1]
+    args = args[:-1]
+    render_i("%s = %s(%s);" % (cdecl(i.type, i), func.name, val_list(args)))
+
+def convert_load(i, args, defined_vars):
+    render_i("%s %s = %s;" % (i.type, var(i), var(args[0])))
+
+def convert_store(i, args, defined_vars):
+    render_i("%s = %s;" % (var(args[1]), var(args[0])))
+
+def convert_mov(i, args, defined_vars):
+    if i.name in defined_vars:
+        render_i("%s = %s;" % (var(i), var(args[0])))
+    else:
+        render_i("%s %s = %s;" % (i.type, var(i), var(args[0])))
+    # mov is the only case when same var can be reused, the rest
+    # vars are SSA-conformant
+    defined_vars.add(i.name)
+
+def convert_icmp(i, args, defined_vars):
+    c_op = {"eq": "==", "ne": "!="}[i.predicate]
+    render_i(("%s %s = %s " + c_op + " %s;") % (i.type, var(i), var(args[0]), var(args[1])))
+
+def convert_binop(i, args, defined_vars):
+    params = [i, args[0], args[1]]
+    params = [var(x) for x in params]
+    params = [i.type] + params
+    c_op = {"add": "+", "sub": "-"}[i.opcode_name]
+    render_i(("%s %s = %s " + c_op + " %s;") % tuple(params))
+
+def convert_unknown(i, args, defined_vars):
+    print "//", i
+
+CONVERTERS = {
+    get_opcode("ret"): convert_ret,
+    get_opcode("br"): convert_br,
+    get_opcode("call"): convert_call,
+    get_opcode("load"): convert_load,
+    get_opcode("store"): convert_store,
+    get_opcode("mov"): convert_mov,
+    get_opcode("icmp"): convert_icmp,
+    get_opcode("add"): convert_binop,
+    get_opcode("sub"): convert_binop,
+}
+
 def convert_i(i, defined_vars):
-    op = i.opcode_name
-    args = i.operands
 #    print "//", i
-    if op == "ret":
-        render_i("return %s;" % var(args[0]))
-    elif op == "br":
-        if len(args) == 3:
-            render_i("if (%s) goto %s; else goto %s;" % (var(args[0]), var(args[2]), var(args[1])))
-        else:
-            render_i("goto %s;" % var(args[0]))
-    elif op == "call":
-        func = i.operands[-1]
-        args = i.operands[:-1]
-        render_i("%s = %s(%s);" % (cdecl(i.type, i), func.name, val_list(args)))
-    elif op == "load":
-            render_i("%s %s = %s;" % (i.type, var(i), var(args[0])))
-    elif op == "store":
-            render_i("%s = %s;" % (var(args[1]), var(args[0])))
-    elif op == "mov":
-        if i.name in defined_vars:
-            render_i("%s = %s;" % (var(i), var(args[0])))
-        else:
-            render_i("%s %s = %s;" % (i.type, var(i), var(args[0])))
-        # mov is the only case when same var can be reused, the rest
-        # vars are SSA-conformant
-        defined_vars.add(i.name)
-    elif op == "icmp":
-        c_op = {"eq": "==", "ne": "!="}[i.predicate]
-        render_i(("%s %s = %s " + c_op + " %s;") % (i.type, var(i), var(args[0]), var(args[1])))
-    elif op in ["add", "sub"]:
-        params = [i, args[0], args[1]]
-        params = [var(x) for x in params]
-        params = [i.type] + params
-        c_op = {"add": "+", "sub": "-"}[op]
-        render_i(("%s %s = %s " + c_op + " %s;") % tuple(params))
-    else:
-        print "//", i
+    CONVERTERS.get(i.opcode, convert_unknown)(i, i.operands, defined_vars)
 
 def convert(mod):
     render('#include "llvmir.h"')
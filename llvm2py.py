@@ -1,6 +1,7 @@
 #!/usr/bin/env python
 import sys
 import re
+from functools import partial
 
 from llvm.core import *
 import llvm
@@ -13,7 +14,7 @@ PRED_MAP = {ICMP_EQ: "eq"}
 LINKAGE_MAP = {LINKAGE_PRIVATE: "private", LINKAGE_COMMON: "common"}
 
 def prim_type(type):
-    return type.split(" ", 1)[0]
+    return pllvm.prim_type(type)
 
 def render_arg(arg):
     if isinstance(arg, PConstantInt):
@@ -49,76 +50,114 @@ def render_types(args):
     return ", ".join([str(x.type) for x in args])
 
 
+# Keywords in text of instruction or global, where operands or names
+# can't be mistaken for them
+INBOUNDS_RE = re.compile(r"\s*(?:%\S+\s*=\s*)?getelementptr\s+inbounds\s")
+UNNAMED_ADDR_RE = re.compile(r"\s*@\S+\s*=\s*(?:\w+\s+)*?unnamed_addr\s")
+
+def is_inbounds(i):
+    """Check if getelementptr instruction is inbounds, without rendering
+    it if llvmpy allows."""
+    try:
+        return i._ptr.isInBounds()
+    except AttributeError:
+        # Not exposed by this llvmpy version
+        return INBOUNDS_RE.match(str(i)) is not None
+
+def has_unnamed_addr(v):
+    """Check if global value has unnamed_addr, without rendering it if
+    llvmpy allows."""
+    try:
+        return v._ptr.hasUnnamedAddr()
+    except AttributeError:
+        return UNNAMED_ADDR_RE.match(str(v)) is not None
+
+
 class PModule(pllvm.PModule):
     pass
 
 
 class PGlobalVariable(pllvm.PGlobalVariable):
     @classmethod
-    def from_llvm(cls, v):
+    def from_llvm(cls, v, memo=None):
         self = cls()
         self.name = v.name
         self.pointer_type = v.type
         self.type = v.type
         self.type_str = str(v.type)[:-1]
         self.is_declaration = v.is_declaration
-        self.initializer = convert_arg(v.initializer)
+        self.initializer = convert_arg(v.initializer, memo)
         self.linkage = LINKAGE_MAP[v.linkage]
         self.alignment = v.alignment
         self.global_constant = v.global_constant
-        self.unnamed_addr = "unnamed_addr" in str(v)
+        if memo is None:
+            self.unnamed_addr = "unnamed_addr" in str(v)
+        else:
+            self.unnamed_addr = has_unnamed_addr(v)
         return self
 
 
 class PArgument(pllvm.PArgument):
-    pass
+    __slots__ = ()
 
 
 class PGlobalVariableRef(pllvm.PGlobalVariableRef):
-    pass
+    __slots__ = ()
 
 
 class PConstantInt(pllvm.PConstantInt):
-    pass
+    __slots__ = ()
 
 
 class PConstantDataArray(pllvm.PConstantDataArray):
-    pass
+    __slots__ = ()
 
 
 # Virtual objects
 class PTmpVariable(pllvm.PTmpVariable):
-    pass
+    __slots__ = ()
 
 
 class PLabelRef(pllvm.PLabelRef):
-    pass
+    __slots__ = ()
 
 
 class PConstantExpr(pllvm.PConstantExpr):
+    __slots__ = ()
 
     @classmethod
-    def from_llvm(cls, expr):
+    def from_llvm(cls, expr, memo=None):
         e = cls()
         e.type = expr.type
         e.opcode_name = expr.opcode_name
-        e.operands = [convert_arg(x) for x in expr.operands]
+        e.operands = [convert_arg(x, memo) for x in expr.operands]
         return e
 
 
-def convert_arg(a):
+def convert_arg(a, memo=None):
+    """Convert LLVM value used as an operand. If memo dict is passed,
+    each value is converted once, and all its uses share the result."""
+    if memo is None:
+        return _convert_arg(a, None)
+    try:
+        return memo[a]
+    except KeyError:
+        v = memo[a] = _convert_arg(a, memo)
+        return v
+
+def _convert_arg(a, memo):
     if isinstance(a, Argument):
         return PArgument(a.name, a.type)
     if isinstance(a, GlobalVariable):
         return PGlobalVariableRef(a.name, a.type)
     if isinstance(a, Function):
-        return PFunction.from_llvm(a, is_ref=True)
+        return PFunction.from_llvm(a, is_ref=True, memo=memo)
     if isinstance(a, ConstantInt):
         return PConstantInt(a.z_ext_value, a.type)
     if isinstance(a, ConstantDataArray):
         return PConstantDataArray(a)
     if isinstance(a, ConstantExpr):
-        return PConstantExpr.from_llvm(a)
+        return PConstantExpr.from_llvm(a, memo)
     if isinstance(a, BasicBlock):
         return PLabelRef(a.name)
     if isinstance(a, Instruction):
@@ -130,12 +169,13 @@ def convert_arg(a):
 
 
 class PInstruction(pllvm.PInstruction):
+    __slots__ = ()
+    predicate_code = pllvm.Extra("predicate_code")
 
     @classmethod
-    def from_llvm(cls, parent_block, i):
+    def from_llvm(cls, parent_block, i, memo=None):
 #        print i.name, i.type, i.opcode_name, i.operands
         out_i = cls()
-        out_i.parent = parent_block
         out_i.name = i.name
         out_i.type = i.type
         out_i.opcode_name = i.opcode_name
@@ -143,9 +183,17 @@ class PInstruction(pllvm.PInstruction):
         if hasattr(i, "predicate"):
             out_i.predicate_code = i.predicate
             out_i.predicate = PRED_MAP[i.predicate]
-        out_i.operands = [convert_arg(x) for x in i.operands]
+        out_i.operands = [convert_arg(x, memo) for x in i.operands]
+        if memo is not None and out_i.name:
+            # Value object shared by all uses is defined here
+            v = convert_arg(i, memo)
+            v.definition = out_i
+            parent_block.parent.add_value(v)
         if i.opcode_name == "getelementptr":
-            out_i.inbounds = "inbounds" in str(i)
+            if memo is None:
+                out_i.inbounds = "inbounds" in str(i)
+            else:
+                out_i.inbounds = is_inbounds(i)
         elif i.opcode_name == "phi":
             out_i.incoming_vars = []
             for x in xrange(i.incoming_count):
@@ -153,15 +201,15 @@ class PInstruction(pllvm.PInstruction):
                 label = i.get_incoming_block(x).name
                 # If this is instruction, i.e. tmpvar, then we came from it basic block
                 if isinstance(o, Instruction):
-                    out_i.incoming_vars.append((convert_arg(o), label))
+                    out_i.incoming_vars.append((convert_arg(o, memo), label))
                 # Alternatively, this can be incoming function argument from basic block %0
                 elif isinstance(o, Argument):
-                    out_i.incoming_vars.append((convert_arg(o), label))
+                    out_i.incoming_vars.append((convert_arg(o, memo), label))
                 # Finally, this can be implicit initialization constant also from bbock %0
                 # Not that de-SSA-ization must convert this implicit initialization into
                 # explicit!
                 elif isinstance(o, ConstantInt):
-                    out_i.incoming_vars.append((convert_arg(o), label))
+                    out_i.incoming_vars.append((convert_arg(o, memo), label))
                 else:
                     assert False, "Unsupported phi arg type"
         return out_i
@@ -174,7 +222,7 @@ class PBasicBlock(pllvm.PBasicBlock):
 class PFunction(pllvm.PFunction):
 
     @classmethod
-    def from_llvm(cls, f, is_ref=False):
+    def from_llvm(cls, f, is_ref=False, memo=None):
         self = cls()
         self.is_ref = is_ref
         self.name = f.name
@@ -182,9 +230,10 @@ class PFunction(pllvm.PFunction):
         self.args = []
         for x in f.args:
             attrs = x.attributes
-            x = convert_arg(x)
+            x = convert_arg(x, memo)
             x.attributes = attrs
             self.args.append(x)
+            self.add_value(x)
         self.is_declaration = f.is_declaration
         self.vararg = f.type.pointee.vararg
         self.does_not_throw = f.does_not_throw
@@ -197,28 +246,57 @@ class IRConverter(object):
 
     @classmethod
     def number_tmps(cls, mod):
-        tmp_i = 0
         for f in mod.functions:
-#            print `f`
-            f_type = str(f.type)[:-1]
-            f_type = f_type.split(" ", 1)
-            f_type = f_type[0] + " function " + f_type[1]
-            for b in f.basic_blocks:
-#                print "BB name:", b.name
-                if not b.name:
-                    b.name = "%d" % tmp_i
+            cls.number_func_tmps(f)
+
+    @classmethod
+    def number_func_tmps(cls, f):
+        # Like in LLVM, implicit names are numbered per function
+        tmp_i = 0
+        for b in f.basic_blocks:
+#            print "BB name:", b.name
+            if not b.name:
+                b.name = "%d" % tmp_i
+                tmp_i += 1
+            for i in b.instructions:
+#                print i
+                if not i.name and i.type != Type.void():
+                    i.name = "%d" % tmp_i
                     tmp_i += 1
-                for i in b.instructions:
-#                    print i
-                    if not i.name and i.type != Type.void():
-                        i.name = "%d" % tmp_i
-                        tmp_i += 1
 
     @classmethod
-    def convert(cls, mod):
-        cls.number_tmps(mod)
+    def convert_body(cls, f, out_f, memo=None):
+        "Convert body of llvmpy function f into PFunction out_f."
+        for b in f.basic_blocks:
+            out_b = PBasicBlock(out_f, b.name)
+            for i in b.instructions:
+#                print "# %s" % i
+                out_b.append(PInstruction.from_llvm(out_b, i, memo))
+            out_f.append(out_b)
+
+    @classmethod
+    def load_body(cls, f, out_f, memo=None):
+        cls.number_func_tmps(f)
+        cls.convert_body(f, out_f, memo)
+
+    @classmethod
+    def convert(cls, mod, fast=False, lazy=False):
+        """Convert llvmpy Module. In fast mode, properties are read
+        directly rather than by rendering objects to text (when llvmpy
+        allows), and each operand value is converted once per module.
+        Otherwise, conversion follows the original, text-based way.
+
+        If lazy is True, only globals and function headers are converted
+        at once, while each function body is converted on first access
+        (so bodies of functions which aren't used are never converted).
+        The llvmpy module is then kept referenced by the result."""
+        memo = {} if fast else None
 
         out_mod = PModule()
+        if lazy:
+            out_mod.llvm_module = mod
+        else:
+            cls.number_tmps(mod)
 
         for v in mod.global_variables:
 #            print dir(v)
@@ -226,16 +304,15 @@ class IRConverter(object):
 #                print a, getattr(v, a)
 #            print v.visibility, v.linkage, "=%s=" % v.section
 #            print v.initializer
-            out_mod.global_variables.append(PGlobalVariable.from_llvm(v))
+            out_mod.add_global(PGlobalVariable.from_llvm(v, memo))
 
         for f in mod.functions:
-            out_f = PFunction.from_llvm(f)
-            for b in f.basic_blocks:
-                out_b = PBasicBlock(out_f, b.name)
-                for i in b.instructions:
-#                    print "# %s" % i
-                    out_b.append(PInstruction.from_llvm(out_b, i))
-                out_f.append(out_b)
+            out_f = PFunction.from_llvm(f, memo=memo)
+            if lazy:
+                out_f.set_body_loader(partial(cls.load_body, f, memo=memo))
+            else:
+                cls.convert_body(f, out_f, memo)
+            out_f.parent = out_mod
             out_mod.append(out_f)
 
         return out_mod
@@ -1,65 +1,115 @@
 import sys
+import os
+import mmap
+import hashlib
+import multiprocessing
+from functools import partial
 
 from pllvm import *
+from serialize import dumps_blocks, loads_blocks
+from lexer import tokenize, source, skip_brackets, is_type, kind, IDENT
+from ptypes import get_type
+
+
+# Should be bumped whenever parser output for the same input changes
+# (used to invalidate caches of parsed modules).
+PARSER_VERSION = "2"
+
+PARAM_ATTRS = {"nocapture": ATTR_NO_CAPTURE}
+
 
 class IRParser(object):
 
-    def __init__(self, fileobj):
+    def __init__(self, fileobj, use_mmap=False):
+        """If use_mmap is True, the file is memory-mapped and parsed in
+        place, so its text is never read into memory as a whole (only
+        individual tokens are extracted from it)."""
         self.f = fileobj
+        self.buf = None
+        if use_mmap:
+            if os.fstat(fileobj.fileno()).st_size:
+                self.buf = mmap.mmap(fileobj.fileno(), 0, access=mmap.ACCESS_READ)
+            else:
+                # Empty files can't be mapped
+                self.buf = ""
         self.mod = PModule()
         self.func = None
         self.block = None
         self.tmp_count = 0
+        # Hash of text of function being parsed, see reparse()
+        self.func_hash = None
+        # (func, start, end) for each lazily parsed function
+        self.body_index = []
 
     @staticmethod
-    def split(s):
-        args = [x.strip() for x in s.split(",")]
-        return args
-
-    @staticmethod
-    def next_token(s):
-        return s.split(None, 1)
-
-    @staticmethod
-    def convert_arg(arg, type=None):
-        if arg[0] == "!":
-            # Tags, so far just return as string
-            return arg
-
-        attrs = set()
-        if type is None:
-            m = re.match(r"(\[.+?\]|[0-9A-Za-z_]+) (.+)", arg)
-            type, arg = m.groups()
-            print m.groups()
-            #type, arg = arg.split(None, 1)
-
-            if not arg.startswith('c"') and " " in arg:
-                mod, arg = arg.split(None, 1)
-                if mod == "nocapture":
-                    attrs.add(ATTR_NO_CAPTURE)
-                else:
-                    assert False, "%s: unsupported attributes" % mod
-
-        try:
-            v = int(arg)
-            return PConstantInt(v, type)
-        except:
-            pass
+    def parse_type(toks, i):
+        """Parse type starting at toks[i]. Return (interned) type object
+        and index of the next token."""
+        start = i
+        t = toks[i][1]
+        if t in ("[", "{", "<"):
+            i = skip_brackets(toks, i)
+        elif t[0] == "%" or is_type(t):
+            # %struct.foo is a named type
+            i += 1
+        else:
+            assert False, "Type expected: " + source(toks[i:])
+        # Pointers and function types
+        n = len(toks)
+        while i < n:
+            t = toks[i][1]
+            if t == "*":
+                i += 1
+            elif t == "(":
+                i = skip_brackets(toks, i)
+            else:
+                break
+        if i == start + 1:
+            return get_type(toks[start][1]), i
+        return get_type(source(toks[start:i])), i
 
-        if arg[0] == "%":
-            v = PTmpVariable(arg[1:], type)
-        elif arg[0] == "@":
+    def parse_operand(self, toks, i, type=None):
+        """Parse (possibly typed) operand starting at toks[i]. If operand
+        doesn't have explicit type, type param is used. Return operand
+        object and index of the next token."""
+        attrs = None
+        if type is None or i + 1 < len(toks) and toks[i + 1][1] != ",":
+            type, i = self.parse_type(toks, i)
+            while toks[i][1] in PARAM_ATTRS:
+                if attrs is None:
+                    attrs = set()
+                attrs.add(PARAM_ATTRS[toks[i][1]])
+                i += 1
+        arg = toks[i][1]
+        i += 1
+        c = arg[0]
+        if c == "%":
+            if type == "label":
+                v = PLabelRef(arg[1:])
+            elif self.func is not None and attrs is None:
+                # All uses of a value share the same object (uses with
+                # attributes get own one, so they don't leak to others)
+                v = self.func.values.get(arg[1:])
+                if v is None or v.type != type:
+                    v = self.func.value(arg[1:], type)
+                return v, i
+            else:
+                v = PTmpVariable(arg[1:], type)
+                if self.func is not None:
+                    self.func.link_use(v)
+        elif c.isdigit() or c == "-":
+            return PConstantInt(int(arg), type), i
+        elif c == "@":
+            if attrs is None:
+                return self.mod.global_ref(arg[1:], type), i
             v = PGlobalVariableRef(arg[1:], type)
-        elif arg.startswith("label "):
-            label = arg.split(None, 1)[1]
-            assert label[0] == "%"
-            v = PLabelRef(label[1:])
         elif arg.startswith('c"'):
             v = PConstantDataArray(arg, type)
         else:
-            assert False, "Unknown arg syntax: " + arg
-        v.attributes = attrs
-        return v
+            assert False, "Unknown arg syntax: " + source(toks[i - 1:])
+        if attrs:
+            v.attributes = attrs
+        return v, i
 
     def next_tmp(self):
         t = str(self.tmp_count)
@@ -74,144 +124,371 @@ class IRParser(object):
         self.func.append(self.block)
         self.block.parent = self.func
 
-    def parse(self):
-        for l in self.f:
-            if l[-1] == "\n":
-                l = l[:-1]
-            m = re.match(r"(.*?)([ \t]*;.*)?$", l)
-            l = m.group(1)
-            comment = m.group(2)
-            if not l:
-                if comment and comment.startswith("; ModuleID = "):
-                    self.mod.module_id = comment
-                continue
-
-            if not self.func:
-                # Global context
-                if l.startswith("target "):
-                    self.mod.target_info.append(l)
-                elif l.startswith("!"):
-                    self.mod.metadata.append(l)
-                elif l.startswith("@"):
-                    lhs, rhs = [x.strip() for x in l.split("=", 1)]
-                    var = PGlobalVariable()
-                    var.name = lhs[1:]
-                    # @g = common global i32 0
-                    while True:
-                        lhs, new_rhs = rhs.split(None, 1)
-                        if lhs in ("private", "linkonce", "weak", "common"):
-                            var.linkage = lhs
-                        elif lhs == "global":
-                            pass
-                        # TODO
-                        elif lhs in ("unnamed_addr", "constant"):
-                            pass
-                        else:
-                            break
-                        rhs = new_rhs
-                    val = self.convert_arg(rhs)
-                    # FIXME: var.type apparently should be pointer to
-                    var.type_str = var.type = val.type
-                    var.initializer = val
-                    self.mod.global_variables.append(var)
-
-                elif l.startswith("define "):
-                    m = re.match(r"define (?P<type>.+?) @(?P<name>.+?)\((?P<args>.*?)\)(?P<mods>.*?) \{", l)
-                    assert m, "Syntax error in func definition:" + l
-                    args = m.group("args")
-                    if not args:
-                        args = []
-                    else:
-                        args = [x.strip() for x in args.split(",")]
-                    args = [self.convert_arg(x) for x in args]
-                    self.func = PFunction(m.group("name"), m.group("type"), args)
-                    mods = m.group("mods").strip().split()
-                    self.func.does_not_throw = "nounwind" in mods
-                    self.func.readonly = "readonly" in mods
-                    self.mod.append(self.func)
-                    self.func.parent = self.mod
-                    continue
-
-            else:
-                # Function context
-                if l == "}":
-                    self.block = None
-                    self.func = None
-                    continue
-
-                if l[-1] == ":":
-                    self.make_block(l[:-1].strip(), comment)
-                    continue
-
-                if self.block is None:
-                    self.make_block()
-
-#                print "in: ", l.strip()
-                comps = [x.strip() for x in l.split("=", 1)]
-                if len(comps) == 2:
-                    lhs, rhs = comps
-                    assert lhs[0] == "%", l
-                    lhs = lhs[1:]
+    def parse(self, lazy=False):
+        """Parse module. If lazy is True, only globals and function headers
+        are parsed, while function bodies are parsed on first access
+        (which requires file object to stay open and seekable until
+        then)."""
+        with gc_disabled():
+            if self.buf is not None:
+                if lazy:
+                    self.parse_range_index(0, len(self.buf))
                 else:
-                    lhs = None
-                    rhs = comps[0]
-                opcode, rhs = rhs.split(None, 1)
-                inst = PInstruction()
-                inst.name = lhs
-                inst.opcode_name = opcode
-                inst.comment = comment
-                if opcode in ("icmp", "bricmp"):
-                    pred, rhs = rhs.split(None, 1)
-                    inst.predicate = pred
-                elif opcode == "load":
-                    h, t = rhs.split(None, 1)
-                    if h == "getelementptr":
-                        inst.offseted = True
-                        rhs = t
-                homotype = True
-                if opcode in set(["load", "store", "getelementptr"]):
-                    homotype = False
-                if homotype:
-                    type, rhs = rhs.split(None, 1)
+                    self.parse_range(0, len(self.buf))
+            elif lazy:
+                self.parse_index()
+            else:
+                self.parse_lines(self.f)
+        return self.mod
+
+    def reparse(self, prev):
+        """Parse new version of module prev was parsed from. Functions
+        whose text didn't change are reused from prev as is (and moved
+        to the new module), only the rest are parsed. Returns the new
+        module and set of names of functions which were changed, added
+        or removed, so analyses can be rerun only for them.
+
+        Unchanged functions of prev whose bodies weren't loaded yet
+        aren't reused, as they would load them from offsets in the old
+        file; new ones, still lazy, are kept instead."""
+        mod = self.parse(lazy=True)
+        old = dict((f.name, f) for f in prev)
+        invalidated = set(old)
+        with gc_disabled():
+            for i, func in enumerate(mod.functions):
+                o = old.get(func.name)
+                if o is not None and o.source_hash is not None and o.source_hash == func.source_hash:
+                    if o.body_loaded():
+                        o.parent = mod
+                        mod.functions[i] = o
+                    invalidated.discard(func.name)
                 else:
-                    type = None
-                inst.type = type
-                print "!", rhs
-                if opcode == "phi":
-                    inst.incoming_vars = []
-                    while rhs.strip():
-                        m = re.match(r"\[(.+?) *, *(.+?)\]( *, *)?(.*)", rhs)
-                        var = m.group(1).strip()
-                        label = m.group(2).strip()
-                        rhs = m.group(4)
-                        inst.incoming_vars.append((self.convert_arg(var, type), label[1:]))
+                    func.bblocks
+                    invalidated.add(func.name)
+        return mod, invalidated
+
+    def parse_lines(self, lines):
+        for l in lines:
+            end = len(l)
+            if end and l[-1] == "\n":
+                end -= 1
+            self.parse_line(l, 0, end)
+
+    def parse_range(self, start, end):
+        "Parse lines in [start, end) range of memory-mapped input."
+        buf = self.buf
+        find = buf.find
+        while start < end:
+            eol = find("\n", start, end)
+            if eol == -1:
+                eol = end
+            self.parse_line(buf, start, eol)
+            start = eol + 1
 
+    def parse_range_index(self, start, end):
+        "Like parse_index(), but for memory-mapped input."
+        buf = self.buf
+        find = buf.find
+        while start < end:
+            eol = find("\n", start, end)
+            if eol == -1:
+                eol = end
+            self.parse_line(buf, start, eol)
+            start = eol + 1
+            if self.func:
+                close = find("\n}", start - 1, end)
+                assert close != -1, "Unexpected EOF in body of @" + self.func.name
+                # Hash through buffer, as slicing would copy body out of mmap
+                self.func_hash.update(buffer(buf, start, close + 1 - start))
+                self.defer_body(start, close + 1)
+                start = find("\n", close + 1, end)
+                if start == -1:
+                    break
+                start += 1
+
+    def parse_index(self):
+        """Parse globals and function headers, for each function
+        recording just the offset range of its body in the file."""
+        f = self.f
+        pos = f.tell()
+        for l in iter(f.readline, ""):
+            pos += len(l)
+            self.parse_line(l, 0, len(l.rstrip("\n")))
+            if self.func:
+                start = pos
+                for l in iter(f.readline, ""):
+                    if l[0] == "}":
+                        break
+                    self.func_hash.update(l)
+                    pos += len(l)
                 else:
-                    if opcode == "getelementptr":
-                        t, rhs2 = self.next_token(rhs)
-                        print (t, rhs2)
-                        if t == "inbounds":
-                            inst.inbounds = True
-                            rhs = rhs2
-                    args = self.split(rhs)
-                    if args[-1][0] == "!":
-                        # TODO: make llvmpy compatible
-                        inst.metadata = args[-1]
-                        args = args[:-1]
-                    if args[-1].startswith("align "):
-                        inst.alignment = int(args[-1].split(None, 1)[1])
-                        args = args[:-1]
-                    args = [self.convert_arg(x, type) for x in args]
-                    if opcode == "br" and len(args) == 3:
-                        args = [args[0], args[2], args[1]]
-                    if opcode == "bricmp":
-                        args = [args[0], args[1], args[3], args[2]]
-                    inst.operands = args
-#                    print "out:", str(inst).strip()
-                self.block.append(inst)
-                inst.parent = self.block
+                    assert False, "Unexpected EOF in body of @" + self.func.name
+                self.defer_body(start, pos)
+                pos += len(l)
 
-        return self.mod
+    def defer_body(self, start, end):
+        "Mark body of current function as to be loaded from [start, end)."
+        self.end_hash()
+        self.func.set_body_loader(partial(self.load_body, start=start, end=end))
+        self.body_index.append((self.func, start, end))
+        self.func = None
+
+    def load_body(self, func, start, end):
+        "Parse function body which is at offsets [start, end) of the input."
+        self.start_body(func)
+        if self.buf is None:
+            self.f.seek(start)
+            self.parse_lines(self.f.read(end - start).split("\n"))
+        else:
+            self.parse_range(start, end)
+        self.end_body()
+
+    def parse_body(self, func, lines):
+        "Parse lines of function body (without header and closing brace)."
+        self.start_body(func)
+        self.parse_lines(lines)
+        self.end_body()
+
+    def start_body(self, func):
+        self.func = func
+        self.block = None
+        self.tmp_count = 0
+
+    def end_body(self):
+        self.func = None
+        self.block = None
+
+    def end_hash(self):
+        self.func.source_hash = self.func_hash.hexdigest()
+        self.func_hash = None
+
+    def parse_line(self, s, pos, end):
+        """Parse a line of IR, contained in s[pos:end]."""
+        if self.func_hash is not None:
+            if s[pos:pos + 1] == "}":
+                self.end_hash()
+            else:
+                self.func_hash.update(buffer(s, pos, end - pos))
+                self.func_hash.update("\n")
+        toks = tokenize(s, pos, end)
+        if not toks:
+            return
+        comment = None
+        if toks[-1][1][0] == ";":
+            w, t = toks.pop()
+            comment = w + t
+            if not toks:
+                if comment.startswith("; ModuleID = "):
+                    self.mod.module_id = comment
+                return
+
+        if self.func:
+            self.parse_func_line(toks, comment)
+        else:
+            self.parse_global(toks)
+
+    def parse_global(self, toks):
+        t = toks[0][1]
+        c = t[0]
+        if c == "@":
+            self.parse_global_var(toks)
+        elif c == "!":
+            self.mod.metadata.append(source(toks))
+        elif t == "target":
+            self.mod.target_info.append(source(toks))
+        elif t == "define":
+            self.parse_define(toks)
+
+    def parse_global_var(self, toks):
+        # @g = common global i32 0
+        assert toks[1][1] == "=", "Syntax error in global var: " + source(toks)
+        var = PGlobalVariable()
+        var.name = toks[0][1][1:]
+        i = 2
+        while True:
+            t = toks[i][1]
+            if t in ("private", "internal", "linkonce", "weak", "common"):
+                var.linkage = t
+            elif t == "unnamed_addr":
+                var.unnamed_addr = True
+            elif t == "constant":
+                var.global_constant = True
+            elif t != "global":
+                break
+            i += 1
+        val, i = self.parse_operand(toks, i)
+        if i + 1 < len(toks) and toks[i + 1][1] == "align":
+            var.alignment = int(toks[i + 2][1])
+        # FIXME: var.type apparently should be pointer to
+        var.type_str = var.type = val.type
+        var.initializer = val
+        self.mod.add_global(var)
+
+    def parse_define(self, toks):
+        # define i32 @func(i32 %a, i8* nocapture %b) nounwind {
+        i = 1
+        # Skip linkage, calling convention, etc.
+        while kind(toks[i][1]) == IDENT:
+            i += 1
+        type, i = self.parse_type(toks, i)
+        name = toks[i][1]
+        assert name[0] == "@" and toks[i + 1][1] == "(", "Syntax error in func definition: " + source(toks)
+        i += 2
+        args = []
+        while toks[i][1] != ")":
+            v, i = self.parse_operand(toks, i)
+            arg = PArgument(v.name, v.type)
+            arg.attributes = v.attributes
+            args.append(arg)
+            if toks[i][1] == ",":
+                i += 1
+        mods = [t for w, t in toks[i + 1:]]
+        assert mods and mods[-1] == "{", "Syntax error in func definition: " + source(toks)
+        self.func = PFunction(name[1:], type, args)
+        # Hash covers header and text of the body (fed as it's parsed)
+        self.func_hash = hashlib.sha1(source(toks) + "\n")
+        # Implicit names are numbered per function
+        self.tmp_count = 0
+        self.func.does_not_throw = "nounwind" in mods
+        self.func.readonly = "readonly" in mods
+        self.mod.append(self.func)
+        self.func.parent = self.mod
+
+    def parse_func_line(self, toks, comment):
+        t = toks[0][1]
+        if t == "}":
+            self.block = None
+            self.func = None
+            return
+
+        if t[-1] == ":" and len(toks) == 1:
+            self.make_block(t[:-1], comment)
+            return
+
+        if self.block is None:
+            self.make_block()
+
+        inst = self.parse_inst(toks, comment)
+        self.block.append(inst)
+        if inst.name:
+            v = self.func.values.get(inst.name)
+            if v is None:
+                v = self.func.value(inst.name)
+            v.definition = inst
+
+    def parse_inst(self, toks, comment=None):
+        n = len(toks)
+        i = 0
+        lhs = None
+        if n > 1 and toks[1][1] == "=":
+            lhs = toks[0][1]
+            assert lhs[0] == "%", source(toks)
+            lhs = lhs[1:]
+            i = 2
+        opcode = toks[i][1]
+        i += 1
+        op = get_opcode(opcode)
+        # Optional attributes, instruction is created with them at once
+        extra = {}
+        if comment is not None:
+            extra["comment"] = comment
+        if op.predicate:
+            extra["predicate"] = toks[i][1]
+            i += 1
+        elif opcode == "load":
+            if toks[i][1] == "getelementptr":
+                extra["offseted"] = True
+                i += 1
+        elif opcode == "getelementptr":
+            extra["inbounds"] = inbounds = toks[i][1] == "inbounds"
+            if inbounds:
+                i += 1
+        if op.typing == TYPE_EACH:
+            type = None
+        else:
+            type, i = self.parse_type(toks, i)
+
+        if opcode == "phi":
+            incoming = []
+            while i < n:
+                # [ val, %label ]
+                assert toks[i][1] == "[", source(toks)
+                v, i = self.parse_operand(toks, i + 1, type)
+                incoming.append((v, toks[i + 1][1][1:]))
+                i += 4
+            extra["incoming_vars"] = incoming
+            return PInstruction(lhs, type, opcode, [], **extra)
+
+        args = []
+        while i < n:
+            t = toks[i][1]
+            if t[0] == "!":
+                # TODO: make llvmpy compatible
+                extra["metadata"] = source(toks[i:])
+                break
+            if t == "align":
+                extra["alignment"] = int(toks[i + 1][1])
+                i += 2
+            else:
+                v, i = self.parse_operand(toks, i, type)
+                args.append(v)
+            i += 1
+        order = op.operand_order.get(len(args))
+        if order:
+            args = [args[x] for x in order]
+        return PInstruction(lhs, type, opcode, args, **extra)
+
+
+def _parse_bodies(args):
+    """Worker for parse_parallel(): parse a batch of function bodies.
+    Bodies are returned in flat encoding, as pickling object graph is
+    slower than parsing itself."""
+    path, ranges = args
+    p = IRParser(open(path), use_mmap=True)
+    res = []
+    for start, end in ranges:
+        func = PFunction()
+        p.load_body(func, start, end)
+        res.append(dumps_blocks(func.bblocks))
+    return res
+
+
+def parse_parallel(path, workers=None):
+    """Parse IR file, parsing function bodies in parallel using a pool
+    of worker processes (by default, one per CPU)."""
+    p = IRParser(open(path), use_mmap=True)
+    mod = p.parse(lazy=True)
+    index = p.body_index
+    if workers is None:
+        workers = multiprocessing.cpu_count()
+    if workers <= 1 or len(index) <= 1:
+        for func in mod:
+            func.bblocks
+        return mod
+
+    # Few batches per worker, to amortize per-task overhead while
+    # still balancing the load.
+    batch_size = max(1, len(index) / (workers * 4))
+    batches = []
+    for i in xrange(0, len(index), batch_size):
+        batches.append((path, [(start, end) for f, start, end in index[i:i + batch_size]]))
+    pool = multiprocessing.Pool(workers)
+    try:
+        results = pool.map(_parse_bodies, batches)
+    finally:
+        pool.close()
+        pool.join()
+
+    i = 0
+    with gc_disabled():
+        for res in results:
+            for packed in res:
+                func = index[i][0]
+                i += 1
+                del func._body_loader
+                func.bblocks = []
+                loads_blocks(func, packed)
+    return mod
 
 
 if __name__ == "__main__":
@@ -0,0 +1,129 @@
+"""On-disk cache of parsed IR modules.
+
+Entries are keyed by hash of the input file contents and parser
+version, so stale entries are never used, just eventually evicted.
+Total size of cache is bounded, least recently used entries are
+evicted first (entry's mtime is its last use time)."""
+import os
+import sys
+import hashlib
+import tempfile
+
+from parse import IRParser, PARSER_VERSION
+import serialize
+
+
+DEFAULT_CACHE_DIR = os.path.expanduser("~/.cache/llvm-codegen-py")
+DEFAULT_MAX_SIZE = 256 * 1024 * 1024
+SUFFIX = ".pmod"
+# Should be bumped whenever format of cache entries changes
+CACHE_FORMAT = "2:%d" % serialize.FORMAT_VERSION
+
+
+class ParseCache(object):
+
+    def __init__(self, cache_dir=None, max_size=DEFAULT_MAX_SIZE):
+        if cache_dir is None:
+            cache_dir = DEFAULT_CACHE_DIR
+        self.dir = cache_dir
+        self.max_size = max_size
+        self.hits = 0
+        self.misses = 0
+        if not os.path.isdir(cache_dir):
+            os.makedirs(cache_dir)
+
+    @staticmethod
+    def key(fileobj):
+        "Compute cache key for contents of a file."
+        h = hashlib.sha1()
+        h.update("%s:%s\n" % (PARSER_VERSION, CACHE_FORMAT))
+        for chunk in iter(lambda: fileobj.read(1 << 20), ""):
+            h.update(chunk)
+        return h.hexdigest()
+
+    def entry_path(self, key):
+        return os.path.join(self.dir, key + SUFFIX)
+
+    def get(self, key):
+        "Return cached module for a key, or None."
+        path = self.entry_path(key)
+        try:
+            f = open(path, "rb")
+        except IOError:
+            return None
+        with f:
+            try:
+                mod = serialize.load(f)
+            except Exception:
+                # Truncated or corrupt entry (arbitrary garbage may trip any
+                # of struct, zlib or decoder errors), drop it and reparse
+                mod = None
+        if mod is None:
+            try:
+                os.remove(path)
+            except OSError:
+                pass
+            return None
+        # Mark as recently used
+        os.utime(path, None)
+        return mod
+
+    def put(self, key, mod):
+        fd, tmp = tempfile.mkstemp(SUFFIX + ".tmp", dir=self.dir)
+        try:
+            with os.fdopen(fd, "wb") as f:
+                serialize.dump(mod, f)
+            # Atomic, so concurrent readers never see partial entry
+            os.rename(tmp, self.entry_path(key))
+        except:
+            os.unlink(tmp)
+            raise
+        self.evict()
+
+    def evict(self):
+        "Remove least recently used entries until cache fits max_size."
+        entries = []
+        total = 0
+        for fname in os.listdir(self.dir):
+            if not fname.endswith(SUFFIX):
+                continue
+            path = os.path.join(self.dir, fname)
+            try:
+                st = os.stat(path)
+            except OSError:
+                continue
+            entries.append((st.st_mtime, st.st_size, path))
+            total += st.st_size
+        entries.sort()
+        for mtime, size, path in entries:
+            if total <= self.max_size:
+                break
+            try:
+                os.remove(path)
+            except OSError:
+                pass
+            total -= size
+
+    def parse(self, path):
+        "Parse IR file, using cached result if available."
+        with open(path, "rb") as f:
+            key = self.key(f)
+        mod = self.get(key)
+        if mod is not None:
+            self.hits += 1
+            return mod
+        self.misses += 1
+        with open(path) as f:
+            mod = IRParser(f).parse()
+        self.put(key, mod)
+        return mod
+
+
+def parse_cached(path, cache_dir=None):
+    "Parse IR file through the default (or given directory) cache."
+    return ParseCache(cache_dir).parse(path)
+
+
+if __name__ == "__main__":
+    from pllvm import IRRenderer
+    IRRenderer.render(parse_cached(sys.argv[1]))
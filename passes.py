@@ -0,0 +1,205 @@
+#!/usr/bin/env python
+"""Pass manager.
+
+Passes declare analyses they require and ones they preserve. Analysis
+results are cached per function by AnalysisManager and recomputed only
+after a pass which didn't preserve them (or anything they depend on)
+has run, or after control flow of the function changed.
+
+Pipelines can be given as text, e.g. "phi-resolve,regalloc(K=8),render".
+
+Usage: passes.py <pipeline> <file.ll>"""
+import sys
+import re
+
+from pllvm import *
+from cfg import get_cfg, Dominators
+from liveness import Liveness
+from interference import InterferenceGraph
+from phi_resolver import PhiResolver
+from reg_alloc import RegAlloc
+
+
+# Analyses by name: (function computing result, names of analyses it
+# depends on)
+ANALYSES = {
+    "cfg": (lambda func, am: get_cfg(func), []),
+    "dominators": (lambda func, am: Dominators(am.get(func, "cfg")), ["cfg"]),
+    "liveness": (lambda func, am: Liveness(func, am.get(func, "cfg")), ["cfg"]),
+    "interference": (lambda func, am: InterferenceGraph(func, am.get(func, "liveness")), ["liveness"]),
+}
+
+# Value of Pass.preserves for passes which don't change IR
+ALL = None
+
+
+class AnalysisManager(object):
+
+    def __init__(self):
+        # func -> {name: (result, func.cfg_version)}
+        self.cache = {}
+        # Number of times each analysis was computed
+        self.computed = {}
+
+    def get(self, func, name):
+        "Return result of analysis for function, cached if still valid."
+        results = self.cache.setdefault(func, {})
+        entry = results.get(name)
+        if entry is not None and entry[1] == func.cfg_version:
+            return entry[0]
+        assert name in ANALYSES, "Unknown analysis: " + name
+        res = ANALYSES[name][0](func, self)
+        results[name] = (res, func.cfg_version)
+        self.computed[name] = self.computed.get(name, 0) + 1
+        return res
+
+    def invalidate(self, func, preserved=()):
+        """Drop results of analyses for function, except preserved ones
+        (and which don't depend on dropped ones)."""
+        if preserved is ALL:
+            return
+        results = self.cache.get(func, {})
+        changed = True
+        while changed:
+            changed = False
+            for name in results.keys():
+                deps = ANALYSES[name][1]
+                if name not in preserved or [d for d in deps if d not in results]:
+                    del results[name]
+                    changed = True
+
+
+class Pass(object):
+    """Base class of passes. Function passes define run_on_function(),
+    module passes override run()."""
+    name = None
+    # Names of analyses the pass uses, and ones it keeps valid
+    requires = []
+    preserves = []
+
+    def __init__(self, **params):
+        self.params = params
+
+    def run(self, mod, am):
+        for func in mod:
+            if func.is_declaration:
+                continue
+            analyses = dict((a, am.get(func, a)) for a in self.requires)
+            self.run_on_function(func, analyses)
+            am.invalidate(func, self.preserves)
+
+    def run_on_function(self, func, analyses):
+        raise NotImplementedError
+
+    def __repr__(self):
+        params = ",".join("%s=%s" % x for x in sorted(self.params.items()))
+        if params:
+            return "%s(%s)" % (self.name, params)
+        return self.name
+
+
+class PhiResolvePass(Pass):
+    name = "phi-resolve"
+    # Inserts moves and removes phis, but doesn't change control flow
+    preserves = ["cfg", "dominators"]
+
+    def run_on_function(self, func, analyses):
+        PhiResolver.convert_func(func)
+
+
+class RegAllocPass(Pass):
+    "Params: K - number of registers."
+    name = "regalloc"
+    requires = ["liveness", "interference"]
+    preserves = ["cfg", "dominators"]
+
+    def run_on_function(self, func, analyses):
+        ra = RegAlloc(func, self.params.get("K", 8), analyses["liveness"], analyses["interference"])
+        ra.alloc()
+        ra.rewrite_regs()
+
+
+class RenderPass(Pass):
+    "Params: implicit_labels (0 or 1)."
+    name = "render"
+    preserves = ALL
+
+    def __init__(self, out=None, **params):
+        Pass.__init__(self, **params)
+        self.out = out
+
+    def run(self, mod, am):
+        out = self.out or sys.stdout
+        IRRenderer.render(mod, out, implicit_labels=bool(self.params.get("implicit_labels", 1)))
+
+
+PASSES = {}
+
+def register_pass(cls):
+    PASSES[cls.name] = cls
+    return cls
+
+for cls in (PhiResolvePass, RegAllocPass, RenderPass):
+    register_pass(cls)
+
+
+PASS_SPEC = re.compile(r"\s*([\w-]+)\s*(?:\((.*)\))?\s*$")
+
+def split_spec(spec):
+    "Split pipeline spec on commas which are outside of parens."
+    res = []
+    depth = 0
+    start = 0
+    for n, c in enumerate(spec):
+        if c == "(":
+            depth += 1
+        elif c == ")":
+            depth -= 1
+        elif c == "," and depth == 0:
+            res.append(spec[start:n])
+            start = n + 1
+    res.append(spec[start:])
+    return res
+
+def parse_pipeline(spec):
+    "Make list of passes from pipeline spec like 'phi-resolve,regalloc(K=8)'."
+    passes = []
+    for p in split_spec(spec):
+        m = PASS_SPEC.match(p)
+        assert m, "Syntax error in pipeline: " + p
+        name, args = m.groups()
+        assert name in PASSES, "Unknown pass: " + name
+        params = {}
+        if args and args.strip():
+            for a in args.split(","):
+                k, v = a.split("=", 1)
+                v = v.strip()
+                params[k.strip()] = int(v) if v.lstrip("-").isdigit() else v
+        passes.append(PASSES[name](**params))
+    return passes
+
+
+class PassManager(object):
+
+    def __init__(self, passes, am=None):
+        "passes is a list of Pass objects or a pipeline spec string."
+        if isinstance(passes, str):
+            passes = parse_pipeline(passes)
+        self.passes = passes
+        self.am = am or AnalysisManager()
+
+    def run(self, mod):
+        for p in self.passes:
+            p.run(mod, self.am)
+        return mod
+
+
+if __name__ == "__main__":
+    from parse import IRParser
+    if len(sys.argv) != 3:
+        print __doc__
+        sys.exit(1)
+    pm = PassManager(sys.argv[1])
+    with open(sys.argv[2]) as f:
+        mod = IRParser(f).parse()
+    pm.run(mod)
@@ -5,21 +5,37 @@ import re
 from pllvm import *
 
 
+PHI = get_opcode("phi")
+
+
 class PhiResolver(object):
 
     @classmethod
     def convert(cls, mod):
         for f in mod.functions:
-            for b in f:
-                for i in b.instructions():
-                    if i.opcode_name == "phi":
-                        for var, label in i.incoming_vars:
-                            block = f[label]
-                            mov = PInstruction(i.name, i.type, "mov", [var])
-                            # Insert move before the last instruction of block,
-                            # which is got to be control transfer instruction.
-                            block.insert(len(block) - 1, mov)
-                        b.remove(i)
+            cls.convert_func(f)
+
+    @classmethod
+    def convert_func(cls, f):
+        for n in xrange(len(f.bblocks)):
+            b = f[n]
+            if not [i for i in b if i.opcode is PHI]:
+                continue
+            # Function may share blocks with its clones
+            b = f.writable(b)
+            for i in b:
+                if i.opcode is PHI:
+                    for var, label in i.incoming_vars:
+                        block = f.writable(f[label])
+                        mov = PInstruction(i.name, i.type, "mov", [var])
+                        # Insert move before control transfer instruction
+                        # at the end of block.
+                        last = block.last
+                        if last is not None and last.opcode.terminator:
+                            block.insert_before(last, mov)
+                        else:
+                            block.append(mov)
+                    b.remove(i)
 
 
 if __name__ == "__main__":
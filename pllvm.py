@@ -1,6 +1,13 @@
 #!/usr/bin/env python
 import sys
 import re
+import gc
+import multiprocessing
+import shutil
+import tempfile
+from contextlib import contextmanager
+
+from ptypes import get_type, PPointerType, PFunctionType
 
 
 ATTR_NO_CAPTURE = "ATTR_NO_CAPTURE"
@@ -8,8 +15,163 @@ LINKAGE_COMMON = "common"
 
 INDENT = "  "
 
+LABEL_TYPE = get_type("label")
+
+@contextmanager
+def gc_disabled():
+    """Disable cyclic garbage collector while building large object
+    graphs: otherwise it repeatedly rescans all the new (but alive)
+    objects, which may take more time than building them."""
+    enabled = gc.isenabled()
+    gc.disable()
+    try:
+        yield
+    finally:
+        if enabled:
+            gc.enable()
+
+class Extra(object):
+    """Optional attribute of a compact (slotted) IR object. Such object
+    has a single _extra slot, which is None until any optional attribute
+    is set, and then holds a side dict of them. So rarely used attributes
+    cost nothing for most objects."""
+
+    def __init__(self, name, default=None):
+        self.name = name
+        self.default = default
+
+    def __get__(self, obj, cls):
+        if obj is None:
+            return self
+        extra = obj._extra
+        if extra is None:
+            return self.default
+        return extra.get(self.name, self.default)
+
+    def __set__(self, obj, value):
+        extra = obj._extra
+        if extra is None:
+            extra = {}
+            object.__setattr__(obj, "_extra", extra)
+        extra[self.name] = value
+
+    def __delete__(self, obj):
+        if obj._extra is not None:
+            obj._extra.pop(self.name, None)
+
+def has_extra(obj, name):
+    "Check if optional attribute was set on an object."
+    return obj._extra is not None and name in obj._extra
+
+
+# Rendered text of instructions in blocks is cached (see
+# PInstruction.__str__()). Setting attributes which affect rendering
+# drops affected texts: of the instruction itself, or of instructions
+# using a local value. Other operands (constants, labels, globals) may
+# be shared by any instructions, so their changes drop all texts, by
+# bumping text epoch. Their changes are rare, unlike renaming of local
+# values (e.g. by register allocation).
+_text_epoch = 0
+
+def invalidate_texts():
+    "Drop all cached texts of instructions."
+    global _text_epoch
+    _text_epoch += 1
+
+def _tracked_setattr(self, name, value):
+    object.__setattr__(self, name, value)
+    if name in self.rendered_attrs:
+        self.dirty()
+
+def _tracked_delattr(self, name):
+    object.__delattr__(self, name)
+    if name in self.rendered_attrs:
+        self.dirty()
+
+# Set attribute which doesn't affect rendering, bypassing __setattr__ (in
+# hot paths)
+set_untracked = object.__setattr__
+
+def _dirty_users(self):
+    "Drop cached texts of instructions using the value."
+    # Attributes are set one by one when unpickling
+    for i in getattr(self, "users", ()):
+        i.dirty()
+
+def _invalidate_texts(self):
+    invalidate_texts()
+
+
+class OperandList(list):
+    """List of operands (or phi incoming values) of an instruction or
+    constant expression. In-place changes drop cached texts, by calling
+    owner's dirty(), and keep def-use chains, by calling its relink()
+    with local values used before and after the change, if its
+    links_uses() is true."""
+    __slots__ = ("owner",)
+
+    def __reduce__(self):
+        return (operand_list, (self.owner, list(self)))
+
+def used_locals(l):
+    """Return list of local values in list of operands or of phi
+    incoming (value, label) pairs."""
+    res = []
+    for x in l:
+        if x.__class__ is tuple:
+            x = x[0]
+        if isinstance(x, LOCAL_VALUES):
+            res.append(x)
+    return res
+
+def _list_mutator(name):
+    method = getattr(list, name)
+    def mutator(self, *args, **kwargs):
+        owner = self.owner
+        if owner.links_uses():
+            old = used_locals(self)
+            res = method(self, *args, **kwargs)
+            owner.relink(old, used_locals(self))
+        else:
+            res = method(self, *args, **kwargs)
+        owner.dirty()
+        return res
+    mutator.__name__ = name
+    return mutator
+
+for _name in ("__setitem__", "__delitem__", "__setslice__", "__delslice__",
+              "__iadd__", "__imul__", "append", "extend", "insert", "pop",
+              "remove", "reverse", "sort"):
+    setattr(OperandList, _name, _list_mutator(_name))
+del _name
+
+class PendingUsers(list):
+    """Users list of a value of function whose instructions are made on
+    demand (see columnar.py). Until owner's materialize() is called, it
+    lacks uses by instructions which weren't made yet."""
+    __slots__ = ("owner",)
+
+def all_users(v):
+    "Return complete users list of local value (see PendingUsers)."
+    if v.users.__class__ is PendingUsers:
+        v.users.owner.materialize()
+    return v.users
+
+def operand_list(owner, l):
+    "Return l as OperandList of owner (copying it, if it isn't one)."
+    if l.__class__ is not OperandList or l.owner is not owner:
+        l = OperandList(l)
+        l.owner = owner
+    return l
+
 def prim_type(type):
-    return type.split(" ", 1)[0]
+    "Return result type for a function (pointer) type, else type itself."
+    t = get_type(str(type))
+    if isinstance(t, PPointerType) and isinstance(t.pointee, PFunctionType):
+        t = t.pointee
+    if isinstance(t, PFunctionType):
+        return t.return_type
+    return t
 
 def render_arg(arg):
     if isinstance(arg, PConstantInt):
@@ -23,7 +185,7 @@ def render_untyped_arg(arg):
 def render_typed_arg(arg):
     if isinstance(arg, str):
         return arg
-    attrs = getattr(arg, "attributes", set())
+    attrs = getattr(arg, "attributes", ())
     flags = ""
     if ATTR_NO_CAPTURE in attrs:
         flags += " nocapture"
@@ -47,16 +209,100 @@ def render_types(args):
     return ", ".join([str(x.type) for x in args])
 
 
+class SymbolTable(object):
+    """Index of a list of named objects, by name and by position.
+    Owner of the list adds objects to it as they're added to the list.
+    Lookups check that the found object still has that name and is in
+    the list, so objects renamed, removed or replaced by direct edits of
+    the list are handled too, by reindexing."""
+
+    def __init__(self):
+        self.names = {}
+        self.positions = {}
+
+    def add(self, obj, pos):
+        self.names.setdefault(obj.name, obj)
+        self.positions[obj] = pos
+
+    def remove(self, obj):
+        if self.names.get(obj.name) is obj:
+            del self.names[obj.name]
+        self.positions.pop(obj, None)
+
+    def index(self, l, obj):
+        """Return position of obj in list l. O(1) as long as objects
+        don't move, otherwise positions are recomputed."""
+        pos = self.positions.get(obj)
+        if pos is None or pos >= len(l) or l[pos] is not obj:
+            self.positions = dict((x, n) for n, x in enumerate(l))
+            try:
+                pos = self.positions[obj]
+            except KeyError:
+                raise ValueError("%s is not in list" % obj.name)
+        return pos
+
+    def get(self, l, name):
+        "Return first object of list l with given name, or None."
+        obj = self.names.get(name)
+        if obj is not None and obj.name == name:
+            try:
+                self.index(l, obj)
+                return obj
+            except ValueError:
+                pass
+        self.names = {}
+        for x in reversed(l):
+            self.names[x.name] = x
+        return self.names.get(name)
+
+
 class PModule(object):
     def __init__(self):
         self.functions = []
         self.global_variables = []
+        # Symbol tables for the above
+        self._functions = SymbolTable()
+        self._globals = SymbolTable()
         self.target_info = []
         self.metadata = []
         self.module_id = None
-
-    def append(self, inst):
-        self.functions.append(inst)
+        # Canonical reference object for each global name
+        self.global_refs = {}
+
+    def global_ref(self, name, type=None):
+        "Return shared PGlobalVariableRef for a global name."
+        v = self.global_refs.get(name)
+        if v is None:
+            v = self.global_refs[name] = PGlobalVariableRef(name, type)
+        elif v.type is None:
+            v.type = type
+        return v
+
+    def append(self, func):
+        self.functions.append(func)
+        self._functions.add(func, len(self.functions) - 1)
+
+    def remove(self, func):
+        self.functions.remove(func)
+        self._functions.remove(func)
+
+    def replace(self, func, new):
+        "Replace function with another one, at the same position."
+        n = self.index(func)
+        self.functions[n] = new
+        self._functions.remove(func)
+        self._functions.add(new, n)
+
+    def add_global(self, var):
+        self.global_variables.append(var)
+        self._globals.add(var, len(self.global_variables) - 1)
+
+    def global_variable(self, name):
+        "Return global variable by name, or None."
+        return self._globals.get(self.global_variables, name)
+
+    def index(self, func):
+        return self._functions.index(self.functions, func)
 
     def __iter__(self):
         return iter(self.functions)
@@ -64,11 +310,7 @@ class PModule(object):
     def __getitem__(self, key):
         if isinstance(key, int):
             return self.functions[key]
-        else:
-            for f in self:
-                if f.name == key:
-                    return f
-        return None
+        return self._functions.get(self.functions, key)
 
 
 class PGlobalVariable(object):
@@ -102,10 +344,31 @@ class PGlobalVariable(object):
         return self.__str__()
 
 
+def slot_setters(cls):
+    """Return setters of slots of class (in __slots__ order), which
+    bypass its __setattr__. They're used to initialize objects, as there
+    are no cached texts to drop yet, and in other hot paths."""
+    return tuple(getattr(cls, name).__set__ for name in cls.__slots__)
+
+
 class PArgument(object):
+    # id is number of value in its function's value table, users is
+    # list of instructions using it (one entry per use)
+    __slots__ = ("name", "type", "id", "definition", "users", "_extra")
+    attributes = Extra("attributes", frozenset())
+    rendered_attrs = frozenset(["name", "type", "attributes"])
+    __setattr__ = _tracked_setattr
+    __delattr__ = _tracked_delattr
+    dirty = _dirty_users
+
     def __init__(self, name, type):
-        self.name = name
-        self.type = type
+        set_name, set_type, set_id, set_definition, set_users, set_extra = _argument_setters
+        set_name(self, name)
+        set_type(self, type)
+        set_id(self, None)
+        set_definition(self, None)
+        set_users(self, [])
+        set_extra(self, None)
 
     def __str__(self):
         return "%" + self.name
@@ -113,10 +376,21 @@ class PArgument(object):
     def __repr__(self):
         return self.__str__()
 
+_argument_setters = slot_setters(PArgument)
+
 class PGlobalVariableRef(object):
+    __slots__ = ("name", "type", "_extra")
+    attributes = Extra("attributes", frozenset())
+    rendered_attrs = frozenset(["name", "type", "attributes"])
+    __setattr__ = _tracked_setattr
+    __delattr__ = _tracked_delattr
+    dirty = _invalidate_texts
+
     def __init__(self, name, type):
-        self.name = name
-        self.type = type
+        set_name, set_type, set_extra = _global_ref_setters
+        set_name(self, name)
+        set_type(self, type)
+        set_extra(self, None)
 
     def __str__(self):
         return "@" + self.name
@@ -124,10 +398,19 @@ class PGlobalVariableRef(object):
     def __repr__(self):
         return self.__str__()
 
+_global_ref_setters = slot_setters(PGlobalVariableRef)
+
 class PConstantInt(object):
+    __slots__ = ("value", "type")
+    rendered_attrs = frozenset(__slots__)
+    __setattr__ = _tracked_setattr
+    __delattr__ = _tracked_delattr
+    dirty = _invalidate_texts
+
     def __init__(self, value, type):
-        self.value = value
-        self.type = type
+        set_value, set_type = _constant_int_setters
+        set_value(self, value)
+        set_type(self, type)
 
     def __str__(self):
         return str(self.value)
@@ -135,10 +418,21 @@ class PConstantInt(object):
     def __repr__(self):
         return self.__str__()
 
+_constant_int_setters = slot_setters(PConstantInt)
+
 class PConstantDataArray(object):
+    __slots__ = ("value", "type", "_extra")
+    attributes = Extra("attributes", frozenset())
+    rendered_attrs = frozenset(["value", "type", "attributes"])
+    __setattr__ = _tracked_setattr
+    __delattr__ = _tracked_delattr
+    dirty = _invalidate_texts
+
     def __init__(self, v, type):
-        self.value = v
-        self.type = type
+        set_value, set_type, set_extra = _data_array_setters
+        set_value(self, v)
+        set_type(self, type)
+        set_extra(self, None)
 #        m = re.match(r"\[.+? x .+?\] (.+)", str(v))
 #        self.value = m.group(1)
 
@@ -148,11 +442,28 @@ class PConstantDataArray(object):
     def __repr__(self):
         return self.__str__()
 
+_data_array_setters = slot_setters(PConstantDataArray)
+
 # Virtual objects
 class PTmpVariable(object):
+    # id is number of value in its function's value table, definition
+    # is instruction defining the value, users is list of instructions
+    # using it (one entry per use)
+    __slots__ = ("name", "type", "id", "definition", "users", "_extra")
+    attributes = Extra("attributes", frozenset())
+    rendered_attrs = frozenset(["name", "type", "attributes"])
+    __setattr__ = _tracked_setattr
+    __delattr__ = _tracked_delattr
+    dirty = _dirty_users
+
     def __init__(self, name, type):
-        self.name = name
-        self.type = type
+        set_name, set_type, set_id, set_definition, set_users, set_extra = _tmp_setters
+        set_name(self, name)
+        set_type(self, type)
+        set_id(self, None)
+        set_definition(self, None)
+        set_users(self, [])
+        set_extra(self, None)
 
     def __str__(self):
         return "%" + self.name
@@ -160,10 +471,21 @@ class PTmpVariable(object):
     def __repr__(self):
         return self.__str__()
 
+_tmp_setters = slot_setters(PTmpVariable)
+
 class PLabelRef(object):
+    __slots__ = ("name", "_extra")
+    type = LABEL_TYPE
+    attributes = Extra("attributes", frozenset())
+    rendered_attrs = frozenset(["name", "attributes"])
+    __setattr__ = _tracked_setattr
+    __delattr__ = _tracked_delattr
+    dirty = _invalidate_texts
+
     def __init__(self, name):
-        self.name = name
-        self.type = "label"
+        set_name, set_extra = _label_setters
+        set_name(self, name)
+        set_extra(self, None)
 
     def __str__(self):
         return "%" + self.name
@@ -171,13 +493,32 @@ class PLabelRef(object):
     def __repr__(self):
         return self.__str__()
 
+_label_setters = slot_setters(PLabelRef)
+
+# Values local to a function, tracked by def-use chains
+LOCAL_VALUES = (PArgument, PTmpVariable)
+
+
 class PConstantExpr(object):
+    __slots__ = ("type", "opcode_name", "operands")
+    rendered_attrs = frozenset(__slots__)
+    __delattr__ = _tracked_delattr
+    dirty = _invalidate_texts
 
     def __init__(self):
         self.type = None
         self.opcode_name = None
         self.operands = []
 
+    def __setattr__(self, name, value):
+        if name == "operands":
+            value = operand_list(self, value)
+        _tracked_setattr(self, name, value)
+
+    def links_uses(self):
+        # Uses in constant expressions aren't in def-use chains
+        return False
+
     def __str__(self):
         return "%s(%s)" % (self.opcode_name, render_typed_args(self.operands))
 
@@ -185,17 +526,311 @@ class PConstantExpr(object):
         return self.__str__()
 
 
+def render_generic(i):
+    if i.name:
+        return "%%%s = %s %s %s" % (i.name, i.opcode_name, i.type, render_untyped_args(i.operands))
+    return "%s %s" % (i.opcode_name, ", ".join([render_arg(x) for x in i.operands]))
+
+def render_load(i):
+    if not i.name:
+        return render_generic(i)
+    if len(i.operands) == 1:
+        s = "%%%s = %s %s" % (i.name, i.opcode_name, render_arg(i.operands[0]))
+    else:
+        # Extended MEM[p + N] form
+        s = "%%%s = %s getelementptr %s" % (i.name, i.opcode_name, render_typed_args(i.operands))
+    if i.alignment:
+        s += ", align %d" % i.alignment
+    if i.metadata:
+        s += ", " + i.metadata
+    return s
+
+def render_icmp(i):
+    if not i.name:
+        return render_generic(i)
+    return "%%%s = %s %s %s %s" % (i.name, i.opcode_name, i.predicate, i.operands[0].type, render_untyped_args(i.operands))
+
+def render_phi(i):
+    args = ", ".join(["[ %s, %%%s ]" % x for x in i.incoming_vars])
+    return "%%%s = %s %s %s" % (i.name, i.opcode_name, i.type, args)
+
+def render_call(i):
+    if not i.name:
+        return render_generic(i)
+    func = i.operands[-1]
+    args = i.operands[:-1]
+    if func.vararg:
+        return "%%%s = %s %s %s(%s)" % (i.name, i.opcode_name, func.type, func, render_typed_args(args))
+    return "%%%s = %s %s %s(%s)" % (i.name, i.opcode_name, i.type, func, render_typed_args(args))
+
+def render_gep(i):
+    if not i.name:
+        return render_generic(i)
+    op = "getelementptr"
+    if i.inbounds:
+        op += " inbounds"
+    return "%%%s = %s %s" % (i.name, op, render_typed_args(i.operands))
+
+def render_ret(i):
+    if i.name:
+        return render_generic(i)
+    return "%s %s %s" % (i.opcode_name, i.operands[0].type, i.operands[0])
+
+def render_store(i):
+    if i.name:
+        return render_generic(i)
+    return "%s %s, %s" % (i.opcode_name, render_arg(i.operands[0]), render_arg(i.operands[1]))
+
+def render_branch(i):
+    if i.name:
+        return render_generic(i)
+    args = i.operands
+    order = i.opcode.operand_order.get(len(args))
+    if order:
+        args = [args[x] for x in order]
+    s = i.opcode_name
+    if i.opcode.predicate:
+        s += " " + i.predicate
+    return "%s %s" % (s, ", ".join([render_arg(x) for x in args]))
+
+
+def succ_next(i):
+    "Successor of non-branch instruction is the next one."
+    if i.next is not None:
+        return [i.next]
+    # Return first instruction of next block
+    b = i.parent
+    f = b.parent
+    return [f[f.index(b) + 1].first]
+
+def succ_none(i):
+    return []
+
+def succ_br(i):
+    if len(i.operands) == 3:
+        labels = [i.operands[1].name, i.operands[2].name]
+    else:
+        labels = [i.operands[0].name]
+    func = i.parent.parent
+    return [func[l][0] for l in labels]
+
+def succ_bricmp(i):
+    labels = [i.operands[2].name, i.operands[3].name]
+    func = i.parent.parent
+    return [func[l][0] for l in labels]
+
+
+# Operand typing rules: one type for the instruction, applying to all
+# operands, or each operand has its own type.
+TYPE_COMMON = "common"
+TYPE_EACH = "each"
+
+
+class Opcode(object):
+    """Descriptor of an instruction opcode, registered in opcode table
+    with unique integer id."""
+
+    def __init__(self, name, terminator=False, result=True, typing=TYPE_COMMON,
+                 predicate=False, operand_order={}, render=render_generic, succ=succ_next):
+        self.id = None
+        self.name = name
+        self.terminator = terminator
+        # Whether instruction defines a value
+        self.result = result
+        self.typing = typing
+        # Whether there's a predicate between opcode and operands
+        self.predicate = predicate
+        # Maps number of operands to order of operands in text, if
+        # it's different from the order in PInstruction.operands
+        self.operand_order = operand_order
+        self.render = render
+        self.succ = succ
+
+    def __repr__(self):
+        return "<Opcode %d %s>" % (self.id, self.name)
+
+
+# Opcodes by id and by name
+OPCODES = []
+OPCODE_MAP = {}
+
+def register_opcode(name, **kwargs):
+    op = Opcode(name, **kwargs)
+    op.id = len(OPCODES)
+    OPCODES.append(op)
+    OPCODE_MAP[name] = op
+    return op
+
+def get_opcode(name):
+    """Return descriptor for opcode name. Unknown opcodes are registered
+    with default properties."""
+    op = OPCODE_MAP.get(name)
+    if op is None:
+        op = register_opcode(name)
+    return op
+
+register_opcode("ret", terminator=True, result=False, render=render_ret, succ=succ_none)
+register_opcode("br", terminator=True, result=False, operand_order={3: (0, 2, 1)},
+                render=render_branch, succ=succ_br)
+register_opcode("unreachable", terminator=True, result=False, succ=succ_none)
+for name in ("add", "sub", "mul", "udiv", "sdiv", "urem", "srem",
+             "shl", "lshr", "ashr", "and", "or", "xor", "alloca", "select"):
+    register_opcode(name)
+register_opcode("load", typing=TYPE_EACH, render=render_load)
+register_opcode("store", typing=TYPE_EACH, result=False, render=render_store)
+register_opcode("getelementptr", typing=TYPE_EACH, render=render_gep)
+register_opcode("icmp", predicate=True, render=render_icmp)
+register_opcode("phi", render=render_phi)
+register_opcode("call", render=render_call)
+# Target pseudo-instructions
+register_opcode("mov")
+register_opcode("bricmp", terminator=True, result=False, predicate=True,
+                operand_order={4: (0, 1, 3, 2)}, render=render_branch, succ=succ_bricmp)
+
+
 class PInstruction(object):
+    # prev/next link instructions of a block, order increases along it,
+    # _text is cached rendered text, valid while text epoch is _epoch
+    __slots__ = ("name", "type", "opcode", "operands", "parent", "prev", "next",
+                 "order", "_text", "_epoch", "_extra")
+    # Attributes which only some instructions have
+    comment = Extra("comment")
+    metadata = Extra("metadata")
+    alignment = Extra("alignment")
+    predicate = Extra("predicate")
+    inbounds = Extra("inbounds", False)
+    offseted = Extra("offseted", False)
+    # For phi: list of (value, label name)
+    incoming_vars = Extra("incoming_vars")
+    rendered_attrs = frozenset(["name", "type", "opcode", "operands", "comment", "metadata",
+                                "alignment", "predicate", "inbounds", "offseted",
+                                "incoming_vars"])
 
     def __init__(self, *args, **kwargs):
-        self.comment = None
-        self.metadata = None
-        self.alignment = None
-        if args or kwargs:
-            self.name, self.type, self.opcode_name, self.operands = args
+        """Takes name, type, opcode name and operands, or nothing. Keyword
+        args set optional attributes (comment, alignment, etc.)."""
+        (set_name, set_type, set_opcode, set_operands, set_parent, set_prev, set_next,
+         set_order, set_text, set_epoch, set_extra) = _inst_setters
+        set_parent(self, None)
+        set_prev(self, None)
+        set_next(self, None)
+        set_order(self, 0)
+        # _epoch is set along with text
+        set_text(self, None)
+        if args:
+            name, type, opcode_name, operands = args
+            set_name(self, name)
+            set_type(self, type)
+            set_opcode(self, get_opcode(opcode_name))
+        else:
+            set_name(self, None)
+            set_type(self, "?type")
+            set_opcode(self, None)
+            operands = []
+        set_operands(self, operand_list(self, operands))
+        if kwargs:
+            if kwargs.get("incoming_vars") is not None:
+                kwargs["incoming_vars"] = operand_list(self, kwargs["incoming_vars"])
+            set_extra(self, kwargs)
+        else:
+            set_extra(self, None)
+
+    def __setattr__(self, name, value):
+        if name in self.rendered_attrs:
+            if name == "operands" or name == "incoming_vars":
+                # Operands aren't set yet when unpickling, then chains are
+                # restored as they were
+                old = getattr(self, name, None)
+                if value is not None:
+                    value = operand_list(self, value)
+                object.__setattr__(self, name, value)
+                if (old is not None or name == "incoming_vars") and self.links_uses():
+                    self.relink(used_locals(old or ()), used_locals(value or ()))
+            else:
+                object.__setattr__(self, name, value)
+            _set_inst_text(self, None)
         else:
-            self.type = "?type"
-            self.operands = []
+            object.__setattr__(self, name, value)
+
+    def __delattr__(self, name):
+        if name == "incoming_vars" and self.links_uses():
+            self.relink(used_locals(self.incoming_vars or ()), ())
+        _tracked_delattr(self, name)
+
+    def links_uses(self):
+        "Check if instruction's uses are in def-use chains (it's in a block)."
+        return self.parent is not None
+
+    def relink(self, old, new):
+        "Update def-use chains for used local values changing from old to new."
+        if old == new:
+            return
+        for v in old:
+            v.users.remove(self)
+        for v in new:
+            v.users.append(self)
+
+    @property
+    def opcode_name(self):
+        return self.opcode.name
+
+    @opcode_name.setter
+    def opcode_name(self, name):
+        self.opcode = get_opcode(name)
+
+    def used_values(self):
+        """Return list of local values (arguments and temporaries) used
+        by instruction, including phi incoming ones."""
+        res = [op for op in self.operands if isinstance(op, LOCAL_VALUES)]
+        if self.incoming_vars:
+            res.extend([v for v, l in self.incoming_vars if isinstance(v, LOCAL_VALUES)])
+        return res
+
+    def set_operand(self, n, v):
+        """Replace n-th operand, keeping def-use chains (and control-flow
+        graph, if it's a branch target)."""
+        old = self.operands[n]
+        if self.parent is not None:
+            f = self.parent.parent
+            if f is not None and self.opcode.terminator \
+                    and (isinstance(old, PLabelRef) or isinstance(v, PLabelRef)):
+                f.cfg_version += 1
+        # Operand list updates def-use chains
+        self.operands[n] = v
+
+    def copy(self):
+        "Return copy of instruction, not linked to any block."
+        i = self.__class__()
+        i.name = self.name
+        i.type = self.type
+        i.opcode = self.opcode
+        i.operands = self.operands
+        if self._extra is not None:
+            i._extra = dict(self._extra)
+            if self.incoming_vars is not None:
+                i.incoming_vars = self.incoming_vars
+        return i
+
+    def replace_uses_of(self, old, make_new):
+        """Replace uses of local value old (including its separate use
+        objects) with make_new(use), keeping def-use chains."""
+        users = old.users
+        for k, op in enumerate(self.operands):
+            if getattr(op, "users", None) is users:
+                self.set_operand(k, make_new(op))
+        if self.incoming_vars:
+            self.incoming_vars = [(make_new(v) if getattr(v, "users", None) is users else v, l)
+                                  for v, l in self.incoming_vars]
+
+    def erase(self):
+        """Remove instruction from its block, unlinking it from def-use
+        chains. Value it defines must not have users left."""
+        f = self.parent.parent
+        v = f.values.get(self.name) if self.name and f is not None else None
+        if v is not None and v.definition is self:
+            assert not all_users(v), "%s still has users: %s" % (v, v.users)
+            v.definition = None
+        self.parent.remove(self)
 
     def defines(self):
         if self.name:
@@ -213,143 +848,546 @@ class PInstruction(object):
         return uses
 
     def succ(self):
-        if self.opcode_name == "ret":
-            return []
-        elif self.opcode_name == "br":
-            if len(self.operands) == 3:
-                labels = [self.operands[1].name, self.operands[2].name]
-            else:
-                labels = [self.operands[0].name]
-            func = self.parent.parent
-            return [func[l][0] for l in labels]
-        elif self.opcode_name == "bricmp":
-            labels = [self.operands[2].name, self.operands[3].name]
-            func = self.parent.parent
-            return [func[l][0] for l in labels]
-        else:
-            b = self.parent
-            i = b.index(self)
-            if i < len(b) - 1:
-                return [b[i + 1]]
-            else:
-                # Return first instruction of next block
-                f = b.parent
-                ib = f.index(b)
-                return [f[ib + 1][0]]
+        return self.opcode.succ(self)
 
-    def __str__(self):
-        if self.name:
-            if self.opcode_name == "load":
-                if len(self.operands) == 1:
-                    s = INDENT + "%%%s = %s %s" % (self.name, self.opcode_name, render_arg(self.operands[0]))
-                else:
-                    # Extended MEM[p + N] form
-                    s = INDENT + "%%%s = %s getelementptr %s" % (self.name, self.opcode_name, render_typed_args(self.operands))
-                if self.alignment:
-                    s += ", align %d" % self.alignment
-                if self.metadata:
-                    s += ", " + self.metadata
-            elif self.opcode_name == "icmp":
-                s = INDENT + "%%%s = %s %s %s %s" % (self.name, self.opcode_name, self.predicate, self.operands[0].type, render_untyped_args(self.operands))
-            elif self.opcode_name == "phi":
-                args = ", ".join(["[ %s, %%%s ]" % x for x in self.incoming_vars])
-                s = INDENT + "%%%s = %s %s %s" % (self.name, self.opcode_name, self.type, args)
-            elif self.opcode_name == "call":
-                func = self.operands[-1]
-                args = self.operands[:-1]
-                if func.vararg:
-                    s = INDENT + "%%%s = %s %s %s(%s)" % (self.name, self.opcode_name, func.type, func, render_typed_args(args))
-                else:
-                    s = INDENT + "%%%s = %s %s %s(%s)" % (self.name, self.opcode_name, self.type, func, render_typed_args(args))
-            elif self.opcode_name == "getelementptr":
-                op = "getelementptr"
-                if self.inbounds:
-                    op += " inbounds"
-                s = INDENT + "%%%s = %s %s" % (self.name, op, render_typed_args( self.operands))
-            else:
-                s = INDENT + "%%%s = %s %s %s" % (self.name, self.opcode_name, self.type, render_untyped_args(self.operands))
+    def render(self):
+        "Render text of instruction (not cached)."
+        if not self.name and not self.operands:
+            # Not completely initialized inst, still render for parser, etc. debugging
+            s = INDENT + "%s ???" % self.opcode_name
         else:
-            if len(self.operands) == 0:
-                # Not completely initialized inst, still render for parser, etc. debugging
-                s = INDENT + "%s ???" % self.opcode_name
-            elif self.opcode_name == "ret":
-                s = INDENT + "%s %s %s" % (self.opcode_name, self.operands[0].type, self.operands[0])
-            elif self.opcode_name == "store":
-                s = INDENT + "%s %s, %s" % (self.opcode_name, render_arg(self.operands[0]), render_arg(self.operands[1]))
-            elif self.opcode_name == "br":
-                args_no = [0]
-                if len(self.operands) == 3:
-                    args_no = [0, 2, 1]
-                s = INDENT + "%s %s" % (self.opcode_name, ", ".join([render_arg(self.operands[x]) for x in args_no]))
-            elif self.opcode_name == "bricmp":
-                args_no = [0, 1, 3, 2]
-                s = INDENT + "%s %s %s" % (self.opcode_name, self.predicate, ", ".join([render_arg(self.operands[x]) for x in args_no]))
-            else:
-                s = INDENT + "%s %s" % (self.opcode_name, ", ".join([render_arg(x) for x in self.operands]))
+            s = INDENT + self.opcode.render(self)
+        extra = self._extra
+        if extra is not None and extra.get("comment"):
+            s += extra["comment"]
+        return s
 
-        if self.comment:
-            s += self.comment
+    def dirty(self):
+        """Drop cached text of instruction. Attribute assignments and
+        changes of operand lists and of values used do it by themselves,
+        so it's needed only after other in-place changes (e.g. of
+        attributes set of an operand)."""
+        _set_inst_text(self, None)
+
+    def __str__(self):
+        s = self._text
+        if s is not None and self._epoch == _text_epoch:
+            return s
+        s = self.render()
+        if self.parent is not None:
+            # Def-use chains are kept only for instructions in blocks, so
+            # only their texts are cached
+            cache_text(self, s)
         return s
 
     def __repr__(self):
         return self.__str__()
 
 
+_inst_setters = slot_setters(PInstruction)
+(_set_inst_name, _set_inst_type, _set_inst_opcode, _set_inst_operands, _set_inst_parent,
+ _set_inst_prev, _set_inst_next, _set_inst_order, _set_inst_text, _set_inst_epoch,
+ _set_inst_extra) = _inst_setters
+
+def cache_text(inst, s):
+    "Cache rendered text of instruction in a block."
+    _set_inst_text(inst, s)
+    _set_inst_epoch(inst, _text_epoch)
+
+
+def replace_all_uses_with(old, new):
+    """Replace all uses of local value old with new value (or constant,
+    etc.), keeping def-use chains. Takes time proportional to number of
+    uses. Uses in blocks shared by cloned functions can't be changed in
+    place, use PFunction.replace_uses() for them."""
+    users = all_users(old)
+    new_users = getattr(new, "users", None)
+    if new_users is users:
+        return
+    for i in users:
+        assert not i.parent.shared, "%s is used in block shared with clones" % old
+    # Chains are updated for all uses at once below, so operand lists
+    # are changed bypassing their own relinking
+    set_item = list.__setitem__
+    done = set()
+    for i in users:
+        if i in done:
+            continue
+        done.add(i)
+        ops = i.operands
+        for k, op in enumerate(ops):
+            # Uses with own type or attributes are separate objects,
+            # but share users list
+            if getattr(op, "users", None) is users:
+                set_item(ops, k, new)
+        if i.incoming_vars:
+            i._extra["incoming_vars"] = operand_list(
+                i, [(new if getattr(v, "users", None) is users else v, l)
+                    for v, l in i.incoming_vars])
+        i.dirty()
+    if new_users is not None:
+        new_users.extend(users)
+    del users[:]
+
+
+# Step between order numbers of appended instructions, leaving room to
+# number inserted ones without renumbering others
+ORDER_STEP = 16
+
+
 class PBasicBlock(object):
+    """Basic block, a doubly-linked list of instructions (via their
+    prev/next links), so inserting and removing instructions is O(1).
+    Instructions also have order numbers, increasing along the block,
+    to compare their positions in O(1)."""
+    # Number of functions sharing the block (see PFunction.clone()). If
+    # it's shared, it's copied to be modified.
+    refs = 1
+
     def __init__(self, func, label):
         self.parent = func
         self.name = label
-        self.insts = []
+        self.first = None
+        self.last = None
+        self.count = 0
+
+    def copy(self, func):
+        "Return copy of block (and its instructions) for function func."
+        b = PBasicBlock(func, self.name)
+        b.comment = getattr(self, "comment", None)
+        for i in self:
+            b.append(i.copy())
+        return b
+
+    @property
+    def shared(self):
+        return self.refs > 1
+
+    def release(self):
+        """Drop reference of a function to the block. When the last one
+        is dropped, its instructions are unlinked from def-use chains."""
+        self.refs -= 1
+        if self.refs == 0:
+            for i in self:
+                for v in i.used_values():
+                    v.users.remove(i)
 
     def instructions(self):
-        """Return copy of block's instruction list, so you can iterate
+        """Return list of block's instructions, so you can iterate
         over it while modifying block."""
-        return self.insts[:]
-
-    def insert(self, pos, inst):
-        self.insts.insert(pos, inst)
+        return list(self)
 
     def append(self, inst):
-        self.insts.append(inst)
+        # Links don't affect rendering, so are set bypassing __setattr__
+        last = self.last
+        _set_inst_parent(inst, self)
+        _set_inst_prev(inst, last)
+        _set_inst_next(inst, None)
+        if last is None:
+            self.first = inst
+            _set_inst_order(inst, 0)
+        else:
+            _set_inst_next(last, inst)
+            _set_inst_order(inst, last.order + ORDER_STEP)
+        self.last = inst
+        self.count += 1
+        self.changed(inst)
+
+    def insert_before(self, ref, inst):
+        "Insert instruction before ref (at the end if ref is None)."
+        if ref is None:
+            self.append(inst)
+            return
+        prev = ref.prev
+        inst.parent = self
+        inst.prev = prev
+        inst.next = ref
+        ref.prev = inst
+        if prev is None:
+            self.first = inst
+            inst.order = ref.order - ORDER_STEP
+        else:
+            prev.next = inst
+            self.number(inst)
+        self.count += 1
+        self.changed(inst)
+
+    def insert_after(self, ref, inst):
+        self.insert_before(ref.next, inst)
+
+    def insert(self, pos, inst):
+        "Insert instruction at position, like list.insert()."
+        if pos < 0:
+            pos = max(0, pos + self.count)
+        if pos >= self.count:
+            self.append(inst)
+        else:
+            self.insert_before(self[pos], inst)
+
+    def number(self, inst):
+        """Give order number to instruction inserted after another one.
+        If there's no room before the next one, following instructions
+        are renumbered, up to where order numbers leave room again."""
+        order = inst.prev.order
+        n = inst.next
+        if n is not None and n.order - order > 1:
+            inst.order = (order + n.order) / 2
+            return
+        inst.order = order = order + ORDER_STEP
+        while n is not None and n.order <= order:
+            n.order = order = order + ORDER_STEP
+            n = n.next
 
     def remove(self, inst):
-        self.insts.remove(inst)
+        assert inst.parent is self, "%s is not in block %s" % (inst, self.name)
+        prev = inst.prev
+        next = inst.next
+        if prev is None:
+            self.first = next
+        else:
+            prev.next = next
+        if next is None:
+            self.last = prev
+        else:
+            next.prev = prev
+        inst.prev = inst.next = inst.parent = None
+        self.count -= 1
+        self.changed(inst, True)
+
+    def changed(self, inst, removed=False):
+        """Update def-use chains and function's state for instruction
+        added or removed."""
+        if removed:
+            for v in inst.used_values():
+                v.users.remove(inst)
+            # Changes of values it uses won't drop its text any more
+            _set_inst_text(inst, None)
+        else:
+            for op in inst.operands:
+                if isinstance(op, LOCAL_VALUES):
+                    op.users.append(inst)
+            if inst._extra is not None and inst.incoming_vars:
+                for v, l in inst.incoming_vars:
+                    if isinstance(v, LOCAL_VALUES):
+                        v.users.append(inst)
+        f = self.parent
+        if f is None:
+            return
+        if inst.name:
+            if removed:
+                f.unregister(inst)
+            else:
+                f.register(inst)
+        if inst.opcode is not None and inst.opcode.terminator:
+            f.cfg_version += 1
 
     def index(self, inst):
-        return self.insts.index(inst)
+        "Return position of instruction in block, O(n)."
+        for n, i in enumerate(self):
+            if i is inst:
+                return n
+        raise ValueError("%s is not in block %s" % (inst, self.name))
 
     def __iter__(self):
-        return iter(self.insts)
+        i = self.first
+        while i is not None:
+            # Allows removing current instruction while iterating
+            next = i.next
+            yield i
+            i = next
+
+    def __reversed__(self):
+        i = self.last
+        while i is not None:
+            prev = i.prev
+            yield i
+            i = prev
 
     def __len__(self):
-        return len(self.insts)
+        return self.count
 
     def __getitem__(self, key):
         if isinstance(key, int):
-            return self.insts[key]
-        else:
-            for i in self:
-                if i.name == inst:
+            if key < 0:
+                key = -key - 1
+                it = reversed(self)
+            else:
+                it = iter(self)
+            for n, i in enumerate(it):
+                if n == key:
                     return i
+            raise IndexError(key)
+        i = self.parent.instruction(key) if self.parent is not None else None
+        if i is not None and i.parent is self:
+            return i
+        for i in self:
+            if i.name == key:
+                return i
 
 
 class PFunction(object):
     def __init__(self, *args, **kwargs):
+        # Canonical value object for each local name, all uses of a
+        # value refer to it. Filled in as body is parsed.
+        self.values = {}
         if args or kwargs:
             self.name, self.type, self.args = args
             self.result_type = prim_type(str(self.type))
+            for a in self.args:
+                self.add_value(a)
         self.is_ref = False
         self.bblocks = []
+        # Symbol tables of blocks and of named instructions
+        self._blocks = SymbolTable()
+        self._insts = {}
+        # Incremented on changes of blocks and terminators, to
+        # invalidate cached control-flow graph (see cfg.py)
+        self.cfg_version = 0
+        # Ids of values which may be shared with clones
+        self._shared_values = set()
         self.is_declaration = False
         self.does_not_throw = True
         self.readonly = False
         self.vararg = False
-
-    def append(self, inst):
-        self.bblocks.append(inst)
+        # Hash of function's source text, if parsed from it
+        self.source_hash = None
+
+    def set_body_loader(self, loader):
+        """Defer creation of function body until it is first accessed.
+        Then, loader(func) will be called to populate it."""
+        self.__dict__.pop("bblocks", None)
+        self._body_loader = loader
+
+    def body_loaded(self):
+        return "bblocks" in self.__dict__
+
+    def __getattr__(self, name):
+        # Called only for missing attributes, so free for loaded functions
+        if name == "bblocks" and "_body_loader" in self.__dict__:
+            loader = self.__dict__.pop("_body_loader")
+            self.bblocks = []
+            loader(self)
+            return self.bblocks
+        raise AttributeError(name)
+
+    def add_value(self, v):
+        "Add value object to function's value table."
+        set_untracked(v, "id", len(self.values))
+        self.values[v.name] = v
+
+    def value(self, name, type=None):
+        """Return canonical value object for a local name (argument or
+        temporary), creating new PTmpVariable for unknown names. Values
+        are numbered with consecutive ids in order of appearance."""
+        v = self.values.get(name)
+        if v is None:
+            v = PTmpVariable(name, type)
+            self.add_value(v)
+        elif v.type is None:
+            # Defining instruction doesn't tell the type, uses do
+            v.type = type
+        elif type is not None and type != v.type:
+            # Use with another type (in loosely typed IR), it gets own
+            # object to render properly, but still the same id
+            return self.link_use(PTmpVariable(name, type))
+        return v
+
+    def link_use(self, v):
+        """Link separate object for a use of local value (with own
+        attributes or type) to the canonical object of that value."""
+        c = self.value(v.name)
+        v.id = c.id
+        v.definition = c.definition
+        v.users = c.users
+        return v
+
+    def define(self, inst):
+        "Link value defined by instruction to it."
+        set_untracked(self.value(inst.name), "definition", inst)
+
+    def append(self, block):
+        self.bblocks.append(block)
+        self._blocks.add(block, len(self.bblocks) - 1)
+        self.cfg_version += 1
+
+    def insert(self, pos, block):
+        self.bblocks.insert(pos, block)
+        self._blocks.add(block, pos)
+        self.cfg_version += 1
+
+    def remove(self, block):
+        self.bblocks.remove(block)
+        self._blocks.remove(block)
+        for i in block:
+            self.unregister(i)
+        self.cfg_version += 1
 
     def index(self, block):
-        return self.bblocks.index(block)
+        """Return position of block. O(1) as long as blocks don't
+        move, otherwise block positions are recomputed."""
+        return self._blocks.index(self.bblocks, block)
+
+    def contains(self, block):
+        "Check if block belongs to function."
+        l = self.bblocks
+        positions = self._blocks.positions
+        pos = positions.get(block)
+        if pos is not None and pos < len(l) and l[pos] is block:
+            return True
+        if pos is not None or len(positions) != len(l):
+            # Positions are stale
+            try:
+                self._blocks.index(l, block)
+                return True
+            except ValueError:
+                pass
+        return False
+
+    def clone(self):
+        """Return copy-on-write clone of function. It shares blocks (and
+        instructions and values) with this function, until they're made
+        writable (see writable()) by either function. So cloning and
+        modifying a few blocks of the clone takes time proportional to
+        their size and the number of blocks and values, not the size of
+        the function.
+
+        Def-use chains of shared values list users from all functions
+        sharing them, use users() to get ones of a particular function.
+        Instructions of shared blocks refer to the function which created
+        them via parent links. Clones which are no longer needed should
+        be discard()ed, so their instructions don't stay in the chains."""
+        c = self.__class__()
+        c.__dict__.update(self.__dict__)
+        c.__dict__.pop("_cfg", None)
+        c.bblocks = list(self.bblocks)
+        c.args = list(getattr(self, "args", []))
+        c.values = dict(self.values)
+        c._blocks = SymbolTable()
+        c._insts = {}
+        c.cfg_version = 0
+        shared = set(id(v) for v in self.values.itervalues())
+        self._shared_values |= shared
+        c._shared_values = set(shared)
+        for b in self.bblocks:
+            b.refs += 1
+        return c
+
+    def discard(self):
+        """Drop body of function which is no longer needed, e.g. clone
+        or snapshot. Instructions of blocks not shared with other
+        functions are unlinked from def-use chains, so they don't stay
+        users of values shared with them."""
+        for b in self.bblocks:
+            b.release()
+        self.bblocks = []
+        self._blocks = SymbolTable()
+        self._insts = {}
+        self.cfg_version += 1
+
+    def snapshot(self):
+        """Save state of function body, which can be restored later by
+        rollback(). Cheap, as blocks are shared copy-on-write. When it's
+        no longer needed, discard() it."""
+        return self.clone()
+
+    def rollback(self, snap):
+        """Restore state saved by snapshot() (or of a clone, e.g. the
+        best of several variants tried). The snapshot stays valid, to
+        roll back to it again."""
+        state = snap.clone()
+        self.discard()
+        self.__dict__.clear()
+        self.__dict__.update(state.__dict__)
+
+    def writable(self, block):
+        """Return block which this function may modify in place of the
+        given one: block itself if function owns it, otherwise its copy,
+        which replaces it in the function."""
+        if block.parent is self and not block.shared:
+            return block
+        pos = self.index(block)
+        b = block.copy(self)
+        self.bblocks[pos] = b
+        self._blocks.add(b, pos)
+        block.release()
+        self.cfg_version += 1
+        return b
+
+    def writable_inst(self, inst):
+        "Return instruction which this function may modify in place of inst."
+        b = inst.parent
+        if b.parent is self and not b.shared:
+            return inst
+        n = b.index(inst)
+        return self.writable(b)[n]
+
+    def writable_value(self, v):
+        """Return local value which this function may modify in place of
+        v: v itself if not shared with clones, otherwise its copy, which
+        replaces it in all uses in this function."""
+        if id(v) not in self._shared_values:
+            return v
+        nv = v.__class__(v.name, v.type)
+        nv.id = v.id
+        nv._extra = dict(v._extra) if v._extra else None
+        self.values[v.name] = nv
+        if v in self.args:
+            self.args[self.args.index(v)] = nv
+
+        def make_new(op):
+            if op is v:
+                return nv
+            # Separate use object, make own one too
+            u = op.__class__(op.name, op.type)
+            u._extra = dict(op._extra) if op._extra else None
+            return self.link_use(u)
+
+        for i in self.users(v):
+            self.writable_inst(i).replace_uses_of(v, make_new)
+        if v.definition is not None:
+            nv.definition = self.instruction(v.name)
+        return nv
+
+    def users(self, v):
+        "Return users of local value in this function (one per use)."
+        return [i for i in v.users if i.parent is not None and self.contains(i.parent)]
+
+    def replace_uses(self, old, new):
+        """Replace uses of local value old in this function with new
+        value, copying blocks shared with clones. Unlike
+        replace_all_uses_with(), doesn't affect other functions."""
+        done = set()
+        for i in self.users(old):
+            if i not in done:
+                done.add(i)
+                self.writable_inst(i).replace_uses_of(old, lambda op: new)
+
+    def register(self, inst):
+        "Add named instruction to symbol table (called by blocks)."
+        self._insts.setdefault(inst.name, inst)
+
+    def unregister(self, inst):
+        if self._insts.get(inst.name) is inst:
+            del self._insts[inst.name]
+
+    def instruction(self, name):
+        """Return instruction with given result name (first one, if
+        there're several, e.g. out of SSA), or None."""
+        i = self._insts.get(name)
+        if i is not None and i.name == name and i.parent is not None \
+                and i.parent.parent is self:
+            try:
+                self.index(i.parent)
+                return i
+            except ValueError:
+                pass
+        # Missing or stale entry, reindex
+        self._insts = {}
+        for b in reversed(self.bblocks):
+            for i in reversed(b):
+                if i.name:
+                    self._insts[i.name] = i
+        return self._insts.get(name)
 
     def __iter__(self):
         return iter(self.bblocks)
@@ -364,10 +1402,7 @@ class PFunction(object):
     def __getitem__(self, key):
         if isinstance(key, int):
             return self.bblocks[key]
-
-        for b in self:
-            if b.name == key:
-                return b
+        return self._blocks.get(self.bblocks, key)
 
     def __str__(self):
         if self.is_ref:
@@ -389,52 +1424,167 @@ class PFunction(object):
 
 class IRRenderer(object):
     """Render textual representation of PLLVMIR, compatible with
-    rendered by native LLVM tools."""
+    rendered by native LLVM tools.
+
+    Lines are collected in a buffer, which is written out in large
+    chunks, and texts of instructions are cached between renderings
+    (see PInstruction.__str__())."""
+
+    # Number of lines after which buffer is written out
+    BUFFER_LINES = 4096
+
+    @classmethod
+    def render(cls, mod, out=sys.stdout, implicit_labels=True):
+        lines = []
+        cls.header_lines(mod, lines)
+        cls.render_functions(mod, 0, len(mod.functions), lines, out, implicit_labels)
+        cls.footer_lines(mod, lines)
+        cls.flush(lines, out)
 
     @staticmethod
-    def render(mod, out=sys.stdout, implicit_labels=True):
+    def header_lines(mod, lines):
+        "Append lines of module header and global variables to a list."
         if mod.module_id:
-                print >>out, mod.module_id
+            lines.append(mod.module_id)
         if mod.target_info:
-            for t in mod.target_info:
-                print >>out, t
-            print >>out
+            lines.extend(mod.target_info)
+            lines.append("")
 
         if len(mod.global_variables):
-            print >>out
+            lines.append("")
             for v in mod.global_variables:
-                print >>out, v
-            print >>out
+                lines.append(str(v))
+            lines.append("")
 
-        last_f = None
-        for f in mod:
+    @staticmethod
+    def footer_lines(mod, lines):
+        "Append metadata lines of module to a list."
+        if mod.metadata:
+            lines.append("")
+            lines.extend(mod.metadata)
+
+    @classmethod
+    def render_functions(cls, mod, start, end, lines, out, implicit_labels=True):
+        """Append lines of module's functions start..end-1 to a list,
+        writing it out as it grows."""
+        funcs = mod.functions
+        # Definitions are separated by empty line, also from ones before start
+        last_f = any(not f.is_declaration for f in funcs[:start])
+        for f in funcs[start:end]:
             if f.is_declaration:
-                print >>out, str(f)
-                print >>out
+                lines.append(str(f))
+                lines.append("")
                 continue
-            else:
-                print >>out, str(f) + " {"
-
-            if last_f: print
-            last_b = None
-            for b in f:
-                if last_b: print >>out
-                if b.name[0].isdigit():
-                    if implicit_labels:
-                        print >>out, ";%s:" % b.name
-                else:
-                    comment = b.comment if b.comment else ""
-                    print >>out, "%s:%s" % (b.name, comment)
-                for i in b:
-                    print >>out, i
-                last_b = b
-            print >>out, "}"
-            last_f = f
+            if last_f:
+                lines.append("")
+            cls.function_lines(f, lines, implicit_labels)
+            last_f = True
+            if len(lines) >= cls.BUFFER_LINES:
+                cls.flush(lines, out)
 
-        if mod.metadata:
-            print >>out
-            for t in mod.metadata:
-                print >>out, t
+    @staticmethod
+    def flush(lines, out):
+        "Write out lines and clear the list."
+        if lines:
+            lines.append("")
+            out.write("\n".join(lines))
+            del lines[:]
+
+    @classmethod
+    def function_lines(cls, f, lines, implicit_labels=True):
+        "Append lines of function definition to a list."
+        lines.append(str(f) + " {")
+        append = lines.append
+        # Same as PInstruction.__str__(), inlined
+        epoch = _text_epoch
+        set_text = _set_inst_text
+        set_epoch = _set_inst_epoch
+        last_b = None
+        for b in f:
+            if last_b:
+                append("")
+            if b.name[0].isdigit():
+                if implicit_labels:
+                    append(";%s:" % b.name)
+            else:
+                comment = b.comment if b.comment else ""
+                append("%s:%s" % (b.name, comment))
+            i = b.first
+            while i is not None:
+                s = i._text
+                if s is None or i._epoch != epoch:
+                    s = i.render()
+                    set_text(i, s)
+                    set_epoch(i, epoch)
+                append(s)
+                i = i.next
+            last_b = b
+        append("}")
+
+    @classmethod
+    def render_parallel(cls, mod, out=sys.stdout, implicit_labels=True, workers=None):
+        """Render module like render(), with functions rendered by worker
+        processes (one per CPU by default). Workers are forked, so they
+        get a snapshot of the module without pickling it. Functions are
+        split into contiguous ranges with about equal number of
+        instructions. The first one is rendered by this process, others
+        by workers into temporary files, which are then copied to out in
+        order. Texts cached by workers are lost with them."""
+        funcs = mod.functions
+        if workers is None:
+            workers = multiprocessing.cpu_count()
+        sizes = [0 if f.is_declaration else sum(b.count for b in f) for f in funcs]
+        if workers < 2 or sum(1 for n in sizes if n) < 2:
+            return cls.render(mod, out, implicit_labels)
+
+        ranges = []
+        total = sum(sizes)
+        start = 0
+        acc = 0
+        for n, size in enumerate(sizes):
+            acc += size
+            if acc * workers >= total * (len(ranges) + 1) or n == len(sizes) - 1:
+                ranges.append((start, n + 1))
+                start = n + 1
+
+        lines = []
+        cls.header_lines(mod, lines)
+        jobs = []
+        try:
+            for start, end in ranges[1:]:
+                chunk = tempfile.TemporaryFile()
+                p = multiprocessing.Process(target=_render_chunk,
+                                            args=(cls, mod, start, end, chunk, implicit_labels))
+                p.start()
+                jobs.append((p, chunk))
+            # First range is rendered meanwhile right into out
+            start, end = ranges[0]
+            cls.render_functions(mod, start, end, lines, out, implicit_labels)
+            cls.flush(lines, out)
+            for p, chunk in jobs:
+                p.join()
+                if p.exitcode:
+                    raise RuntimeError("rendering worker exited with code %d" % p.exitcode)
+                chunk.seek(0)
+                shutil.copyfileobj(chunk, out, 1 << 20)
+        finally:
+            for p, chunk in jobs:
+                if p.is_alive():
+                    p.terminate()
+                chunk.close()
+        cls.footer_lines(mod, lines)
+        cls.flush(lines, out)
+
+
+def _render_chunk(cls, mod, start, end, out, implicit_labels):
+    "Render range of functions for IRRenderer.render_parallel()."
+    # Collection would touch all objects of the module, copying memory
+    # shared with parent
+    with gc_disabled():
+        lines = []
+        cls.render_functions(mod, start, end, lines, out, implicit_labels)
+        cls.flush(lines, out)
+        out.flush()
 
 
 if __name__ == "__main__":
@@ -0,0 +1,156 @@
+"""LLVM IR types.
+
+Types are represented by objects subclassing str (so they are still
+equal to, and render as, their textual spelling), with structure and
+properties (width, size, pointee, element, etc.) parsed once and cached
+as attributes. Type objects are interned: get_type() returns the same
+object for the same spelling."""
+from lexer import tokenize, source, split
+
+
+# Should be set according to target, before any pointer type is created
+POINTER_WIDTH = 32
+
+FLOAT_WIDTHS = {"half": 16, "float": 32, "double": 64, "x86_fp80": 80,
+    "fp128": 128, "ppc_fp128": 128}
+
+
+class PType(str):
+    "Type without specific structure (void, label, named types, etc.)"
+    # In bits, None if not applicable/unknown
+    width = None
+    # In bytes
+    size = None
+    align = None
+
+    def __new__(cls, spelling, *args):
+        # Structure params are handled by subclasses' __init__
+        return str.__new__(cls, spelling)
+
+
+class PIntType(PType):
+    def __init__(self, spelling, width):
+        self.width = width
+        self.size = self.align = (width + 7) / 8
+
+
+class PFloatType(PType):
+    def __init__(self, spelling, width):
+        self.width = width
+        self.size = self.align = width / 8
+
+
+class PPointerType(PType):
+    def __init__(self, spelling, pointee):
+        self.pointee = pointee
+        self.width = POINTER_WIDTH
+        self.size = self.align = POINTER_WIDTH / 8
+
+
+class PArrayType(PType):
+    def __init__(self, spelling, count, element):
+        self.count = count
+        self.element = element
+        self.align = element.align
+        if element.size is not None:
+            self.size = count * element.size
+            self.width = self.size * 8
+
+
+class PVectorType(PArrayType):
+    pass
+
+
+class PStructType(PType):
+    def __init__(self, spelling, elements, packed=False):
+        self.elements = elements
+        self.packed = packed
+        if None in [e.size for e in elements]:
+            return
+        # Natural alignment of each element, unless packed
+        size = 0
+        align = 1
+        for e in elements:
+            if not packed:
+                size = (size + e.align - 1) / e.align * e.align
+                align = max(align, e.align)
+            size += e.size
+        self.align = align
+        self.size = (size + align - 1) / align * align
+        self.width = self.size * 8
+
+
+class PFunctionType(PType):
+    def __init__(self, spelling, return_type, args, vararg):
+        self.return_type = return_type
+        self.args = args
+        self.vararg = vararg
+
+
+_types = {}
+
+
+def get_type(spelling):
+    "Return interned type object for a type spelling."
+    t = _types.get(spelling)
+    if t is None:
+        t = _types[spelling] = make_type(spelling)
+    return t
+
+
+def intern_type(spelling):
+    "Like get_type(), but passes None through."
+    if spelling is None:
+        return None
+    return get_type(spelling)
+
+
+def make_type(spelling):
+    toks = tokenize(spelling)
+    try:
+        return make_type_from_toks(spelling, toks)
+    except (IndexError, ValueError):
+        # Syntax we don't know about, still keep it as a type
+        return PType(spelling)
+
+
+def make_type_from_toks(spelling, toks):
+    first = toks[0][1]
+    last = toks[-1][1]
+    if last == "*":
+        return PPointerType(spelling, get_type(source(toks[:-1])))
+    if last == ")":
+        # Function type: find opening paren of the params
+        depth = 0
+        for i in xrange(len(toks) - 1, 0, -1):
+            t = toks[i][1]
+            if t == ")":
+                depth += 1
+            elif t == "(":
+                depth -= 1
+                if depth == 0:
+                    break
+        ret = get_type(source(toks[:i]))
+        params = split(toks[i + 1:-1]) if i + 2 < len(toks) else []
+        vararg = bool(params) and params[-1][0][1] == "..."
+        if vararg:
+            params.pop()
+        return PFunctionType(spelling, ret, [get_type(source(p)) for p in params], vararg)
+    if len(toks) == 1:
+        if first[0] == "i" and first[1:].isdigit():
+            return PIntType(spelling, int(first[1:]))
+        if first in FLOAT_WIDTHS:
+            return PFloatType(spelling, FLOAT_WIDTHS[first])
+        return PType(spelling)
+    if first == "[" and last == "]" or first == "<" and last == ">" and toks[1][1] != "{":
+        # [N x type] or <N x type>
+        if toks[2][1] != "x":
+            raise ValueError(spelling)
+        cls = PArrayType if first == "[" else PVectorType
+        return cls(spelling, int(toks[1][1]), get_type(source(toks[3:-1])))
+    if first == "{" and last == "}":
+        return PStructType(spelling, [get_type(source(e)) for e in split(toks[1:-1])])
+    if first == "<" and last == ">":
+        # <{ packed struct }>
+        return PStructType(spelling, [get_type(source(e)) for e in split(toks[2:-2])], True)
+    return PType(spelling)
@@ -7,11 +7,16 @@ from graph_color import *
 
 class RegAlloc(object):
 
-    def __init__(self, func, num_regs):
+    def __init__(self, func, num_regs, liveness=None, interf=None):
+        """Liveness and interference graph of function are computed,
+        unless passed in (e.g. cached by pass manager)."""
         self.num_regs = num_regs
         self.func = func
-        self.liveness = Liveness(func)
-        interf = InterferenceGraph(func, self.liveness)
+        if liveness is None:
+            liveness = Liveness(func)
+        self.liveness = liveness
+        if interf is None:
+            interf = InterferenceGraph(func, liveness)
         # Use graph implementation more optimal for coloring algo
         self.interf = UngraphAdjList()
         self.interf.from_graph(interf)
@@ -27,12 +32,22 @@ class RegAlloc(object):
         return "R%d" % self.reg_map[var]
 
     def rewrite_regs(self):
+        f = self.func
+        # Function may share blocks and values with its clones (e.g. if
+        # allocation variants are tried), get own ones to modify
+        for b in list(f):
+            f.writable(b)
+        for v in f.values.values():
+            f.writable_value(v)
+        # Operand objects are shared between uses, rename each just once
+        renamed = set()
         for i in self.func.iter_insts():
             if i.name:
                 i.name = self.reg(i.name)
             for a in i.operands:
-                if isinstance(a, PTmpVariable):
+                if isinstance(a, (PTmpVariable, PArgument)) and a not in renamed:
                     a.name = self.reg(a.name)
+                    renamed.add(a)
         # Remove void moves
         for i in list(self.func.iter_insts()):
             if i.opcode_name == "mov" and isinstance(i.operands[0], PTmpVariable):
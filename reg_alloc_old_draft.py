@@ -1,5 +1,7 @@
 from pprint import pprint
 
+from ptypes import get_type, PIntType, PPointerType
+
 
 ARG_REGS = ["R7", "R6", "R5", "R4"]
 RES_REGS = ["R7", "R6", "R5", "R4"]
@@ -63,10 +65,11 @@ class IRStream:
 
 
 def get_width(type):
-    assert type[0] == "i"
-    if type[-1] == "*":
-        type = type[:-1]
-    return int(type[1:])
+    t = get_type(type)
+    if isinstance(t, PPointerType):
+        t = t.pointee
+    assert isinstance(t, PIntType)
+    return t.width
 
 def get_size(type):
     return get_width(type) / REG_WIDTH
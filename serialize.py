@@ -0,0 +1,604 @@
+"""Compact binary format for PLLVM IR.
+
+File consists of a header (magic and format version) followed by a
+stream of records: one for module-level data (globals, target info,
+metadata), then one per function, then an end marker. Each record is a
+string table (names, types, comments, etc.) and an array of 16- or
+32-bit integers (whichever fits), referring to strings by index.
+Within a function, operands are stored once in a value table and
+instructions refer to them by index. Common opcodes are stored as
+fixed numbers.
+
+Records are written and read one at a time (see BinaryWriter,
+BinaryReader), so modules can be streamed. The same encoding of
+function bodies is used to pass them between processes. Decoding it is
+much faster than both reparsing IR text and unpickling object graph."""
+import sys
+import struct
+from array import array
+from functools import partial
+
+from pllvm import *
+from ptypes import intern_type
+
+
+MAGIC = "PLLB"
+FORMAT_VERSION = 4
+
+HEADER = struct.Struct("<4sH")
+RECORD_HEADER = struct.Struct("<BcII")
+
+# Record tags
+REC_END = 0
+REC_MODULE = 1
+REC_FUNCTION = 2
+
+# Operand kinds
+OP_TMP = 0
+OP_ARG = 1
+OP_GLOBAL = 2
+OP_LABEL = 3
+OP_INT = 4
+OP_BIGINT = 5
+OP_DATA = 6
+OP_STR = 7
+# Function (call target), name and type
+OP_FUNC = 8
+# Constant expression: opcode, type, number of operands, then operands
+OP_EXPR = 9
+# No value (initializer of external global)
+OP_NONE = 10
+# Flags or'ed with operand kind
+OP_NOCAPTURE = 0x100
+OP_VARARG = 0x200
+
+OPERAND_CLASSES = {
+    OP_TMP: PTmpVariable,
+    OP_ARG: PArgument,
+    OP_GLOBAL: PGlobalVariableRef,
+    OP_DATA: PConstantDataArray,
+}
+
+# Instruction flags
+F_PREDICATE = 1
+F_OFFSETED = 2
+F_INBOUNDS = 4
+F_ALIGNMENT = 8
+F_METADATA = 16
+F_COMMENT = 32
+F_PHI = 64
+
+# Function flags
+FF_DECLARATION = 1
+FF_NOUNWIND = 2
+FF_READONLY = 4
+FF_VARARG = 8
+
+# Global variable flags
+GF_CONSTANT = 1
+GF_UNNAMED_ADDR = 2
+GF_DECLARATION = 4
+
+# Opcodes with fixed numbers. Other opcodes are stored as
+# len(OPCODE_NAMES) + index of the name in string table. Ids in the
+# opcode registry (pllvm.OPCODES) depend on the order of registration,
+# so they aren't used.
+OPCODE_NAMES = [
+    "ret", "br", "switch", "unreachable",
+    "add", "sub", "mul", "udiv", "sdiv", "urem", "srem",
+    "shl", "lshr", "ashr", "and", "or", "xor",
+    "alloca", "load", "store", "getelementptr",
+    "trunc", "zext", "sext", "ptrtoint", "inttoptr", "bitcast",
+    "icmp", "phi", "select", "call",
+    "mov", "bricmp",
+]
+OPCODE_IDS = dict((name, i) for i, name in enumerate(OPCODE_NAMES))
+
+# Ints are built as 32-bit, and stored as 16-bit when they fit
+INT_TYPECODE = "i"
+SHORT_TYPECODE = "h"
+assert array(INT_TYPECODE).itemsize == 4 and array(SHORT_TYPECODE).itemsize == 2
+INT_MIN = -(1 << 31)
+INT_MAX = (1 << 31) - 1
+SHORT_MIN = -(1 << 15)
+SHORT_MAX = (1 << 15) - 1
+
+
+class StringTable(object):
+    "Table of unique strings, None is represented by index -1."
+
+    def __init__(self):
+        self.strings = []
+        self.index = {}
+
+    def add(self, s):
+        if s is None:
+            return -1
+        try:
+            return self.index[s]
+        except KeyError:
+            i = self.index[s] = len(self.strings)
+            self.strings.append(s)
+            return i
+
+    def blob(self):
+        # IR strings can't contain newlines, so they make a separator
+        return "\n".join(self.strings)
+
+
+def load_strings(blob):
+    "Load string table. Extra None at the end makes index -1 decode as None."
+    strings = blob.split("\n")
+    strings.append(None)
+    return strings
+
+
+def int_array():
+    return array(INT_TYPECODE)
+
+
+def pack_ints(a):
+    """Pack int array into little-endian bytes of the narrowest fitting
+    type. Returns typecode and bytes."""
+    typecode = INT_TYPECODE
+    if not a or (min(a) >= SHORT_MIN and max(a) <= SHORT_MAX):
+        typecode = SHORT_TYPECODE
+        a = array(typecode, a)
+    if sys.byteorder == "big":
+        a = array(typecode, a)
+        a.byteswap()
+    return typecode, a.tostring()
+
+
+def unpack_ints(typecode, data):
+    "Unpack bytes packed by pack_ints() to list of ints."
+    a = array(typecode)
+    a.fromstring(data)
+    if sys.byteorder == "big":
+        a.byteswap()
+    return a.tolist()
+
+
+def encode_operand(op, out, add_str):
+    if op is None:
+        out.extend((OP_NONE, -1, -1))
+        return
+    if isinstance(op, PConstantInt):
+        v = op.value
+        if INT_MIN <= v <= INT_MAX:
+            out.extend((OP_INT, v, add_str(op.type)))
+        else:
+            out.extend((OP_BIGINT, add_str(str(v)), add_str(op.type)))
+        return
+    if isinstance(op, str):
+        out.extend((OP_STR, add_str(op), -1))
+        return
+    if isinstance(op, PLabelRef):
+        out.extend((OP_LABEL, add_str(op.name), -1))
+        return
+    if isinstance(op, PTmpVariable):
+        kind = OP_TMP
+    elif isinstance(op, PArgument):
+        kind = OP_ARG
+    elif isinstance(op, PGlobalVariableRef):
+        kind = OP_GLOBAL
+    elif isinstance(op, PConstantDataArray):
+        out.extend((OP_DATA, add_str(op.value), add_str(op.type)))
+        return
+    elif isinstance(op, PFunction):
+        kind = OP_FUNC
+        if op.vararg:
+            kind |= OP_VARARG
+        out.extend((kind, add_str(op.name), add_str(op.type)))
+        return
+    elif isinstance(op, PConstantExpr):
+        out.extend((OP_EXPR, add_str(op.opcode_name), add_str(op.type), len(op.operands)))
+        for x in op.operands:
+            encode_operand(x, out, add_str)
+        return
+    else:
+        raise NotImplementedError(op, type(op))
+    if ATTR_NO_CAPTURE in getattr(op, "attributes", ()):
+        kind |= OP_NOCAPTURE
+    out.extend((kind, add_str(op.name), add_str(op.type)))
+
+
+def decode_operand(kind, a, b, strings):
+    if kind == OP_TMP:
+        return PTmpVariable(strings[a], intern_type(strings[b]))
+    if kind == OP_INT:
+        return PConstantInt(a, intern_type(strings[b]))
+    if kind == OP_LABEL:
+        return PLabelRef(strings[a])
+    if kind == OP_STR:
+        return strings[a]
+    if kind == OP_BIGINT:
+        return PConstantInt(int(strings[a]), intern_type(strings[b]))
+    if kind == OP_NONE:
+        return None
+    if kind & ~OP_VARARG == OP_FUNC:
+        f = PFunction(strings[a], intern_type(strings[b]), [])
+        f.is_ref = True
+        f.vararg = bool(kind & OP_VARARG)
+        return f
+    v = OPERAND_CLASSES[kind & ~OP_NOCAPTURE](strings[a], intern_type(strings[b]))
+    if kind & OP_NOCAPTURE:
+        v.attributes = set([ATTR_NO_CAPTURE])
+    return v
+
+
+def decode_operand_at(data, pos, strings):
+    """Decode operand starting at data[pos], which may be a constant
+    expression spanning several entries. Returns operand and position
+    past it."""
+    kind = data[pos]
+    if kind != OP_EXPR:
+        return decode_operand(kind, data[pos + 1], data[pos + 2], strings), pos + 3
+    e = PConstantExpr()
+    e.opcode_name = strings[data[pos + 1]]
+    e.type = intern_type(strings[data[pos + 2]])
+    n = data[pos + 3]
+    pos += 4
+    for x in xrange(n):
+        op, pos = decode_operand_at(data, pos, strings)
+        e.operands.append(op)
+    return e, pos
+
+
+def operand_factory(kind, a, b, strings):
+    "Return callable creating new instances of an encoded operand."
+    if kind == OP_TMP:
+        return partial(PTmpVariable, strings[a], intern_type(strings[b]))
+    if kind == OP_INT:
+        return partial(PConstantInt, a, intern_type(strings[b]))
+    if kind == OP_LABEL:
+        return partial(PLabelRef, strings[a])
+    if kind == OP_STR:
+        s = strings[a]
+        return lambda: s
+    return partial(decode_operand, kind, a, b, strings)
+
+
+def linked_factory(func, factory):
+    "Wrap operand factory to link new objects to local value of func."
+    return lambda: func.link_use(factory())
+
+
+def encode_body(blocks, add_str, out):
+    """Encode list of basic blocks, appending ints to out array. Strings
+    are added to string table using add_str function."""
+    values = int_array()
+    value_ids = {}
+    tmp = int_array()
+
+    def value(op):
+        if op.__class__ is PTmpVariable and op._extra is None:
+            # Fast path for the most common case
+            key = (op.name, op.type)
+            try:
+                return value_ids[key]
+            except KeyError:
+                i = value_ids[key] = len(value_ids)
+                values.extend((OP_TMP, add_str(op.name), add_str(op.type)))
+                return i
+        del tmp[:]
+        encode_operand(op, tmp, add_str)
+        key = tuple(tmp)
+        try:
+            return value_ids[key]
+        except KeyError:
+            i = value_ids[key] = len(value_ids)
+            values.extend(tmp)
+            return i
+
+    body = int_array()
+    body.append(len(blocks))
+    for b in blocks:
+        body.extend((add_str(b.name), add_str(getattr(b, "comment", None)), len(b)))
+        for i in b:
+            flags = 0
+            if i.predicate is not None:
+                flags |= F_PREDICATE
+            if i.offseted:
+                flags |= F_OFFSETED
+            if i.inbounds:
+                flags |= F_INBOUNDS
+            if i.alignment is not None:
+                flags |= F_ALIGNMENT
+            if i.metadata is not None:
+                flags |= F_METADATA
+            if i.comment is not None:
+                flags |= F_COMMENT
+            if i.incoming_vars is not None:
+                flags |= F_PHI
+            opcode = OPCODE_IDS.get(i.opcode_name)
+            if opcode is None:
+                opcode = len(OPCODE_NAMES) + add_str(i.opcode_name)
+            body.extend((add_str(i.name), add_str(i.type), opcode, flags | len(i.operands) << 8))
+            body.extend([value(op) for op in i.operands])
+            if flags & F_PREDICATE:
+                body.append(add_str(i.predicate))
+            if flags & F_ALIGNMENT:
+                body.append(i.alignment)
+            if flags & F_METADATA:
+                body.append(add_str(i.metadata))
+            if flags & F_COMMENT:
+                body.append(add_str(i.comment))
+            if flags & F_PHI:
+                body.append(len(i.incoming_vars))
+                for v, label in i.incoming_vars:
+                    body.extend((value(v), add_str(label)))
+
+    out.append(len(value_ids))
+    out.extend(values)
+    out.extend(body)
+
+
+def decode_body(func, strings, data, pos=0):
+    """Decode blocks encoded by encode_body() and append them to func.
+    strings is a string table as returned by load_strings(), data is a
+    sequence of ints starting at pos. Returns position past decoded
+    data.
+
+    Like with the parser, uses of local values (and of globals, if func
+    belongs to a module) refer to canonical objects, while other
+    operands are separate objects for each use."""
+    mod = getattr(func, "parent", None)
+    nvalues = data[pos]
+    pos += 1
+    # For each value, either shared object or None and a factory
+    shared = []
+    new = []
+    for vi in xrange(nvalues):
+        kind, a, b = data[pos:pos + 3]
+        if kind == OP_EXPR:
+            shared.append(None)
+            new.append(partial(lambda p: decode_operand_at(data, p, strings)[0], pos))
+            pos = decode_operand_at(data, pos, strings)[1]
+            continue
+        pos += 3
+        v = None
+        if kind == OP_TMP or kind == OP_ARG:
+            v = func.value(strings[a], intern_type(strings[b]))
+        elif kind == OP_GLOBAL and mod is not None:
+            v = mod.global_ref(strings[a], intern_type(strings[b]))
+        shared.append(v)
+        if v is not None:
+            new.append(None)
+        elif kind & ~OP_NOCAPTURE in (OP_TMP, OP_ARG):
+            # Use of a value with attributes
+            new.append(linked_factory(func, operand_factory(kind, a, b, strings)))
+        else:
+            new.append(operand_factory(kind, a, b, strings))
+
+    nopcodes = len(OPCODE_NAMES)
+    nblocks = data[pos]
+    pos += 1
+    for bi in xrange(nblocks):
+        b = PBasicBlock(func, strings[data[pos]])
+        b.comment = strings[data[pos + 1]]
+        ninsts = data[pos + 2]
+        pos += 3
+        append = b.append
+        for ii in xrange(ninsts):
+            name, type, opcode, flags = data[pos:pos + 4]
+            pos += 4
+            nops = flags >> 8
+            ops = [shared[v] or new[v]() for v in data[pos:pos + nops]]
+            pos += nops
+            if opcode < nopcodes:
+                opcode = OPCODE_NAMES[opcode]
+            else:
+                opcode = strings[opcode - nopcodes]
+            # Optional attributes, instruction is created with them at once
+            extra = {}
+            if flags & 0xff:
+                if flags & F_PREDICATE:
+                    extra["predicate"] = strings[data[pos]]
+                    pos += 1
+                if flags & F_OFFSETED:
+                    extra["offseted"] = True
+                if flags & F_ALIGNMENT:
+                    extra["alignment"] = data[pos]
+                    pos += 1
+                if flags & F_METADATA:
+                    extra["metadata"] = strings[data[pos]]
+                    pos += 1
+                if flags & F_COMMENT:
+                    extra["comment"] = strings[data[pos]]
+                    pos += 1
+                if flags & F_PHI:
+                    n = data[pos]
+                    pos += 1
+                    incoming = []
+                    for vi in xrange(n):
+                        v = data[pos]
+                        incoming.append((shared[v] or new[v](), strings[data[pos + 1]]))
+                        pos += 2
+                    extra["incoming_vars"] = incoming
+            if opcode == "getelementptr":
+                extra["inbounds"] = bool(flags & F_INBOUNDS)
+            inst = PInstruction(strings[name], intern_type(strings[type]), opcode, ops, **extra)
+            append(inst)
+            if inst.name:
+                func.define(inst)
+        func.append(b)
+    return pos
+
+
+def dumps_blocks(blocks):
+    "Encode list of blocks into a pair of strings."
+    strtab = StringTable()
+    data = int_array()
+    encode_body(blocks, strtab.add, data)
+    return (strtab.blob(),) + pack_ints(data)
+
+
+def loads_blocks(func, packed):
+    "Decode blocks packed by dumps_blocks() and append them to func."
+    blob, typecode, data = packed
+    decode_body(func, load_strings(blob), unpack_ints(typecode, data))
+
+
+class BinaryWriter(object):
+    "Write module in binary format to a file, a record at a time."
+
+    def __init__(self, f):
+        self.f = f
+        f.write(HEADER.pack(MAGIC, FORMAT_VERSION))
+
+    def write_record(self, tag, strtab, data):
+        blob = strtab.blob()
+        typecode, data = pack_ints(data)
+        self.f.write(RECORD_HEADER.pack(tag, typecode, len(blob), len(data)))
+        self.f.write(blob)
+        self.f.write(data)
+
+    def write_module_header(self, mod):
+        "Write module-level data (everything except functions)."
+        strtab = StringTable()
+        add_str = strtab.add
+        out = int_array()
+        out.append(add_str(mod.module_id))
+        for l in (mod.target_info, mod.metadata):
+            out.append(len(l))
+            out.extend([add_str(x) for x in l])
+        out.append(len(mod.global_variables))
+        for v in mod.global_variables:
+            flags = 0
+            if v.global_constant:
+                flags |= GF_CONSTANT
+            if v.unnamed_addr:
+                flags |= GF_UNNAMED_ADDR
+            if v.is_declaration:
+                flags |= GF_DECLARATION
+            alignment = v.alignment if v.alignment is not None else -1
+            out.extend((add_str(v.name), add_str(v.linkage), add_str(v.type_str), flags, alignment))
+            encode_operand(v.initializer, out, add_str)
+        self.write_record(REC_MODULE, strtab, out)
+
+    def write_function(self, func):
+        strtab = StringTable()
+        add_str = strtab.add
+        out = int_array()
+        flags = 0
+        if func.is_declaration:
+            flags |= FF_DECLARATION
+        if func.does_not_throw:
+            flags |= FF_NOUNWIND
+        if func.readonly:
+            flags |= FF_READONLY
+        if func.vararg:
+            flags |= FF_VARARG
+        out.extend((add_str(func.name), add_str(func.type), add_str(func.source_hash),
+                    flags, len(func.args)))
+        for a in func.args:
+            encode_operand(a, out, add_str)
+        encode_body(func.bblocks, add_str, out)
+        self.write_record(REC_FUNCTION, strtab, out)
+
+    def close(self):
+        "Write end marker. Doesn't close underlying file."
+        self.f.write(RECORD_HEADER.pack(REC_END, SHORT_TYPECODE, 0, 0))
+
+
+class BinaryReader(object):
+    "Read module in binary format from a file, a record at a time."
+
+    def __init__(self, f):
+        self.f = f
+        header = f.read(HEADER.size)
+        if len(header) != HEADER.size or header[:4] != MAGIC:
+            raise ValueError("Not a binary PLLVM IR file")
+        magic, version = HEADER.unpack(header)
+        if version != FORMAT_VERSION:
+            raise ValueError("Unsupported binary PLLVM IR format version: %d" % version)
+        self.mod = None
+
+    def read_record(self):
+        tag, typecode, blob_len, data_len = RECORD_HEADER.unpack(self.f.read(RECORD_HEADER.size))
+        strings = load_strings(self.f.read(blob_len))
+        data = unpack_ints(typecode, self.f.read(data_len))
+        return tag, strings, data
+
+    def read_module_header(self):
+        "Read module-level data, returning PModule without functions."
+        tag, strings, data = self.read_record()
+        assert tag == REC_MODULE, "Module record expected"
+        mod = self.mod = PModule()
+        mod.module_id = strings[data[0]]
+        pos = 1
+        for l in (mod.target_info, mod.metadata):
+            n = data[pos]
+            l.extend([strings[x] for x in data[pos + 1:pos + 1 + n]])
+            pos += 1 + n
+        n = data[pos]
+        pos += 1
+        for i in xrange(n):
+            v = PGlobalVariable()
+            name, linkage, type, flags, alignment = data[pos:pos + 5]
+            v.name = strings[name]
+            v.linkage = strings[linkage]
+            v.type_str = v.type = intern_type(strings[type])
+            v.global_constant = bool(flags & GF_CONSTANT)
+            v.unnamed_addr = bool(flags & GF_UNNAMED_ADDR)
+            v.is_declaration = bool(flags & GF_DECLARATION)
+            if alignment >= 0:
+                v.alignment = alignment
+            v.initializer, pos = decode_operand_at(data, pos + 5, strings)
+            mod.add_global(v)
+        return mod
+
+    def iter_functions(self):
+        "Yield functions one by one, as they are read and added to module."
+        while True:
+            tag, strings, data = self.read_record()
+            if tag == REC_END:
+                return
+            assert tag == REC_FUNCTION, "Function record expected"
+            name, type, source_hash, flags, nargs = data[:5]
+            pos = 5
+            args = []
+            for i in xrange(nargs):
+                a, pos = decode_operand_at(data, pos, strings)
+                args.append(a)
+            func = PFunction(strings[name], intern_type(strings[type]), args)
+            func.is_declaration = bool(flags & FF_DECLARATION)
+            func.does_not_throw = bool(flags & FF_NOUNWIND)
+            func.readonly = bool(flags & FF_READONLY)
+            func.vararg = bool(flags & FF_VARARG)
+            func.source_hash = strings[source_hash]
+            func.parent = self.mod
+            with gc_disabled():
+                decode_body(func, strings, data, pos)
+            self.mod.append(func)
+            yield func
+
+    def read_module(self):
+        mod = self.read_module_header()
+        for func in self.iter_functions():
+            pass
+        return mod
+
+
+def dump(mod, f):
+    "Write module to a file in binary format."
+    w = BinaryWriter(f)
+    w.write_module_header(mod)
+    for func in mod:
+        w.write_function(func)
+    w.close()
+
+
+def load(f):
+    "Read module in binary format from a file."
+    return BinaryReader(f).read_module()
+
+
+if __name__ == "__main__":
+    # Convert IR text to binary format
+    from parse import IRParser
+    with open(sys.argv[1]) as f:
+        mod = IRParser(f).parse()
+    with open(sys.argv[2], "wb") as f:
+        dump(mod, f)
@@ -0,0 +1,70 @@
+from pllvm import *
+
+
+def make_block(n):
+    b = PBasicBlock(None, "b")
+    for x in xrange(n):
+        b.append(PInstruction("v%d" % x, "i32", "add", []))
+    return b
+
+def names(b):
+    return [i.name for i in b]
+
+def check_order(b):
+    l = list(b)
+    assert [i.order for i in l] == sorted(set(i.order for i in l))
+    assert list(reversed(b)) == l[::-1]
+    assert len(b) == len(l)
+
+def test_edit():
+    b = make_block(3)
+    v0, v1, v2 = b.instructions()
+    b.insert(1, PInstruction("x", "i32", "mov", []))
+    b.insert_after(v2, PInstruction("y", "i32", "mov", []))
+    b.insert(0, PInstruction("z", "i32", "mov", []))
+    assert names(b) == ["z", "v0", "x", "v1", "v2", "y"]
+    assert b[-1].name == "y" and b[2].name == "x" and b["v1"] is v1
+    check_order(b)
+    # Removing current instruction while iterating
+    for i in b:
+        if i.name[0] != "v":
+            b.remove(i)
+    assert names(b) == ["v0", "v1", "v2"]
+    assert b.first is v0 and b.last is v2 and v0.prev is None
+    assert b.index(v2) == 2
+    check_order(b)
+
+def test_renumber():
+    b = make_block(3)
+    v0, v1, v2 = b.instructions()
+    # Fill the gap between orders, until following ones must be renumbered
+    for x in xrange(10):
+        b.insert_before(v1, PInstruction("x%d" % x, "i32", "mov", []))
+    check_order(b)
+    assert v0.order < v1.order < v2.order
+    assert len(b) == 13
+
+def test_symbols():
+    mod = PModule()
+    f = PFunction("f", "i32 ()*", [])
+    mod.append(f)
+    for name in ("entry", "exit"):
+        b = PBasicBlock(f, name)
+        f.append(b)
+        for x in xrange(3):
+            b.append(PInstruction("%s%d" % (name, x), "i32", "add", []))
+    assert mod["f"] is f and mod["g"] is None
+    assert f["exit"] is f[1] and f.instruction("exit1") is f[1][1]
+    assert f["exit"]["exit2"] is f[1][2] and f["entry"]["exit2"] is None
+    # Renames, removals and direct list edits are picked up
+    f[0].name = "start"
+    f[1][1].name = "renamed"
+    f[1].remove(f[1][0])
+    assert f["start"] is f[0] and f["entry"] is None
+    assert f.instruction("renamed") is f[1][0] and f.instruction("exit1") is None
+    assert f.instruction("exit0") is None
+    g = PFunction("f", "i32 ()*", [])
+    mod.functions[0] = g
+    assert mod["f"] is g
+    f.remove(f[0])
+    assert f.instruction("entry0") is None and f.index(f["exit"]) == 0
@@ -0,0 +1,54 @@
+import os
+from cStringIO import StringIO
+
+from pllvm import *
+from parse import *
+from cfg import *
+
+
+datadir = os.path.dirname(__file__) + "/data/"
+
+def names(blocks):
+    return [b.name for b in blocks]
+
+def test_strlen():
+    func = IRParser(open(datadir + "strlen.ll")).parse()[0]
+    cfg = get_cfg(func)
+    entry, loop, exit = func
+    assert cfg.entry is entry and cfg.exits == [exit]
+    # Like in PInstruction.succ(), false branch goes first
+    assert cfg.successors(entry) == [loop, exit]
+    assert cfg.successors(loop) == [loop, exit]
+    assert cfg.predecessors(loop) == [entry, loop]
+    assert cfg.predecessors(exit) == [entry, loop]
+    assert len(cfg.edges()) == len(cfg.reverse_edges()) == 4
+    assert names(cfg.reverse_postorder()) == ["0", ".lr.ph", "._crit_edge"]
+    assert names(cfg.postorder()) == ["._crit_edge", ".lr.ph", "0"]
+    assert get_cfg(func) is cfg
+    # Non-terminator edits don't invalidate it, block changes do
+    loop.remove(loop[0])
+    assert get_cfg(func) is cfg
+    func.append(PBasicBlock(func, "new"))
+    assert get_cfg(func) is not cfg
+
+def test_fallthrough():
+    func = IRParser(open(datadir + "appel-2ed-p204-llvm-br.ll")).parse()[0]
+    cfg = get_cfg(func)
+    entry, l1, b2 = func
+    assert cfg.successors(entry) == [l1]
+    assert cfg.predecessors(l1) == [entry, l1]
+    b2.remove(b2.last)
+    cfg2 = get_cfg(func)
+    assert cfg2 is not cfg and cfg2.exits == [b2]
+
+def test_retarget():
+    func = IRParser(open(datadir + "strlen.ll")).parse()[0]
+    cfg = get_cfg(func)
+    entry, loop, exit = func
+    br = loop.last
+    n = [k for k, op in enumerate(br.operands) if isinstance(op, PLabelRef) and op.name == loop.name][0]
+    br.set_operand(n, PLabelRef(exit.name))
+    cfg2 = get_cfg(func)
+    assert cfg2 is not cfg
+    assert cfg2.successors(loop) == [exit]
+    assert cfg2.predecessors(loop) == [entry]
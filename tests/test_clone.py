@@ -0,0 +1,113 @@
+import os
+from cStringIO import StringIO
+
+from pllvm import *
+from parse import *
+from phi_resolver import PhiResolver
+from reg_alloc import RegAlloc
+
+
+datadir = os.path.dirname(__file__) + "/data/"
+
+def render(func):
+    mod = PModule()
+    mod.append(func)
+    out = StringIO()
+    IRRenderer.render(mod, out)
+    return out.getvalue()
+
+def test_clone():
+    mod = IRParser(open(datadir + "strlen.ll")).parse()
+    func = mod[0]
+    ref = render(func)
+    c = func.clone()
+    assert [b for b in c] == [b for b in func]
+    # Only modified blocks get copied
+    b = c.writable(c[1])
+    assert b is not func[1] and c[1] is b and c[0] is func[0]
+    assert c.writable(b) is b
+    b.remove(b.first)
+    assert render(func) == ref
+    assert c[".lr.ph"] is b and c.instruction(".02") is None
+    # Modifying the original doesn't affect the clone either
+    ref_c = render(c)
+    PhiResolver.convert(mod)
+    assert render(c) == ref_c
+    assert render(func) != ref
+
+def test_values():
+    func = IRParser(open(datadir + "appel-2ed-p221.ll")).parse()[0]
+    ref = render(func)
+    c = func.clone()
+    g, h = c.values["g"], c.values["h"]
+    c.replace_uses(h, g)
+    assert render(func) == ref
+    assert func.values["f"].definition.operands[1] is h
+    assert c.instruction("f").operands == [g, g]
+    assert c.users(h) == [] and len(func.users(h)) == 1
+    # Value copy replaces it in all uses of the clone
+    k = c.writable_value(c.values["k"])
+    k.name = "K"
+    assert "%K" in render(c) and "%K" not in render(func)
+
+def test_snapshot():
+    func = IRParser(open(datadir + "strlen.ll.nossa")).parse()[0]
+    ref = render(func)
+    snap = func.snapshot()
+    results = {}
+    for K in (4, 8):
+        ra = RegAlloc(func, K)
+        ra.alloc()
+        ra.rewrite_regs()
+        results[K] = render(func)
+        assert results[K] != ref
+        func.rollback(snap)
+        assert render(func) == ref
+    # Same result as without snapshots
+    ra = RegAlloc(func, 8)
+    ra.alloc()
+    ra.rewrite_regs()
+    assert render(func) == results[8]
+
+def check_users(func):
+    # Users are exactly live instructions, of func and its snapshot
+    for v in func.values.values():
+        uses = [i for i in func.iter_insts() for u in i.used_values() if u.users is v.users]
+        assert sorted(v.users) == sorted(uses), v
+
+def test_rollback_users():
+    mod = IRParser(open(datadir + "strlen.ll")).parse()
+    func = mod[0]
+    counts = dict((name, len(v.users)) for name, v in func.values.items())
+    snap = func.snapshot()
+    for n in range(3):
+        PhiResolver.convert(mod)
+        func.rollback(snap)
+        check_users(func)
+        assert dict((name, len(v.users)) for name, v in func.values.items()) == counts
+
+def test_discard():
+    func = IRParser(open(datadir + "appel-2ed-p204.ll")).parse()[0]
+    v = func.values["b"]
+    assert len(v.users) == 2
+    snap = func.snapshot()
+    func.writable(func[1])
+    # Both the copy and the original, kept by the snapshot
+    assert len(v.users) == 4
+    func.rollback(snap)
+    assert len(v.users) == 2
+    c = func.clone()
+    c.writable(c[1])
+    try:
+        replace_all_uses_with(v, PConstantInt(1, "i32"))
+    except AssertionError, e:
+        assert "shared with clones" in str(e)
+    else:
+        assert False, "Changed block shared with clones"
+    c.discard()
+    snap.discard()
+    assert len(v.users) == 2 and not func[1].shared
+    # All other uses are gone, so definition can be erased
+    replace_all_uses_with(v, PConstantInt(1, "i32"))
+    v.definition.erase()
+    check_users(func)
@@ -0,0 +1,123 @@
+import os
+from cStringIO import StringIO
+
+from pllvm import *
+from parse import *
+from columnar import *
+from cfg import get_cfg
+from liveness import Liveness
+import bench
+
+
+datadir = os.path.dirname(__file__) + "/data/"
+
+def render(mod):
+    out = StringIO()
+    IRRenderer.render(mod, out)
+    return out.getvalue()
+
+def test_views():
+    for text in (open(datadir + "strlen.ll").read(), bench.synth_module(2, 5, 3)):
+        mod = IRParser(StringIO(text)).parse()
+        ref = render(mod)
+        pack_module(mod)
+        func = mod.functions[-1]
+        assert isinstance(func, ColumnarFunction)
+        assert mod[func.name] is func
+        assert not func[0].materialized()
+        assert render(mod) == ref
+        assert func[0].materialized()
+        # Uses of a value still share the canonical object
+        for i in func.iter_insts():
+            for op in i.operands:
+                if isinstance(op, PTmpVariable):
+                    assert func.values[op.name] is op
+                    assert op.definition.name == op.name
+
+def test_columns():
+    text = open(datadir + "appel-2ed-p204-llvm-br.ll").read()
+    func = IRParser(StringIO(text)).parse()[0]
+    insts = list(func.iter_insts())
+    ref_succ = [[insts.index(s) for s in i.succ()] for i in insts]
+    func = ColumnarFunction.from_function(func)
+    assert len(func.opcodes) == len(insts)
+    start, index = func.succ_rows()
+    for n, i in enumerate(func.iter_insts()):
+        assert func.opcodes[n] == i.opcode.id
+        assert [func.table[x].name for x in func.defs(n)] == sorted(i.defs())
+        assert set(func.table[x].name for x in func.uses(n)) == i.uses()
+        assert list(index[start[n]:start[n + 1]]) == ref_succ[n]
+
+def test_pack():
+    text = open(datadir + "appel-2ed-p204.ll").read()
+    mod = IRParser(StringIO(text)).parse()
+    pack_module(mod)
+    func = mod[0]
+    # Modify via views and write changes back
+    b = func[1]
+    i = b[0]
+    b.insert(0, PInstruction("x", i.type, "add", [i.operands[0], PConstantInt(1, i.type)]))
+    i.comment = " ; changed"
+    ref = render(mod)
+    n = len(func.opcodes)
+    func.pack()
+    assert len(func.opcodes) == n + 1
+    assert not func[1].materialized()
+    assert render(mod) == ref
+
+def test_cfg():
+    # CFG cached before packing is of the replaced blocks
+    text = open(datadir + "appel-2ed-p204-llvm-br.ll").read()
+    mod = IRParser(StringIO(text)).parse()
+    ref = Liveness(mod[0])
+    pack_module(mod)
+    func = mod[0]
+    for n in xrange(2):
+        cfg = get_cfg(func)
+        assert cfg.blocks == func.bblocks
+        l = Liveness(func)
+        for i, ref_i in zip(func.iter_insts(), ref.func.iter_insts()):
+            assert l.live_out(i) == ref.live_out(ref_i)
+        func.pack()
+
+def test_users():
+    # Def-use chains are complete for code relying on them, though
+    # views are made on demand
+    text = open(datadir + "strlen.ll").read()
+    ref = IRParser(StringIO(text)).parse()[0]
+    mod = IRParser(StringIO(text)).parse()
+    pack_module(mod)
+    func = mod[0]
+    v = func.values["4"]
+    assert len(func.users(v)) == len(ref.values["4"].users)
+    func.pack()
+    # %4 is defined and used in block 1, also used in block 2
+    func[0].first
+    assert not func[1].materialized()
+    replace_all_uses_with(func.values["4"], PConstantInt(7, get_type("i32")))
+    text = render(mod)
+    assert text.count("%4") == 1 and "[ 7, %.lr.ph ]" in text
+    func.instruction("4").erase()
+    for name, v in func.values.items():
+        assert len(v.users) == len([i for i in func.iter_insts() if name in i.uses()
+                                    or any(u is v for u, l in i.incoming_vars or ())]), name
+
+def test_erase():
+    text = """\
+define i32 @f(i32 %x) {
+  %a = add i32 %x, 1
+  br label %b
+
+b:
+  ret i32 %a
+}
+"""
+    mod = IRParser(StringIO(text)).parse()
+    pack_module(mod)
+    func = mod[0]
+    try:
+        func[0].first.erase()
+    except AssertionError, e:
+        assert "still has users" in str(e)
+    else:
+        assert False, "erase() of value used by block not materialized didn't fail"
@@ -0,0 +1,132 @@
+import os
+from cStringIO import StringIO
+
+try:
+    import numpy
+except ImportError:
+    from nose.exc import SkipTest
+    raise SkipTest("NumPy is not available")
+
+from parse import *
+from liveness import *
+from dataflow import *
+from columnar import ColumnarFunction
+from cfg import get_cfg
+import bench
+
+
+datadir = os.path.dirname(__file__) + "/data/"
+
+def test_pack():
+    rows = [[], [0, 5, 63], [1, 64, 130], range(0, 200, 7)]
+    assert unpack(pack(rows, 200)) == rows
+    ints = [0, 1, 1 << 64 | 3, (1 << 200) - 1]
+    m = pack_ints(ints, 200)
+    assert unpack_ints(m) == ints
+    assert unpack(m)[2] == [0, 1, 64]
+    assert unpack(ones(130)[None])[0] == range(130)
+
+def test_liveness():
+    for fname in ("appel-2ed-p204.ll", "appel-2ed-p204-llvm-br.ll", "appel-2ed-p221.ll",
+                  "strlen.ll", "strlen.ll.nossa", "func-if.ll"):
+        mod = IRParser(open(datadir + fname)).parse()
+        for f in mod:
+            if f.is_declaration:
+                continue
+            ref = Liveness(f)
+            for cls in (Liveness, BitLiveness):
+                l = cls(f, backend="numpy")
+                assert l.live_out_map() == ref.live_out_map(), fname
+                for b in f:
+                    assert l.live_in_block(b) == ref.live_in_block(b)
+                    assert l.live_out_block(b) == ref.live_out_block(b)
+
+def test_columnar():
+    # Gen/kill and edges made from columns give the same results
+    for fname in ("appel-2ed-p204.ll", "appel-2ed-p204-llvm-br.ll", "appel-2ed-p221.ll",
+                  "strlen.ll", "strlen.ll.nossa", "func-if.ll"):
+        text = open(datadir + fname).read()
+        ref = Liveness(IRParser(StringIO(text)).parse()[0])
+        f = ColumnarFunction.from_function(IRParser(StringIO(text)).parse()[0])
+        for cls in (Liveness, BitLiveness):
+            l = cls(f, backend="numpy")
+            for b, ref_b in zip(f, ref.func):
+                assert l.live_in_block(b) == ref.live_in_block(ref_b), fname
+                assert l.live_out_block(b) == ref.live_out_block(ref_b), fname
+                assert not b.materialized()
+        for b, ref_b in zip(f, ref.func):
+            for i, ref_i in zip(b, ref_b):
+                assert l.live_out(i) == ref.live_out(ref_i), fname
+
+def test_columnar_edges():
+    text = bench.synth_tree(4) + """
+define i32 @g(i32 %x) {
+  br label %a
+
+a:
+  %y = add i32 %x, 1
+  ret i32 %y
+  %z = add i32 %y, 1
+
+b:
+
+c:
+  ret i32 %z
+}
+"""
+    for f in IRParser(StringIO(text)).parse():
+        cfg = get_cfg(f)
+        ref = Liveness(f)
+        f = ColumnarFunction.from_function(f)
+        start, index = columnar_successors(f)
+        n = len(f.bblocks)
+        for k, b in enumerate(cfg.blocks):
+            succ = [cfg.blocks.index(s) for s in cfg.successors(b)]
+            end = start[k + 1] if k + 1 < n else len(index)
+            assert (sorted(succ) or [n]) == list(index[start[k]:end])
+        l = BitLiveness(f, backend="numpy")
+        for b, ref_b in zip(f, cfg.blocks):
+            assert l.live_in_block(b) == ref.live_in_block(ref_b)
+            assert l.live_out_block(b) == ref.live_out_block(ref_b)
+
+def test_reaching():
+    f = IRParser(open(datadir + "appel-2ed-p204-llvm-br.ll")).parse()["func"]
+    entry, loop, exit = f
+    a0 = entry.first
+    b, c, a1, btmp = list(loop)[:4]
+    reach = reaching_definitions(f)
+    assert reach[entry] == set()
+    assert reach[loop] == set([a0, b, c, a1, btmp])
+    assert reach[exit] == set([b, c, a1, btmp])
+
+def test_available():
+    text = """define i32 @f(i32 %x, i32 %y) {
+entry:
+  %a = add i32 %x, %y
+  %e = sub i32 %y, 1
+  %c = icmp eq i32 %x, 0
+  br i1 %c, label %l, label %r
+
+l:
+  %b = add i32 %x, %y
+  %x = mov i32 1
+  br label %m
+
+r:
+  %d = mul i32 %x, %y
+  br label %m
+
+m:
+  ret i32 %a
+}
+"""
+    f = IRParser(StringIO(text)).parse()[0]
+    entry, l, r, m = f
+    add = ("add", None, "i32", ("%x", "%y"))
+    sub = ("sub", None, "i32", ("%y", "1"))
+    icmp = ("icmp", "eq", "i32", ("%x", "0"))
+    avail = available_expressions(f)
+    assert avail[entry] == set()
+    assert avail[l] == avail[r] == set([add, sub, icmp])
+    # Redefinition of %x in one of predecessors kills expressions using it
+    assert avail[m] == set([sub])
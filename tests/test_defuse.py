@@ -0,0 +1,83 @@
+import os
+from cStringIO import StringIO
+
+from pllvm import *
+from parse import *
+from phi_resolver import PhiResolver
+import serialize
+
+
+datadir = os.path.dirname(__file__) + "/data/"
+
+def check_chains(func):
+    users = {}
+    for i in func.iter_insts():
+        for v in i.used_values():
+            users.setdefault(id(v.users), []).append(i)
+    for v in func.values.values():
+        assert sorted(v.users) == sorted(users.get(id(v.users), [])), v
+
+def test_chains():
+    text = open(datadir + "strlen.ll").read()
+    mod = IRParser(StringIO(text)).parse()
+    out = StringIO()
+    serialize.dump(mod, out)
+    for mod in (mod, serialize.load(StringIO(out.getvalue()))):
+        func = mod[0]
+        check_chains(func)
+        v = func.values["4"]
+        assert v.definition.opcode_name == "add"
+        assert sorted(i.opcode_name for i in v.users) == ["phi", "phi"]
+        # nocapture use of %p is separate object, but the same value
+        assert func.values["p"].users
+        PhiResolver.convert(mod)
+        check_chains(func)
+
+def test_rauw():
+    mod = IRParser(open(datadir + "appel-2ed-p221.ll")).parse()
+    func = mod[0]
+    g, h = func.values["g"], func.values["h"]
+    f = func.values["f"]
+    assert f.definition.operands == [g, h]
+    replace_all_uses_with(h, g)
+    assert f.definition.operands == [g, g] and not h.users
+    assert g.users.count(f.definition) == 2
+    h.definition.erase()
+    assert h.definition is None and func.instruction("h") is None
+    f.definition.set_operand(1, PConstantInt(3, "i32"))
+    assert g.users.count(f.definition) == 1
+    check_chains(func)
+    try:
+        g.definition.erase()
+    except AssertionError, e:
+        assert "still has users" in str(e)
+    else:
+        assert False, "Erased defining instruction of a used value"
+
+def test_operand_edits():
+    # Direct edits of operand lists keep chains too
+    mod = IRParser(open(datadir + "strlen.ll")).parse()
+    func = mod[0]
+    v1, v4, p = func.values["1"], func.values["4"], func.values["p"]
+    icmp = func.instruction("2")
+    add = func.instruction("4")
+    phi = func.instruction("l.01")
+    icmp.operands[0] = v4
+    assert icmp not in v1.users and icmp in v4.users
+    add.operands.append(v1)
+    add.operands[1:] = [v1, v1]
+    assert v1.users.count(add) == 2
+    add.operands.pop()
+    add.operands = [func.values["l.01"], PConstantInt(1, add.type)]
+    assert add not in v1.users
+    phi.incoming_vars[0] = (v1, ".lr.ph")
+    assert phi in v1.users and phi not in v4.users
+    del phi.incoming_vars
+    assert phi not in v1.users
+    phi.incoming_vars = [(v4, ".lr.ph"), (PConstantInt(0, phi.type), "0")]
+    # Not in a block, so not a use
+    i = PInstruction("x", add.type, "add", [v4, v4])
+    i.operands[0] = v1
+    assert i not in v1.users and i not in v4.users
+    check_chains(func)
+    assert len(v4.users) == 3
@@ -0,0 +1,43 @@
+from lexer import *
+
+
+def texts(toks):
+    return [t for w, t in toks]
+
+def kinds(toks):
+    return [kind(t) for w, t in toks]
+
+
+def test_inst():
+    toks = tokenize("  %1 = load i8* %p, align 1, !tbaa !0")
+    assert texts(toks) == ["%1", "=", "load", "i8", "*", "%p", ",", "align", "1", ",", "!tbaa", "!0"], toks
+    assert kinds(toks) == [LOCAL, PUNCT, IDENT, TYPE, PUNCT, LOCAL, PUNCT, IDENT, INT, PUNCT, METADATA, METADATA], toks
+
+def test_comment():
+    toks = tokenize(".lr.ph:                ; preds = %0, %.lr.ph")
+    assert kinds(toks) == [LABEL, COMMENT], toks
+    assert "".join(toks[1]) == "                ; preds = %0, %.lr.ph"
+
+def test_strings():
+    toks = tokenize('@.str = private constant [4 x i8] c"a;b\\00", align 1')
+    assert toks[0] == ("", "@.str")
+    assert (" ", 'c"a;b\\00"') in toks
+    assert COMMENT not in kinds(toks)
+    toks = tokenize('!0 = metadata !{metadata !"omnipotent char", metadata !1}')
+    assert texts(toks)[3:6] == ["!", "{", "metadata"], toks
+    assert toks[6] == (" ", '!"omnipotent char"'), toks
+
+def test_source():
+    s = "xxx\n  ret   i32 %c\nyyy"
+    toks = tokenize(s, 4, 18)
+    assert texts(toks) == ["ret", "i32", "%c"]
+    assert source(toks) == "ret   i32 %c"
+
+def test_split():
+    toks = tokenize("[ %3, %.lr.ph ], [ 0, %0 ]")
+    groups = split(toks)
+    assert len(groups) == 2
+    assert texts(split(groups[0][1:-1])[1]) == ["%.lr.ph"]
+    toks = tokenize("i32 (i8*, ...)* @printf, i32 1")
+    assert skip_brackets(toks, 1) == 7
+    assert len(split(toks)) == 2
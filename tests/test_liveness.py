@@ -59,3 +59,36 @@ def test_clang_strlen():
     pprint(live_ranges)
     l.back_annotate()
     IRRenderer.render(mod)
+
+
+def test_block_solver():
+    # Block-level solver gives the same results as instruction-level one
+    for fname in ("appel-2ed-p204.ll", "appel-2ed-p204-llvm-br.ll", "appel-2ed-p221.ll",
+                  "strlen.ll", "strlen.ll.nossa", "func-if.ll"):
+        mod = IRParser(open(datadir + fname)).parse()
+        for f in mod:
+            if f.is_declaration:
+                continue
+            ref = InstLiveness(f).live_out_map()
+            l = Liveness(f)
+            for inst in f.iter_insts():
+                assert l.live_out(inst) == ref[inst], "%s: [%s] %s vs %s" % (fname, inst, l.live_out(inst), ref[inst])
+            assert l.live_out_map() == ref
+
+
+def test_bits():
+    for fname in ("appel-2ed-p204-llvm-br.ll", "strlen.ll", "strlen.ll.nossa", "func-if.ll"):
+        mod = IRParser(open(datadir + fname)).parse()
+        for f in mod:
+            if f.is_declaration:
+                continue
+            ref = Liveness(f)
+            l = BitLiveness(f)
+            assert l.live_out_map() == ref.live_out_map()
+            for inst in f.iter_insts():
+                assert l.live_out(inst) == ref.live_out(inst)
+                for name in ref.live_out(inst):
+                    assert l.is_live_out(inst, name)
+                assert not l.is_live_out(inst, "no-such-var")
+            for b in f:
+                assert l.live_in_block(b) == ref.live_in_block(b)
@@ -0,0 +1,43 @@
+from cStringIO import StringIO
+
+from pllvm import *
+from parse import IRParser
+
+
+def test_registry():
+    op = get_opcode("br")
+    assert OPCODES[op.id] is op
+    assert op.terminator and not op.result
+    assert get_opcode("add").typing == TYPE_COMMON
+    assert get_opcode("load").typing == TYPE_EACH
+    # Unknown opcodes get registered with defaults
+    op = get_opcode("frobnicate")
+    assert get_opcode("frobnicate") is op
+    assert not op.terminator
+
+def test_dispatch():
+    text = """\
+define i32 @f(i32 %a) {
+entry:
+  bricmp lt i32 %a, 10, label %l1, label %l2
+
+l1:
+  %b = mov i32 %a
+  ret i32 %b
+
+l2:
+  ret i32 0
+}
+"""
+    mod = IRParser(StringIO(text)).parse()
+    func = mod[0]
+    br = func[0][0]
+    assert br.opcode is get_opcode("bricmp")
+    # Operands are stored in [a, b, false, true] order
+    assert br.operands[2].name == "l2"
+    assert br.succ() == [func["l2"][0], func["l1"][0]]
+    assert func["l1"][0].succ() == [func["l1"][1]]
+    assert func["l1"][1].succ() == []
+    out = StringIO()
+    IRRenderer.render(mod, out)
+    assert out.getvalue() == text
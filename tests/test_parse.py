@@ -1,4 +1,5 @@
 import os
+import tempfile
 from cStringIO import StringIO
 import difflib
 
@@ -40,3 +41,130 @@ def test_strlen():
     new = out.getvalue().splitlines(True)
     diff = "".join(difflib.unified_diff(org, new))
     assert diff == "", "Parse roundtrip mismatch:\n" + diff
+
+def test_lazy():
+    f = "strlen.ll"
+    p = IRParser(open(datadir + f))
+    mod = p.parse(lazy=True)
+    func = mod["_strlen"]
+    assert func.args[0].name == "p"
+    assert not func.body_loaded()
+    assert func[0][0].opcode_name == "load"
+    assert func.body_loaded()
+    out = StringIO()
+    IRRenderer.render(mod, out, implicit_labels=False)
+    assert out.getvalue() == open(datadir + f).read()
+
+def test_mmap():
+    for f in ("strlen.ll", "appel-2ed-p221.ll"):
+        org = open(datadir + f).read()
+        for lazy in (False, True):
+            p = IRParser(open(datadir + f), use_mmap=True)
+            mod = p.parse(lazy=lazy)
+            out = StringIO()
+            IRRenderer.render(mod, out, implicit_labels=False)
+            assert out.getvalue() == org, "lazy=%s:\n%s" % (lazy, out.getvalue())
+
+def test_parallel():
+    # Make module with several functions
+    text = open(datadir + "appel-2ed-p221.ll").read()
+    for i in xrange(4):
+        text += open(datadir + "appel-2ed-p204.ll").read().replace("@func", "@func%d" % i)
+    fname = tempfile.mktemp(".ll")
+    open(fname, "w").write(text)
+    try:
+        mod = parse_parallel(fname, workers=2)
+    finally:
+        os.remove(fname)
+    out = StringIO()
+    IRRenderer.render(mod, out)
+    ref = StringIO()
+    IRRenderer.render(IRParser(StringIO(text)).parse(), ref)
+    assert out.getvalue() == ref.getvalue()
+    assert len(mod.functions) == 5
+    assert mod["func3"][0].parent is mod["func3"]
+
+def test_reparse():
+    base = open(datadir + "appel-2ed-p204.ll").read()
+    funcs = [base.replace("@func", "@func%d" % i) for i in xrange(3)]
+    old_text = "".join(funcs)
+    funcs[1] = funcs[1].replace("add i32", "sub i32")
+    new_text = "".join(funcs[1:]) + base.replace("@func", "@func3")
+    fname = tempfile.mktemp(".ll")
+    open(fname, "w").write(new_text)
+    try:
+        for use_mmap in (False, True):
+            prev = IRParser(StringIO(old_text)).parse()
+            f = open(fname)
+            mod, invalidated = IRParser(f, use_mmap=use_mmap).reparse(prev)
+            assert invalidated == set(["func0", "func1", "func3"]), invalidated
+            assert mod["func2"] is prev["func2"]
+            assert mod["func2"].parent is mod
+            out = StringIO()
+            IRRenderer.render(mod, out)
+            ref = StringIO()
+            IRRenderer.render(IRParser(StringIO(new_text)).parse(), ref)
+            assert out.getvalue() == ref.getvalue()
+            f.close()
+    finally:
+        os.remove(fname)
+
+def test_reparse_lazy():
+    # File edited in place between lazy parse and reparse: bodies not
+    # loaded yet must come from the new file
+    base = open(datadir + "appel-2ed-p204.ll").read()
+    funcs = [base.replace("@func", "@func%d" % i) for i in xrange(3)]
+    fname = tempfile.mktemp(".ll")
+    open(fname, "w").write("".join(funcs))
+    try:
+        for use_mmap in (False, True):
+            f = open(fname)
+            prev = IRParser(f, use_mmap=use_mmap).parse(lazy=True)
+            prev["func0"].bblocks
+            funcs2 = list(funcs)
+            funcs2[1] = funcs2[1].replace("i32 %c", "i32 %c, i32 %b")
+            open(fname, "w").write("".join(funcs2))
+            f2 = open(fname)
+            mod, invalidated = IRParser(f2, use_mmap=use_mmap).reparse(prev)
+            assert invalidated == set(["func1"]), invalidated
+            assert mod["func0"] is prev["func0"]
+            assert mod["func2"] is not prev["func2"]
+            out = StringIO()
+            IRRenderer.render(mod, out)
+            ref = StringIO()
+            IRRenderer.render(IRParser(StringIO("".join(funcs2))).parse(), ref)
+            assert out.getvalue() == ref.getvalue()
+            f.close()
+            f2.close()
+            open(fname, "w").write("".join(funcs))
+    finally:
+        os.remove(fname)
+
+def test_values():
+    mod = IRParser(open(datadir + "appel-2ed-p204.ll")).parse()
+    func = mod[0]
+    uses = {}
+    for i in func.iter_insts():
+        for op in i.operands:
+            if isinstance(op, (PTmpVariable, PArgument)):
+                assert func.values[op.name] is op
+                uses.setdefault(op.name, []).append(op)
+                if isinstance(op, PTmpVariable):
+                    assert op.definition.name == op.name
+    assert max(len(l) for l in uses.values()) > 1
+    assert func.values["c"] is func.args[0]
+    ids = sorted(v.id for v in func.values.values())
+    assert ids == range(len(func.values))
+
+def test_compact():
+    mod = IRParser(open(datadir + "strlen.ll")).parse()
+    for i in mod["_strlen"].iter_insts():
+        assert not hasattr(i, "__dict__")
+        for op in i.operands:
+            assert not hasattr(op, "__dict__")
+    load = mod["_strlen"][0][0]
+    assert load.alignment == 1 and load.predicate is None
+    assert has_extra(load, "alignment") and not has_extra(load, "inbounds")
+    del load.alignment
+    assert load.alignment is None
+    assert mod["_strlen"].args[0].attributes == set([ATTR_NO_CAPTURE])
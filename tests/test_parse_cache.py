@@ -0,0 +1,87 @@
+import os
+import shutil
+import tempfile
+from cStringIO import StringIO
+
+from pllvm import *
+from parse_cache import *
+
+
+datadir = os.path.dirname(__file__) + "/data/"
+
+def render(mod):
+    out = StringIO()
+    IRRenderer.render(mod, out)
+    return out.getvalue()
+
+def test_hit():
+    d = tempfile.mkdtemp()
+    try:
+        cache = ParseCache(d)
+        for f in ("strlen.ll", "appel-2ed-p221.ll"):
+            mod1 = cache.parse(datadir + f)
+            mod2 = cache.parse(datadir + f)
+            assert render(mod1) == render(mod2)
+            func = mod2[0]
+            assert func.parent is mod2
+            assert func[0].parent is func
+            assert func[0][0].parent is func[0]
+        assert cache.misses == 2
+        assert cache.hits == 2
+    finally:
+        shutil.rmtree(d)
+
+def test_evict():
+    d = tempfile.mkdtemp()
+    try:
+        cache = ParseCache(d, max_size=0)
+        cache.parse(datadir + "strlen.ll")
+        assert os.listdir(d) == []
+        cache.max_size = 1 << 20
+        cache.parse(datadir + "strlen.ll")
+        first = os.path.join(d, os.listdir(d)[0])
+        # Make sure first entry is older
+        os.utime(first, (0, 0))
+        cache.parse(datadir + "strlen.ll.nossa")
+        assert len(os.listdir(d)) == 2
+        second = [x for x in os.listdir(d) if os.path.join(d, x) != first][0]
+        cache.max_size = os.path.getsize(os.path.join(d, second))
+        cache.evict()
+        assert len(os.listdir(d)) == 1
+        assert not os.path.exists(first)
+        cache.parse(datadir + "strlen.ll.nossa")
+        assert cache.hits == 1
+    finally:
+        shutil.rmtree(d)
+
+def test_corrupt_entry():
+    d = tempfile.mkdtemp()
+    try:
+        cache = ParseCache(d)
+        mod1 = cache.parse(datadir + "strlen.ll")
+        path = os.path.join(d, os.listdir(d)[0])
+        data = open(path, "rb").read()
+        with open(path, "wb") as f:
+            f.write(data[:len(data) // 2])
+        with open(datadir + "strlen.ll", "rb") as f:
+            assert cache.get(cache.key(f)) is None
+        assert not os.path.exists(path)
+        mod2 = cache.parse(datadir + "strlen.ll")
+        assert render(mod1) == render(mod2)
+        assert cache.misses == 2
+    finally:
+        shutil.rmtree(d)
+
+def test_put_error():
+    d = tempfile.mkdtemp()
+    try:
+        cache = ParseCache(d)
+        try:
+            cache.put("key", object())
+        except AttributeError:
+            pass
+        else:
+            assert False
+        assert os.listdir(d) == []
+    finally:
+        shutil.rmtree(d)
@@ -0,0 +1,73 @@
+import os
+from cStringIO import StringIO
+
+from pllvm import *
+from parse import *
+from phi_resolver import PhiResolver
+from reg_alloc import RegAlloc
+from passes import *
+
+
+datadir = os.path.dirname(__file__) + "/data/"
+
+def parse(name):
+    return IRParser(open(datadir + name)).parse()
+
+def test_pipeline():
+    passes = parse_pipeline("phi-resolve, regalloc(K=8),render(implicit_labels=0)")
+    assert [p.name for p in passes] == ["phi-resolve", "regalloc", "render"]
+    assert passes[1].params == {"K": 8}
+    assert repr(passes[1]) == "regalloc(K=8)"
+    assert passes[2].params == {"implicit_labels": 0}
+
+def test_caching():
+    mod = parse("strlen.ll.nossa")
+    func = mod[0]
+    am = AnalysisManager()
+    live = am.get(func, "liveness")
+    assert am.get(func, "interference") is not None
+    assert am.get(func, "liveness") is live
+    assert am.computed == {"cfg": 1, "liveness": 1, "interference": 1}
+    # Analyses depending on dropped ones are dropped too
+    am.invalidate(func, ["cfg", "interference"])
+    assert am.get(func, "cfg") is not None
+    assert am.get(func, "liveness") is not live
+    assert am.computed == {"cfg": 1, "liveness": 2, "interference": 1}
+    am.get(func, "interference")
+    assert am.computed["interference"] == 2
+    # Control flow change makes all results stale
+    func.append(PBasicBlock(func, "extra"))
+    am.get(func, "interference")
+    assert am.computed == {"cfg": 2, "liveness": 3, "interference": 3}
+
+def test_invalidation():
+    mod = parse("strlen.ll")
+    pm = PassManager("phi-resolve,regalloc(K=8)")
+    pm.run(mod)
+    am = pm.am
+    func = mod[0]
+    # CFG survives both passes, liveness is gone after regalloc
+    assert am.computed["cfg"] == 1
+    assert sorted(am.cache[func].keys()) == ["cfg"]
+
+def test_dominators():
+    mod = parse("strlen.ll")
+    func = mod[0]
+    doms = AnalysisManager().get(func, "dominators")
+    assert doms.idom[func[0]] is None
+    assert doms.idom[func[1]] is func[0] and doms.idom[func[2]] is func[0]
+    assert doms.dominates(func[0], func[2]) and not doms.dominates(func[1], func[2])
+
+def test_render():
+    mod = parse("strlen.ll")
+    PhiResolver.convert(mod)
+    ra = RegAlloc(mod[0], 8)
+    ra.alloc()
+    ra.rewrite_regs()
+    ref = StringIO()
+    IRRenderer.render(mod, ref)
+
+    mod = parse("strlen.ll")
+    out = StringIO()
+    PassManager([PhiResolvePass(), RegAllocPass(K=8), RenderPass(out)]).run(mod)
+    assert out.getvalue() == ref.getvalue()
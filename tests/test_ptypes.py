@@ -0,0 +1,35 @@
+import os
+
+from ptypes import *
+from parse import IRParser
+
+
+datadir = os.path.dirname(__file__) + "/data/"
+
+def test_int():
+    t = get_type("i16")
+    assert isinstance(t, PIntType)
+    assert t == "i16" and str(t) == "i16"
+    assert t.width == 16 and t.size == 2
+    assert get_type("i16") is t
+    assert get_type("i1").size == 1
+
+def test_derived():
+    t = get_type("[4 x i8]*")
+    assert isinstance(t, PPointerType)
+    assert t.pointee.count == 4 and t.pointee.element is get_type("i8")
+    assert t.pointee.size == 4
+    t = get_type("i32 (i8*, ...)*").pointee
+    assert isinstance(t, PFunctionType)
+    assert t.return_type == "i32" and t.args == ["i8*"] and t.vararg
+    assert get_type("{ i8, i32, i16 }").size == 12
+    assert get_type("<{ i8, i32 }>").size == 5
+    assert get_type("%struct.foo").size is None
+
+def test_parser():
+    mod = IRParser(open(datadir + "strlen.ll")).parse()
+    func = mod[0]
+    assert isinstance(func.args[0].type, PPointerType)
+    for i in func.iter_insts():
+        for op in i.operands:
+            assert op.type is get_type(op.type)
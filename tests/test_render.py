@@ -0,0 +1,114 @@
+import os
+import sys
+import pickle
+from cStringIO import StringIO
+
+from pllvm import *
+from parse import *
+from reg_alloc import RegAlloc
+
+
+datadir = os.path.dirname(__file__) + "/data/"
+
+def render(mod):
+    out = StringIO()
+    IRRenderer.render(mod, out)
+    return out.getvalue()
+
+def render_uncached(mod):
+    for f in mod:
+        for i in f.iter_insts():
+            i.dirty()
+    return render(mod)
+
+def test_cache():
+    mod = IRParser(open(datadir + "strlen.ll")).parse()
+    func = mod[0]
+    text = render(mod)
+    i = func.instruction("4")
+    assert i._text is not None and render(mod) == text
+    i.comment = " ; changed"
+    assert i._text is None
+    i.set_operand(1, PConstantInt(2, i.type))
+    func.values["l.01"].name = "len"
+    replace_all_uses_with(func.values["5"], func.values["1"])
+    text = render(mod)
+    assert "add i32 %len, 2 ; changed" in text
+    assert text.count("icmp eq i8 %1, 0") == 2
+    assert text == render_uncached(mod)
+
+def test_regalloc():
+    mod = IRParser(open(datadir + "strlen.ll.nossa")).parse()
+    text = render(mod)
+    ra = RegAlloc(mod[0], 8)
+    ra.alloc()
+    ra.rewrite_regs()
+    assert render(mod) == render_uncached(mod)
+
+def test_functions():
+    text = open(datadir + "appel-2ed-p221.ll").read()
+    mod = IRParser(StringIO(text)).parse()
+    mod2 = IRParser(StringIO(text.replace("@main", "@main2"))).parse()
+    mod.append(mod2[0])
+    stdout = sys.stdout
+    sys.stdout = StringIO()
+    try:
+        out = render(mod)
+        assert sys.stdout.getvalue() == ""
+    finally:
+        sys.stdout = stdout
+    # Definitions are separated by empty line
+    assert "}\n\ndefine" in out
+    assert out.count("define") == 2
+
+def test_parallel():
+    mod = IRParser(open(datadir + "func-if.ll")).parse()
+    for f in ("strlen.ll", "appel-2ed-p221.ll", "appel-2ed-p204.ll"):
+        mod.append(IRParser(open(datadir + f)).parse()[0])
+    # Declaration between definitions, starting some worker's range
+    decl = PFunction("foo", get_type("i32 ()*"), [])
+    decl.is_declaration = True
+    mod.functions.insert(2, decl)
+    for implicit_labels in (True, False):
+        ref = StringIO()
+        IRRenderer.render(mod, ref, implicit_labels)
+        for workers in (2, 3, 8):
+            out = StringIO()
+            IRRenderer.render_parallel(mod, out, implicit_labels, workers)
+            assert out.getvalue() == ref.getvalue(), workers
+
+def test_cache_invalidation():
+    # Edits which don't go through instruction's own attributes
+    mod = IRParser(open(datadir + "strlen.ll")).parse()
+    func = mod[0]
+    render(mod)
+    load = func.instruction("1")
+    del load.alignment
+    br = func[0].last
+    br.operands[1].name = "done"
+    add = func.instruction("4")
+    add.operands[1].value = 7
+    phi = func.instruction("l.01")
+    phi.incoming_vars[1] = (PConstantInt(3, phi.type), "0")
+    icmp = func.instruction("2")
+    icmp.operands[1] = PConstantInt(9, icmp.operands[1].type)
+    text = render(mod)
+    assert "load i8* %p, !tbaa !0" in text
+    assert "label %done" in text
+    assert "add i32 %l.01, 7" in text
+    assert "[ 3, %0 ]" in text
+    assert "icmp eq i8 %1, 9" in text
+    assert text == render_uncached(mod)
+
+def test_cache_identity():
+    # Caching text keeps instructions plain, picklable PInstructions
+    mod = IRParser(open(datadir + "strlen.ll")).parse()
+    text = render(mod)
+    for i in mod[0].iter_insts():
+        assert type(i) is PInstruction
+    mod2 = pickle.loads(pickle.dumps(mod, 2))
+    assert render(mod2) == text
+    i = mod2[0].instruction("4")
+    i.operands[1].value = 2
+    i.operands.append(i.operands.pop())
+    assert "add i32 %l.01, 2" in render(mod2)
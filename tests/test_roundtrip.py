@@ -1,4 +1,5 @@
 import os
+from cStringIO import StringIO
 
 try:
     import llvm.core
@@ -16,3 +17,44 @@ def test_func_if():
     os.system("./llvm2py.py %s/%s >%s/out/%s" % (datadir, f, datadir, f))
     rc = os.system("diff -u %s/%s %s/out/%s" % (datadir, f, datadir, f))
     assert rc == 0, "Roundtrip failed"
+
+def test_fast_convert():
+    # Fast and text-based conversion modes should give the same result
+    for f in ("strlen.ll", "func-if.ll"):
+        res = []
+        for fast in (False, True):
+            with open("%s/%s" % (datadir, f)) as asm:
+                mod = Module.from_assembly(asm)
+            out = StringIO()
+            pllvm.IRRenderer.render(IRConverter.convert(mod, fast=fast), out)
+            res.append(out.getvalue())
+        assert res[0] == res[1], f
+
+class Text(object):
+    "Stands for llvmpy object which doesn't expose a property."
+    def __init__(self, text):
+        self.text = text
+
+    def __str__(self):
+        return self.text
+
+def test_keywords():
+    # Fallbacks of fast mode find keywords, not names containing them
+    assert is_inbounds(Text("  %3 = getelementptr inbounds i8* %.02, i32 1"))
+    assert not is_inbounds(Text("  %inbounds.ptr = getelementptr i8* %inbounds, i32 1"))
+    assert has_unnamed_addr(Text('@.str = private unnamed_addr constant [4 x i8] c"foo\\00"'))
+    assert not has_unnamed_addr(Text("@unnamed_addr_tbl = global i32 0"))
+    assert not has_unnamed_addr(Text("@p = global i32* @unnamed_addr"))
+
+def test_lazy_convert():
+    f = "strlen.ll"
+    res = []
+    for lazy in (False, True):
+        with open("%s/%s" % (datadir, f)) as asm:
+            mod = IRConverter.convert(Module.from_assembly(asm), lazy=lazy)
+        assert mod[0].body_loaded() != lazy
+        out = StringIO()
+        pllvm.IRRenderer.render(mod, out)
+        assert mod[0].body_loaded()
+        res.append(out.getvalue())
+    assert res[0] == res[1]
@@ -0,0 +1,115 @@
+import os
+from cStringIO import StringIO
+
+from pllvm import *
+from parse import IRParser
+import serialize
+
+
+datadir = os.path.dirname(__file__) + "/data/"
+
+def render(mod):
+    out = StringIO()
+    IRRenderer.render(mod, out)
+    return out.getvalue()
+
+def roundtrip(mod):
+    out = StringIO()
+    serialize.dump(mod, out)
+    return serialize.load(StringIO(out.getvalue()))
+
+def test_roundtrip():
+    for f in ("strlen.ll", "appel-2ed-p221.ll", "func-if.ll"):
+        mod = IRParser(open(datadir + f)).parse()
+        mod2 = roundtrip(mod)
+        assert render(mod2) == render(mod), f
+        assert mod2[0].parent is mod2
+        assert mod2[0].source_hash == mod[0].source_hash
+        assert mod2[0][0][0].parent is mod2[0][0]
+
+def test_values():
+    text = """\
+define i64 @f(i8* nocapture %p) nounwind {
+  %1 = add i64 5000000000, 70000
+  %2 = frob i64 %1, %1
+  ret i64 %2
+}
+"""
+    mod = IRParser(StringIO(text)).parse()
+    mod2 = roundtrip(mod)
+    assert render(mod2) == render(mod)
+    assert mod2[0].args[0].attributes == set([ATTR_NO_CAPTURE])
+    insts = mod2[0][0].instructions()
+    assert insts[0].operands[0].value == 5000000000
+    assert insts[1].opcode_name == "frob"
+    # Uses of a value share the object, linked to its definition
+    assert insts[1].operands[0] is insts[1].operands[1] is mod2[0].values["1"]
+    assert insts[1].operands[0].definition is insts[0]
+
+def test_stream():
+    mod = IRParser(open(datadir + "strlen.ll")).parse()
+    out = StringIO()
+    serialize.dump(mod, out)
+    r = serialize.BinaryReader(StringIO(out.getvalue()))
+    mod2 = r.read_module_header()
+    assert len(mod2.functions) == 0
+    for f in r.iter_functions():
+        assert f is mod2.functions[-1]
+    assert [f.name for f in mod2] == [f.name for f in mod]
+
+def test_bad_header():
+    for data in ("", "PLLB\xff\x00"):
+        try:
+            serialize.load(StringIO(data))
+            assert False
+        except ValueError:
+            pass
+
+def test_call():
+    # Call target and constant expression operands, as made by IRConverter
+    text = """\
+@.str = private unnamed_addr constant [4 x i8] c"foo\\00", align 1
+
+define i32 @main() nounwind {
+  ret i32 0
+}
+"""
+    mod = IRParser(StringIO(text)).parse()
+    for vararg in (False, True):
+        callee = PFunction("printf", get_type("i32 (i8*, ...)*"), [])
+        callee.is_ref = True
+        callee.vararg = vararg
+        expr = PConstantExpr()
+        expr.type = get_type("i8*")
+        expr.opcode_name = "getelementptr inbounds"
+        expr.operands = [mod.global_ref(".str", get_type("[4 x i8]*")),
+                         PConstantInt(0, get_type("i32")), PConstantInt(0, get_type("i32"))]
+        mod[0][0].insert(0, PInstruction("1", get_type("i32"), "call", [expr, callee]))
+        mod2 = roundtrip(mod)
+        assert render(mod2) == render(mod)
+        callee2 = mod2[0][0][0].operands[-1]
+        assert callee2.is_ref and callee2.vararg == vararg
+        assert isinstance(mod2[0][0][0].operands[0], PConstantExpr)
+        mod[0][0].remove(mod[0][0][0])
+
+def test_external_global():
+    # External global has no initializer, as made by IRConverter
+    mod = IRParser(StringIO("@g = global i32 1\n")).parse()
+    v = PGlobalVariable()
+    v.name = "x"
+    v.linkage = "external"
+    v.type_str = v.type = get_type("i32")
+    v.is_declaration = True
+    mod.add_global(v)
+    mod2 = roundtrip(mod)
+    g, x = mod2.global_variables
+    assert g.initializer.value == 1
+    assert x.name == "x" and x.linkage == "external"
+    assert x.is_declaration and x.initializer is None
+    assert x.type is v.type
+
+def test_opcodes():
+    # Format's own opcode numbering doesn't shadow the opcode registry
+    assert serialize.OPCODES is OPCODES
+    for n, name in enumerate(serialize.OPCODE_NAMES):
+        assert serialize.OPCODE_IDS[name] == n